@@ -93,6 +93,7 @@ CREATE TABLE IF NOT EXISTS running_tasks (
 	status ENUM('PENDING', 'RUNNING', 'COMPLETED', 'FAILED') DEFAULT 'PENDING' NOT NULL,
 	start_time DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
 	end_time DATETIME,
+    INDEX running_tasks_status_user (status, user_id),
     FOREIGN KEY (user_id) REFERENCES users(user_id) ON DELETE CASCADE ON UPDATE CASCADE
 );
 
@@ -180,6 +181,20 @@ CREATE TABLE IF NOT EXISTS results (
   uuid VARCHAR(36) NOT NULL,
   scores JSON NOT NULL,
   finish_time DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  true_positives INT UNSIGNED GENERATED ALWAYS AS (CAST(JSON_EXTRACT(scores, '$.tPos') AS UNSIGNED)) STORED,
+  true_negatives INT UNSIGNED GENERATED ALWAYS AS (CAST(JSON_EXTRACT(scores, '$.tNeg') AS UNSIGNED)) STORED,
+  false_negatives INT UNSIGNED GENERATED ALWAYS AS (CAST(JSON_EXTRACT(scores, '$.fNeg') AS UNSIGNED)) STORED,
+  false_positives INT UNSIGNED GENERATED ALWAYS AS (CAST(JSON_EXTRACT(scores, '$.fPos') AS UNSIGNED)) STORED,
+  accuracy DOUBLE GENERATED ALWAYS AS (CAST(JSON_EXTRACT(scores, '$.accuracy') AS DOUBLE)) STORED,
+  `precision` DOUBLE GENERATED ALWAYS AS (CAST(JSON_EXTRACT(scores, '$.precision') AS DOUBLE)) STORED,
+  recall DOUBLE GENERATED ALWAYS AS (CAST(JSON_EXTRACT(scores, '$.recall') AS DOUBLE)) STORED,
+  fscore DOUBLE GENERATED ALWAYS AS (CAST(JSON_EXTRACT(scores, '$.fscore') AS DOUBLE)) STORED,
+  fscore_ci_low DOUBLE GENERATED ALWAYS AS (CAST(JSON_EXTRACT(scores, '$.ci.fscore[0]') AS DOUBLE)) STORED,
+  fscore_ci_high DOUBLE GENERATED ALWAYS AS (CAST(JSON_EXTRACT(scores, '$.ci.fscore[1]') AS DOUBLE)) STORED,
+  INDEX results_user_finish_time (user_id, finish_time),
+  INDEX results_user_fscore (user_id, fscore),
+  INDEX results_fscore (fscore),
+  INDEX results_accuracy (accuracy),
   CONSTRAINT FOREIGN KEY (user_id) REFERENCES users(user_id) ON DELETE CASCADE ON UPDATE CASCADE
 );
 
@@ -211,6 +226,11 @@ SELECT
     results.user_id,
     users.full_name,
     results.scores,
+    results.finish_time,
+    results.accuracy,
+    results.`precision`,
+    results.recall,
+    results.fscore,
     results_additional_info.prompt
 FROM 
     result_in_competition
@@ -225,26 +245,53 @@ LEFT JOIN
 ON users.user_id = results.user_id;
 
 
-CREATE OR REPLACE VIEW competition_scoreboard_fscore AS
-WITH user_scores AS (
+CREATE TABLE IF NOT EXISTS competition_leaderboard (
+  competition_id BIGINT UNSIGNED NOT NULL,
+  user_id BIGINT UNSIGNED NOT NULL,
+  highest_fscore DECIMAL(10,2) NOT NULL,
+  result_id BIGINT UNSIGNED NOT NULL,
+  updated_at DATETIME NOT NULL DEFAULT (UTC_TIMESTAMP()),
+  PRIMARY KEY (competition_id, user_id),
+  INDEX competition_leaderboard_score (competition_id, highest_fscore DESC, user_id),
+  CONSTRAINT FOREIGN KEY (competition_id) REFERENCES competitions(id) ON DELETE CASCADE ON UPDATE CASCADE,
+  CONSTRAINT FOREIGN KEY (user_id) REFERENCES users(user_id) ON DELETE CASCADE ON UPDATE CASCADE,
+  CONSTRAINT FOREIGN KEY (result_id) REFERENCES results(id) ON DELETE CASCADE ON UPDATE CASCADE
+);
+
+
+-- Fill the leaderboard from results submitted before it existed.
+-- Running this statement again rebuilds the leaderboard from the results (e.g. after manual edits).
+-- It reads results.fscore, so on a database created before that column existed run migrations/001 first.
+INSERT INTO competition_leaderboard (competition_id, user_id, highest_fscore, result_id)
+SELECT competition_id, user_id, highest_fscore, result_id FROM (
     SELECT
-        competition_id,
-        user_id,
-        full_name,
-        MAX(CAST(JSON_UNQUOTE(JSON_EXTRACT(scores, '$.fscore')) AS DECIMAL(10,2))) AS highest_fscore
-    FROM 
-        competition_scoreboard
-    GROUP BY 
-        competition_id, user_id, full_name
-)
+        result_in_competition.competition_id,
+        results.user_id,
+        CAST(results.fscore AS DECIMAL(10,2)) AS highest_fscore,
+        results.id AS result_id,
+        ROW_NUMBER() OVER (
+            PARTITION BY result_in_competition.competition_id, results.user_id
+            ORDER BY results.fscore DESC, results.id ASC
+        ) AS position
+    FROM result_in_competition
+    INNER JOIN results ON results.id = result_in_competition.result_id
+) AS best_results
+WHERE position = 1
+ON DUPLICATE KEY UPDATE highest_fscore = VALUES(highest_fscore), result_id = VALUES(result_id);
+
+
+CREATE OR REPLACE VIEW competition_scoreboard_fscore AS
 SELECT 
-	  competition_id,
-    user_id,
-    full_name,
-    highest_fscore,
-    RANK() OVER (PARTITION BY competition_id ORDER BY highest_fscore DESC) AS ranking
+	  competition_leaderboard.competition_id,
+    competition_leaderboard.user_id,
+    users.full_name,
+    competition_leaderboard.highest_fscore,
+    RANK() OVER (PARTITION BY competition_leaderboard.competition_id ORDER BY competition_leaderboard.highest_fscore DESC) AS ranking
 FROM 
-    user_scores
+    competition_leaderboard
+LEFT JOIN
+	  users
+ON users.user_id = competition_leaderboard.user_id
 ORDER BY 
     ranking;
 
@@ -298,3 +345,63 @@ ON
     AND competition_scoreboard_fscore.user_id = competition_participants.user_id
 ORDER BY 
     competition_scoreboard_fscore.highest_fscore DESC;
+
+
+CREATE TABLE IF NOT EXISTS running_task_checkpoints (
+    task_id BIGINT UNSIGNED NOT NULL,
+    run_args JSON NOT NULL,
+    row_order JSON NOT NULL,
+    rows_completed INT UNSIGNED NOT NULL DEFAULT 0,
+    stats JSON,
+    updated_at DATETIME NOT NULL DEFAULT (UTC_TIMESTAMP()),
+    PRIMARY KEY (task_id),
+    FOREIGN KEY (task_id) REFERENCES running_tasks(process_id) ON DELETE CASCADE ON UPDATE CASCADE
+);
+
+
+CREATE TABLE IF NOT EXISTS task_queue (
+    task_id BIGINT UNSIGNED NOT NULL,
+    run_args JSON NOT NULL,
+    PRIMARY KEY (task_id),
+    FOREIGN KEY (task_id) REFERENCES running_tasks(process_id) ON DELETE CASCADE ON UPDATE CASCADE
+);
+
+
+
+CREATE TABLE IF NOT EXISTS results_rows (
+    task_id BIGINT UNSIGNED NOT NULL,
+    row_id INT UNSIGNED NOT NULL,
+    position INT UNSIGNED NOT NULL,
+    label TINYINT,
+    response VARCHAR(16),
+    confidence_level TINYINT UNSIGNED,
+    truth_level TINYINT UNSIGNED,
+    correct BOOL NOT NULL,
+    explanation TEXT,
+    PRIMARY KEY (task_id, row_id),
+    FOREIGN KEY (task_id) REFERENCES running_tasks(process_id) ON DELETE CASCADE ON UPDATE CASCADE
+);
+
+
+CREATE TABLE IF NOT EXISTS api_key_checks (
+    key_hash CHAR(64) NOT NULL,
+    is_valid BOOL NOT NULL,
+    expires_at DATETIME NOT NULL,
+    PRIMARY KEY (key_hash)
+);
+
+
+CREATE TABLE IF NOT EXISTS email_outbox (
+    id BIGINT UNSIGNED NOT NULL AUTO_INCREMENT,
+    receiver_email VARCHAR(320) NOT NULL,
+    subject VARCHAR(255) NOT NULL,
+    body MEDIUMTEXT NOT NULL,
+    status ENUM('PENDING', 'SENDING', 'SENT', 'FAILED') NOT NULL DEFAULT 'PENDING',
+    attempts INT UNSIGNED NOT NULL DEFAULT 0,
+    last_error TEXT,
+    next_attempt_at DATETIME NOT NULL DEFAULT (UTC_TIMESTAMP()),
+    created_at DATETIME NOT NULL DEFAULT (UTC_TIMESTAMP()),
+    sent_at DATETIME,
+    PRIMARY KEY (id),
+    INDEX email_outbox_status_next_attempt (status, next_attempt_at)
+);
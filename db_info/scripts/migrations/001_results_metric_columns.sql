@@ -0,0 +1,18 @@
+-- Store the metrics in results.scores as typed, indexed columns.
+-- The columns are generated from scores, so existing rows are filled when this runs
+-- and new rows stay in sync without changing the code that inserts results.
+-- Run once on databases created before these columns were added to create.sql.
+
+ALTER TABLE results
+  ADD COLUMN true_positives INT UNSIGNED GENERATED ALWAYS AS (CAST(JSON_EXTRACT(scores, '$.tPos') AS UNSIGNED)) STORED,
+  ADD COLUMN true_negatives INT UNSIGNED GENERATED ALWAYS AS (CAST(JSON_EXTRACT(scores, '$.tNeg') AS UNSIGNED)) STORED,
+  ADD COLUMN false_negatives INT UNSIGNED GENERATED ALWAYS AS (CAST(JSON_EXTRACT(scores, '$.fNeg') AS UNSIGNED)) STORED,
+  ADD COLUMN false_positives INT UNSIGNED GENERATED ALWAYS AS (CAST(JSON_EXTRACT(scores, '$.fPos') AS UNSIGNED)) STORED,
+  ADD COLUMN accuracy DOUBLE GENERATED ALWAYS AS (CAST(JSON_EXTRACT(scores, '$.accuracy') AS DOUBLE)) STORED,
+  ADD COLUMN `precision` DOUBLE GENERATED ALWAYS AS (CAST(JSON_EXTRACT(scores, '$.precision') AS DOUBLE)) STORED,
+  ADD COLUMN recall DOUBLE GENERATED ALWAYS AS (CAST(JSON_EXTRACT(scores, '$.recall') AS DOUBLE)) STORED,
+  ADD COLUMN fscore DOUBLE GENERATED ALWAYS AS (CAST(JSON_EXTRACT(scores, '$.fscore') AS DOUBLE)) STORED,
+  ADD INDEX results_user_finish_time (user_id, finish_time),
+  ADD INDEX results_user_fscore (user_id, fscore),
+  ADD INDEX results_fscore (fscore),
+  ADD INDEX results_accuracy (accuracy);
@@ -0,0 +1,5 @@
+-- Keep the stats of a running prompt run with its checkpoint, so partial results can be shown while it runs.
+-- Run once on databases created before this column was added to create.sql.
+
+ALTER TABLE running_task_checkpoints
+  ADD COLUMN stats JSON AFTER rows_completed;
@@ -0,0 +1,7 @@
+-- Expose the bootstrap interval of each result's fscore (stored in results.scores under ci) as columns for the scoreboard.
+-- Run once on databases created before these columns were added to create.sql.
+-- Older results get their intervals when the workers next start (see backfill_result_intervals).
+
+ALTER TABLE results
+  ADD COLUMN fscore_ci_low DOUBLE GENERATED ALWAYS AS (CAST(JSON_EXTRACT(scores, '$.ci.fscore[0]') AS DOUBLE)) STORED AFTER fscore,
+  ADD COLUMN fscore_ci_high DOUBLE GENERATED ALWAYS AS (CAST(JSON_EXTRACT(scores, '$.ci.fscore[1]') AS DOUBLE)) STORED AFTER fscore_ci_low;
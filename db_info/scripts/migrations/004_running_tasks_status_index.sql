@@ -0,0 +1,6 @@
+-- Index running_tasks by status and user for the task queue and the active task check.
+-- Run once on databases created before this index was added to create.sql.
+-- Skip it if the index already exists (it was created by an earlier version of create.sql).
+
+ALTER TABLE running_tasks
+  ADD INDEX running_tasks_status_user (status, user_id);
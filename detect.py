@@ -1,6 +1,6 @@
 import csv
-import google.generativeai as genai
 import os
+import sys
 from dotenv import load_dotenv
 
 # Load .env variables
@@ -46,10 +46,15 @@ prompts = [
 ]
 i = 0
 
+# Share the web server's response cache so repeated runs skip the API
+sys.path.append(os.path.join(script_directory, "web-server"))
+from helper_functions.response_cache import get_response_cache, ResponseCache
+from helper_functions.model_backend import GeminiBackend
+cache = get_response_cache()
+
 
 # Configure Gemini API
-genai.configure(api_key=os.environ['GOOGLE_API_KEY'])
-model = genai.GenerativeModel(model_name='gemini-pro')
+model = GeminiBackend(api_key=os.environ['GOOGLE_API_KEY'])
 
 # Pulls data in from csv file and organizes it in a list of dictionaries
 if in_file == "./example_data.csv":
@@ -95,50 +100,31 @@ for current in in_data:
             # Add text to current prompt and strips text of any ";"
             full_prompt = current_prompt + current["text"].replace(";", "")
 
-            # Interact with Gemini to fill out response, response_explanation, confidence, truthful_level, and correct
-            res = model.generate_content(
-            contents=full_prompt,
-            generation_config={
-            'temperature': 0,
-            'max_output_tokens': 800
-            },
-            safety_settings=[
-            {
-                "category": "HARM_CATEGORY_HARASSMENT",
-                "threshold": "BLOCK_NONE",
-            },
-            {
-                "category": "HARM_CATEGORY_HATE_SPEECH",
-                "threshold": "BLOCK_NONE",
-            },
-            {
-                "category": "HARM_CATEGORY_SEXUALLY_EXPLICIT",
-                "threshold": "BLOCK_NONE",
-            },
-            {
-                "category": "HARM_CATEGORY_DANGEROUS",
-                "threshold": "BLOCK_NONE",
-            },
-            ])
-
-            # Checks if the prompt was blocked
-            if str(res.prompt_feedback).replace("\n", "") == "block_reason: OTHER":
-                print(str(i) + ": Prompt Blocked")
-                continue
+            # Reuse an earlier response to the same prompt and post if there is one
+            cache_key = ResponseCache.make_key(model.model_name, "", current_prompt, current["text"].replace(";", ""))
+            res_text = cache.get(cache_key)
+            cached = res_text is not None
 
-            # Checks for if response is empty
-            if res.parts == []:
-                print(str(i) + ": Response is empty")
-                continue
+            if not cached:
+                # Interact with Gemini to fill out response, response_explanation, confidence, truthful_level, and correct
+                res_text = model.generate(full_prompt, max_output_tokens=800)
 
-            #print(res.text)
-            res = res.text.split(";")
+                # Checks if the prompt was blocked or the response is empty
+                if res_text is None:
+                    print(str(i) + ": No response")
+                    continue
+
+            res = res_text.split(";")
 
             # Checks if response is correct length
             if len(res) <= 1:
                 print("Prompt did not return correct response")
                 continue
             
+            # Only cache responses in the expected format
+            if not cached:
+                cache.set(cache_key, res_text)
+
             # Determines if PaLM 2 was correct or not
             if current["label"] == res[0]:
                 correct = 1
@@ -179,4 +165,6 @@ for current in in_data:
 if data:
     with open(out_file, mode="a", newline="", encoding='utf-8') as csv_file:
         csv_writer = csv.writer(csv_file)
-        csv_writer.writerows(data)
\ No newline at end of file
+        csv_writer.writerows(data)
+
+print(f"Response cache stats: {cache.stats()}")
\ No newline at end of file
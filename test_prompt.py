@@ -1,13 +1,13 @@
-import google.generativeai as genai
 import os
+import sys
 from dotenv import load_dotenv
 
 load_dotenv()
 
-genai.configure(
-    api_key=os.environ['GOOGLE_API_KEY'])
-model = genai.GenerativeModel(
-    model_name='gemini-pro')
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "web-server"))
+from helper_functions.model_backend import GeminiBackend
+
+model = GeminiBackend(api_key=os.environ['GOOGLE_API_KEY'])
 
 prompt = """
     Tell me if the following twitter post is factual or dissinformation. Your answer will have 4 sections seperated by a ";". 
@@ -17,33 +17,9 @@ prompt = """
     Section 4 - A explanation of why the post is fact or fake and why you gave the confidence level you did. Here is the twitter post: Suzanne Bonamici supports a plan that will cut choice for Medicare Advantage seniors.
 """
 
-completion = model.generate_content(
-    prompt,
-    generation_config={
-        'temperature': 0,
-        'max_output_tokens': 800
-    },
-    safety_settings=[
-        {
-            "category": "HARM_CATEGORY_HARASSMENT",
-            "threshold": "BLOCK_NONE",
-        },
-        {
-            "category": "HARM_CATEGORY_HATE_SPEECH",
-            "threshold": "BLOCK_NONE",
-        },
-        {
-            "category": "HARM_CATEGORY_SEXUALLY_EXPLICIT",
-            "threshold": "BLOCK_NONE",
-        },
-        {
-            "category": "HARM_CATEGORY_DANGEROUS",
-            "threshold": "BLOCK_NONE",
-        },
-    ]
-)
+completion = model.generate(prompt, max_output_tokens=800)
 
-print(completion.text)
+print(completion)
 
 """
         {
@@ -0,0 +1,215 @@
+"""
+End-to-end throughput benchmark for the prompt pipeline.
+
+Runs the same sampling, evaluation, CSV writing and stats code as a real prompt run,
+against the stub model backend with injected latency, on synthetic datasets.
+The database and email are not touched: checkpoints are skipped and sending the
+email is not measured, since it depends on the SMTP server rather than this code.
+
+Usage (from the web-server directory):
+    python benchmarks/pipeline_benchmark.py --sizes 1000 10000 100000 --latency 0.05
+
+Each size runs in its own process, so the peak RSS reported for a size isn't raised by
+the sizes run before it. Results are printed and written as JSON to benchmarks/results/
+so runs on different commits can be compared.
+"""
+import argparse
+import csv
+import json
+import multiprocessing
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+
+# Allow importing the web-server modules when run as a script
+SCRIPT_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(SCRIPT_DIRECTORY))
+
+import web_detect
+from helper_functions import dataset_index, dataset_cache
+from helper_functions.model_backend import StubBackend
+from helper_functions.rate_limiter import RateLimiter
+from helper_functions.response_cache import ResponseCache
+from helper_functions.metrics import MetricsAccumulator
+from helper_functions.stats import compute_sheet_stats
+
+DEFAULT_SIZES = [1000, 10000, 100000]
+DEFAULT_OUTPUT_DIRECTORY = os.path.join(SCRIPT_DIRECTORY, "results")
+PROMPT = "Is the following post disinformation?\n"
+WORDS = ["vaccine", "election", "climate", "report", "official", "claims", "study", "shows", "new", "data",
+         "breaking", "news", "experts", "say", "government", "secret", "cure", "found", "million", "people"]
+
+
+def make_dataset(path, num_rows, seed=0):
+    """
+    Write a synthetic dataset csv with text and label columns.
+
+    :param path: The path of the csv to write
+    :param num_rows: The number of rows to write
+    :param seed: Seed for the generated posts
+    """
+    rng = random.Random(seed)
+    with open(path, mode="w", newline="", encoding='utf-8') as csv_file:
+        csv_writer = csv.writer(csv_file)
+        csv_writer.writerow(["text", "label"])
+        for i in range(num_rows):
+            text = f"{i} " + " ".join(rng.choice(WORDS) for _ in range(rng.randint(10, 60)))
+            csv_writer.writerow([text, rng.randint(0, 1)])
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(fraction * (len(values) - 1))))]
+
+
+def peak_rss_mb():
+    # ru_maxrss is the high-water mark of the whole process, so each size is run in a fresh process.
+    # It is in kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        return peak / (1024 * 1024)
+    return peak / 1024
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=SCRIPT_DIRECTORY, stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmark(num_rows, args, work_directory):
+    """
+    Run the pipeline once on a synthetic dataset.
+
+    :param num_rows: The number of rows in the dataset (all of them are evaluated)
+    :param args: The parsed command line arguments
+    :param work_directory: A temporary directory for the dataset, its index and cache, and the response cache
+    :return: A dictionary of timings for the run
+    """
+    web_detect.PROMPT_CONCURRENCY = args.concurrency
+    # Keep the synthetic dataset's index and cache out of the server's dynamic directory
+    dataset_index.INDEX_DIRECTORY = os.path.join(work_directory, "dataset_index")
+    dataset_cache.CACHE_DIRECTORY = os.path.join(work_directory, "dataset_cache")
+
+    dataset_path = os.path.join(work_directory, f"dataset-{num_rows}.csv")
+    make_dataset(dataset_path, num_rows, seed=args.seed)
+
+    run_args = {
+        "prompt": PROMPT,
+        "dataset_info": {"name": "benchmark", "subject": "benchmark", "file_path": dataset_path},
+        "num_rows": num_rows,
+        "batch_size": args.batch_size,
+    }
+    model = StubBackend(latency=args.latency, latency_jitter=args.jitter, error_rate=args.error_rate, rate_limit_rate=0, seed=args.seed)
+    # Budgets high enough that the limiter never waits, so only the pipeline is measured
+    limiter = RateLimiter(requests_per_minute=10 ** 9, tokens_per_minute=10 ** 12)
+    cache = ResponseCache(path=os.path.join(work_directory, f"cache-{num_rows}.sqlite3"))
+
+    # The stats step reads results from the prompt results directory
+    os.makedirs(web_detect.RESULTS_DIRECTORY, exist_ok=True)
+    out_name = f"benchmark-{uuid.uuid4()}"
+    out_file = os.path.join(web_detect.RESULTS_DIRECTORY, f"{out_name}.csv")
+    timings = {}
+    try:
+        start = time.perf_counter()
+        random_rows = web_detect.sample_rows(dataset_path, num_rows)
+        rows = [(position, index, row) for position, (index, row) in enumerate(random_rows)]
+        timings["sampling_seconds"] = time.perf_counter() - start
+
+        with open(out_file, mode="w", newline="", encoding='utf-8') as csv_file:
+            csv.writer(csv_file).writerow(web_detect.CSV_HEADERS)
+
+        metrics = MetricsAccumulator()
+        start = time.perf_counter()
+        web_detect.evaluate_rows(model, limiter, cache, run_args, rows, out_file, on_row=lambda position, row: metrics.add_output_row(row), timings=timings)
+        timings["evaluation_seconds"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        metrics.stats()
+        timings["stats_seconds"] = time.perf_counter() - start
+
+        # The xlsx is only built when it is downloaded, so it is timed separately from the run
+        start = time.perf_counter()
+        compute_sheet_stats(f"{out_name}.csv", f"{out_name}.xlsx", metrics=metrics)
+        timings["xlsx_seconds"] = time.perf_counter() - start
+    finally:
+        for path in (out_file, os.path.join(web_detect.RESULTS_DIRECTORY, f"{out_name}.xlsx")):
+            if os.path.exists(path):
+                os.remove(path)
+
+    row_latencies = timings.pop("row_latencies")
+    total_seconds = timings["sampling_seconds"] + timings["evaluation_seconds"] + timings["stats_seconds"]
+    return {
+        "rows": len(rows),
+        "rows_per_second": len(rows) / timings["evaluation_seconds"] if timings["evaluation_seconds"] else None,
+        "end_to_end_rows_per_second": len(rows) / total_seconds if total_seconds else None,
+        "latency_p50": percentile(row_latencies, 0.50),
+        "latency_p95": percentile(row_latencies, 0.95),
+        "latency_p99": percentile(row_latencies, 0.99),
+        "sampling_seconds": timings["sampling_seconds"],
+        "evaluation_seconds": timings["evaluation_seconds"],
+        "csv_write_seconds": timings["csv_write_seconds"],
+        "stats_seconds": timings["stats_seconds"],
+        "xlsx_seconds": timings["xlsx_seconds"],
+        "total_seconds": total_seconds,
+        "cache": cache.stats(),
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the prompt pipeline against a simulated model.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="Dataset sizes to run")
+    parser.add_argument("--latency", type=float, default=0.05, help="Seconds each simulated model request takes")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Random extra seconds added to each request")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests that fail")
+    parser.add_argument("--concurrency", type=int, default=web_detect.PROMPT_CONCURRENCY, help="Requests in flight at once")
+    parser.add_argument("--batch-size", type=int, default=web_detect.PROMPT_BATCH_SIZE, help="Posts sent per request")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for the datasets and simulated model")
+    parser.add_argument("--output", default=None, help="Path of the JSON results file")
+    args = parser.parse_args()
+
+    results = {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "settings": {
+            "latency": args.latency,
+            "jitter": args.jitter,
+            "error_rate": args.error_rate,
+            "concurrency": args.concurrency,
+            "batch_size": args.batch_size,
+            "seed": args.seed,
+        },
+        "runs": [],
+    }
+    # A new interpreter for each size, so memory used by earlier sizes doesn't count towards later ones
+    context = multiprocessing.get_context("spawn")
+    with tempfile.TemporaryDirectory() as work_directory:
+        for num_rows in args.sizes:
+            print(f"Running {num_rows} rows...")
+            with context.Pool(processes=1) as pool:
+                run = pool.apply(run_benchmark, (num_rows, args, work_directory))
+            results["runs"].append(run)
+            print(f"  {run['rows_per_second']:.1f} rows/sec, p50 {run['latency_p50']:.3f}s, p95 {run['latency_p95']:.3f}s, "
+                  f"p99 {run['latency_p99']:.3f}s, peak RSS {run['peak_rss_mb']:.1f} MB")
+
+    output = args.output
+    if not output:
+        os.makedirs(DEFAULT_OUTPUT_DIRECTORY, exist_ok=True)
+        commit = (results["commit"] or "unknown")[:10]
+        output = os.path.join(DEFAULT_OUTPUT_DIRECTORY, f"{time.strftime('%Y%m%d-%H%M%S')}-{commit}.json")
+    with open(output, "w", encoding='utf-8') as results_file:
+        json.dump(results, results_file, indent=2)
+    print(f"Results written to {output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,57 +1,123 @@
+import hashlib
+import os
 import requests
-import json
-from openai import OpenAI
+from helper_functions.database import execute_sql, sql_results_one
+
+# Seconds a key check is reused. Bad keys are checked again sooner, since the user may fix the key in their console.
+API_KEY_VALID_TTL = int(os.getenv("API_KEY_VALID_TTL", 3600))
+API_KEY_INVALID_TTL = int(os.getenv("API_KEY_INVALID_TTL", 60))
+
+# Seconds to wait for the provider when checking a key
+API_KEY_CHECK_TIMEOUT = 10
+
+
+def hash_api_key(api_key):
+    # Key checks are stored by hash so the keys themselves never leave their own tables
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()
+
 
 def test_gemini_key(api_key):
-    # curl -H 'Content-Type: application/json' -d '{"contents":[{"parts":[{"text":"Write a story about a magic backpack"}]}]}' -X POST https://generativelanguage.googleapis.com/v1beta/models/gemini-pro:generateContent?key=YOUR_API_KEY
-    
-    # Replace 'YOUR_API_KEY' with your actual API key
-
-    # Define the payload
-    payload = {
-        "contents": [
-            {
-                "parts": [
-                    {
-                        "text": "Write a story about a magic backpack"
-                    }
-                ]
-            }
-        ]
-    }
-
-    # Define headers
-    headers = {
-        'Content-Type': 'application/json'
-    }
-
-    # Define the API URL
-    url = f'https://generativelanguage.googleapis.com/v1beta/models/gemini-pro:generateContent?key={api_key}'
-
-    # Make POST request
-    response = requests.post(url, headers=headers, data=json.dumps(payload))
-
-    # Check if there was an error
-    if "error" in response.json():
-        return False, "Bad API Key"
-    return True, "Good API Key"
+    """
+    Check a Gemini key by looking up the model's metadata, which needs a valid key but doesn't use any generation quota.
+
+    :param api_key: The Gemini API key
+    :return: A tuple containing a boolean indicating whether the key is valid, a message,
+    and a boolean indicating whether the answer is definite (False for network and server errors)
+    """
+    url = 'https://generativelanguage.googleapis.com/v1beta/models/gemini-pro'
+    try:
+        response = requests.get(url, params={'key': api_key}, timeout=API_KEY_CHECK_TIMEOUT)
+    except requests.RequestException as e:
+        print(f"Error checking Gemini key: {str(e)}")
+        return False, "Unable to reach Gemini to check the API key, please try again", False
+
+    if response.status_code == 200:
+        return True, "Good API Key", True
+    # Google answers a bad key with 400 API_KEY_INVALID, and a key without access with 401 or 403
+    if response.status_code in (400, 401, 403):
+        return False, "Bad API Key", True
+    print(f"Unexpected response checking Gemini key: {response.status_code} {response.text[:200]}")
+    return False, "Unable to check the API key, please try again", False
+
+
+def validate_gemini_key(api_key):
+    """
+    Check a Gemini key, reusing an earlier check of the same key while it is fresh.
+
+    :param api_key: The Gemini API key
+    :return: A tuple containing a boolean indicating whether the key is valid and a message
+    """
+    return validate_api_key(api_key, test_gemini_key)
+
+
+def validate_chatgpt_key(api_key):
+    """
+    Check an OpenAI key, reusing an earlier check of the same key while it is fresh.
+
+    :param api_key: The OpenAI API key
+    :return: A tuple containing a boolean indicating whether the key is valid and a message
+    """
+    return validate_api_key(api_key, test_chatgpt_key)
+
+
+def validate_api_key(api_key, test_key):
+    """
+    Check an API key with test_key, reusing an earlier check of the same key while it is fresh.
+
+    :param api_key: The API key
+    :param test_key: The provider's check, returning (is_valid, message, definite)
+    :return: A tuple containing a boolean indicating whether the key is valid and a message
+    """
+    key_hash = hash_api_key(api_key)
+    status, message, result = sql_results_one("SELECT is_valid FROM api_key_checks WHERE key_hash = %s AND expires_at > utc_timestamp();", (key_hash,))
+    if not status:
+        print(f"Error reading API key check: {message}")
+    elif result:
+        return (True, "Good API Key") if result[0] else (False, "Bad API Key")
+
+    is_valid, message, definite = test_key(api_key)
+    if definite:
+        ttl = API_KEY_VALID_TTL if is_valid else API_KEY_INVALID_TTL
+        status, error = execute_sql(
+            "INSERT INTO api_key_checks (key_hash, is_valid, expires_at) VALUES (%s, %s, utc_timestamp() + INTERVAL %s SECOND) "
+            "ON DUPLICATE KEY UPDATE is_valid = VALUES(is_valid), expires_at = VALUES(expires_at);",
+            (key_hash, is_valid, ttl,)
+        )
+        if not status:
+            print(f"Error saving API key check: {error}")
+    return is_valid, message
+
+
+def invalidate_api_key_check(api_key):
+    """
+    Forget the stored check of a key, so the next submission checks it again.
+    Called when a run is rejected by the provider.
+
+    :param api_key: The API key
+    :return: A tuple containing a boolean indicating success and a message
+    """
+    return execute_sql("DELETE FROM api_key_checks WHERE key_hash = %s;", (hash_api_key(api_key),))
 
 
 def test_chatgpt_key(api_key):
-    client = OpenAI(api_key=api_key)
-    response = client.chat.completions.create(
-    model="gpt-3.5-turbo",
-    messages=[
-        {
-        "role": "user",
-        "content": "Test this for me"
-        }
-    ],
-    temperature=1,
-    max_tokens=256,
-    top_p=1,
-    frequency_penalty=0,
-    presence_penalty=0
-    )
-
-    return False, "Not implemented yet"
\ No newline at end of file
+    """
+    Check an OpenAI key by looking up the model's metadata, which needs a valid key but doesn't use any tokens.
+
+    :param api_key: The OpenAI API key
+    :return: A tuple containing a boolean indicating whether the key is valid, a message,
+    and a boolean indicating whether the answer is definite (False for network and server errors)
+    """
+    url = 'https://api.openai.com/v1/models/gpt-3.5-turbo'
+    try:
+        response = requests.get(url, headers={'Authorization': f'Bearer {api_key}'}, timeout=API_KEY_CHECK_TIMEOUT)
+    except requests.RequestException as e:
+        print(f"Error checking OpenAI key: {str(e)}")
+        return False, "Unable to reach OpenAI to check the API key, please try again", False
+
+    if response.status_code == 200:
+        return True, "Good API Key", True
+    # OpenAI answers a bad key with 401, and a key without access to the model with 403 or 404
+    if response.status_code in (401, 403, 404):
+        return False, "Bad API Key", True
+    print(f"Unexpected response checking OpenAI key: {response.status_code} {response.text[:200]}")
+    return False, "Unable to check the API key, please try again", False
@@ -0,0 +1,86 @@
+import json
+import os
+import numpy as np
+
+# Bootstrap resamples per result, and the coverage of the intervals
+BOOTSTRAP_SAMPLES = int(os.getenv("BOOTSTRAP_SAMPLES", 2000))
+BOOTSTRAP_CONFIDENCE = float(os.getenv("BOOTSTRAP_CONFIDENCE", 0.95))
+
+# Results given intervals per query when backfilling
+BACKFILL_BATCH_SIZE = 500
+
+
+def _ratio(numerator, denominator):
+    # Same convention as the run stats: a metric with nothing to divide by is 0
+    return np.divide(numerator, denominator, out=np.zeros_like(numerator, dtype=float), where=denominator != 0)
+
+
+def bootstrap_intervals(tp, tn, fp, fn, num_samples=BOOTSTRAP_SAMPLES, confidence=BOOTSTRAP_CONFIDENCE, seed=None):
+    """
+    Percentile bootstrap intervals for a run's metrics. Resampling the rows of a run only changes
+    how many land in each confusion cell, so all resamples are drawn at once from a multinomial over the four cells.
+
+    :param tp: True positives
+    :param tn: True negatives
+    :param fp: False positives
+    :param fn: False negatives
+    :param num_samples: The number of resamples
+    :param confidence: The coverage of the intervals, e.g. 0.95
+    :param seed: Seed for the resampling
+    :return: A dictionary of metric name (accuracy, precision, recall, fscore) to [low, high], or None if there are no rows
+    """
+    counts = np.array([tp, tn, fp, fn], dtype=float)
+    num_rows = int(counts.sum())
+    if num_rows == 0:
+        return None
+
+    rng = np.random.default_rng(seed)
+    samples = rng.multinomial(num_rows, counts / num_rows, size=num_samples).astype(float)
+    s_tp, s_tn, s_fp, s_fn = samples.T
+
+    precision = _ratio(s_tp, s_tp + s_fp)
+    recall = _ratio(s_tp, s_tp + s_fn)
+    metrics = {
+        'accuracy': (s_tp + s_tn) / num_rows,
+        'precision': precision,
+        'recall': recall,
+        'fscore': _ratio(2 * precision * recall, precision + recall),
+    }
+
+    tail = (1 - confidence) / 2
+    intervals = {}
+    for name, values in metrics.items():
+        low, high = np.quantile(values, [tail, 1 - tail])
+        intervals[name] = [round(float(low), 4), round(float(high), 4)]
+    return intervals
+
+
+def backfill_result_intervals():
+    """
+    Add bootstrap intervals to results saved before they were computed.
+
+    :return: A tuple containing a boolean indicating success and a message
+    """
+    # Imported here so the intervals can be computed without a database connection
+    from helper_functions.database import sql_results_all, execute_many_sql
+
+    total = 0
+    while True:
+        query = """SELECT id, true_positives, true_negatives, false_positives, false_negatives FROM results
+        WHERE JSON_EXTRACT(scores, '$.ci') IS NULL AND true_positives IS NOT NULL
+        ORDER BY id LIMIT %s;"""
+        status, message, rows = sql_results_all(query, (BACKFILL_BATCH_SIZE,))
+        if not status:
+            return False, message
+        if not rows:
+            return True, f"Added intervals to {total} results"
+
+        updates = []
+        for result_id, tp, tn, fp, fn in rows:
+            # Results without any rows get an empty object, so they aren't selected again
+            intervals = bootstrap_intervals(tp, tn, fp, fn, seed=result_id) or {}
+            updates.append((json.dumps(intervals), result_id))
+        status, message = execute_many_sql("UPDATE results SET scores = JSON_SET(scores, '$.ci', CAST(%s AS JSON)) WHERE id = %s;", updates)
+        if not status:
+            return False, message
+        total += len(updates)
@@ -0,0 +1,240 @@
+import argparse
+import json
+import re
+import numpy as np
+import pandas as pd
+
+# confidence_level and truth_level are asked for on a 1-12 scale by the current instructions,
+# older result files used 1-10. The scale is read from the prompt column when it says "a level from 1-N".
+MAX_LEVEL = 12
+LEVEL_SCALE_PATTERN = re.compile(r"level from 1\s*-\s*(\d+)")
+
+# Text labels used by some of the older result files
+TEXT_LABELS = {
+    'fake': 1,
+    'disinformation': 1,
+    'false': 1,
+    'fact': 0,
+    'factual': 0,
+    'true': 0,
+    'real': 0,
+}
+
+
+def _to_numbers(column):
+    # Levels and labels are free text in the csv ("12", " 12", "1.0"), anything else becomes NaN
+    return pd.to_numeric(column.astype(str).str.strip(), errors='coerce').to_numpy(dtype=float)
+
+
+def _to_labels(column):
+    labels = _to_numbers(column)
+    text = column.astype(str).str.strip().str.lower().map(TEXT_LABELS).to_numpy(dtype=float)
+    labels = np.where(np.isnan(labels), text, labels)
+    # Only 0 and 1 are labels, 1 is disinformation
+    return np.where(np.isin(labels, (0, 1)), labels, np.nan)
+
+
+def _prompt_scale(prompts):
+    # The largest "level from 1-N" in the prompts, or None if they don't say
+    scales = prompts.drop_duplicates().str.findall(LEVEL_SCALE_PATTERN).explode().dropna()
+    return int(scales.astype(int).max()) if not scales.empty else None
+
+
+def load_results(path):
+    """
+    Read the columns needed for the analysis from a results csv.
+
+    :param path: The path of the results csv
+    :return: A dictionary of float arrays (NaN where a value is missing or not a number):
+    label and response (1 is disinformation), confidence_level and truth_level,
+    and max_level, the top of the level scale named in the prompt column (None if it doesn't name one)
+    """
+    columns = {"label", "response", "confidence_level", "truth_level", "prompt"}
+    df = pd.read_csv(path, usecols=lambda column: column in columns, dtype=str, keep_default_na=False)
+    missing = sorted(columns - {"prompt"} - set(df.columns))
+    if missing:
+        raise ValueError(f"Missing columns: {', '.join(missing)}")
+    return {
+        'label': _to_labels(df["label"]),
+        'response': _to_labels(df["response"]),
+        'confidence_level': _to_numbers(df["confidence_level"]),
+        'truth_level': _to_numbers(df["truth_level"]),
+        'max_level': _prompt_scale(df["prompt"]) if "prompt" in df.columns else None,
+    }
+
+
+def level_probability(levels, max_level):
+    """
+    Map levels on a 1-max_level scale to [0, 1] with (level - 1) / (max_level - 1),
+    so the lowest level is 0, the highest is 1 and the middle of the scale is 0.5.
+    Levels outside the scale are clipped to it.
+
+    :param levels: Array of levels
+    :param max_level: The top of the scale
+    :return: Array of probabilities (NaN where the level is NaN)
+    """
+    return (np.clip(levels, 1, max_level) - 1) / (max_level - 1)
+
+
+def reliability_curve(probabilities, outcomes, num_bins=10):
+    """
+    Compare predicted probabilities with how often the outcome happened, in equal-width bins.
+
+    :param probabilities: Array of predicted probabilities in [0, 1]
+    :param outcomes: Array of 0/1 outcomes
+    :param num_bins: The number of bins
+    :return: A dictionary with the per-bin count, mean predicted probability and observed frequency
+    (empty bins are left out), the expected calibration error and the Brier score
+    """
+    probabilities = np.asarray(probabilities, dtype=float)
+    outcomes = np.asarray(outcomes, dtype=float)
+    if probabilities.size == 0:
+        return {'bins': [], 'count': [], 'predicted': [], 'observed': [], 'ece': None, 'brier': None}
+
+    bins = np.minimum((probabilities * num_bins).astype(int), num_bins - 1)
+    count = np.bincount(bins, minlength=num_bins)
+    predicted_sum = np.bincount(bins, weights=probabilities, minlength=num_bins)
+    observed_sum = np.bincount(bins, weights=outcomes, minlength=num_bins)
+
+    used = count > 0
+    predicted = predicted_sum[used] / count[used]
+    observed = observed_sum[used] / count[used]
+    ece = float(np.sum(count[used] / probabilities.size * np.abs(observed - predicted)))
+    brier = float(np.mean((probabilities - outcomes) ** 2))
+    return {
+        'bins': np.flatnonzero(used).tolist(),
+        'count': count[used].tolist(),
+        'predicted': predicted.tolist(),
+        'observed': observed.tolist(),
+        'ece': ece,
+        'brier': brier,
+    }
+
+
+def _ranked_counts(labels, scores):
+    # True and false positives when everything scoring at least each distinct score is called positive
+    order = np.argsort(-scores, kind="mergesort")
+    scores, labels = scores[order], labels[order]
+    # Tied scores form one threshold, so only the last row of each tie is kept
+    last_of_tie = np.r_[scores[1:] != scores[:-1], True]
+    tps = np.cumsum(labels)[last_of_tie]
+    fps = np.cumsum(1 - labels)[last_of_tie]
+    return tps, fps, scores[last_of_tie]
+
+
+def roc_curve(labels, scores):
+    """
+    ROC curve and its area for a score where higher means more likely positive.
+
+    :param labels: Array of 0/1 labels
+    :param scores: Array of scores
+    :return: A dictionary with the false positive rates, true positive rates, thresholds and the AUC
+    (None if only one class is present)
+    """
+    labels = np.asarray(labels, dtype=float)
+    scores = np.asarray(scores, dtype=float)
+    positives = labels.sum()
+    negatives = labels.size - positives
+    if positives == 0 or negatives == 0:
+        return {'fpr': [], 'tpr': [], 'thresholds': [], 'auc': None}
+
+    tps, fps, thresholds = _ranked_counts(labels, scores)
+    tpr = np.r_[0, tps / positives]
+    fpr = np.r_[0, fps / negatives]
+    auc = float(np.sum(np.diff(fpr) * (tpr[1:] + tpr[:-1]) / 2))
+    return {'fpr': fpr.tolist(), 'tpr': tpr.tolist(), 'thresholds': thresholds.tolist(), 'auc': auc}
+
+
+def pr_curve(labels, scores):
+    """
+    Precision-recall curve and its average precision for a score where higher means more likely positive.
+
+    :param labels: Array of 0/1 labels
+    :param scores: Array of scores
+    :return: A dictionary with the precisions, recalls, thresholds and the average precision
+    (None if there are no positives)
+    """
+    labels = np.asarray(labels, dtype=float)
+    scores = np.asarray(scores, dtype=float)
+    positives = labels.sum()
+    if positives == 0:
+        return {'precision': [], 'recall': [], 'thresholds': [], 'average_precision': None}
+
+    tps, fps, thresholds = _ranked_counts(labels, scores)
+    precision = tps / (tps + fps)
+    recall = tps / positives
+    average_precision = float(np.sum(np.diff(np.r_[0, recall]) * precision))
+    return {'precision': precision.tolist(), 'recall': recall.tolist(), 'thresholds': thresholds.tolist(), 'average_precision': average_precision}
+
+
+def analyze_results(results, max_level=None):
+    """
+    Calibration and ranking analysis of a prompt run.
+    Levels are mapped to probabilities with level_probability, (level - 1) / (max_level - 1).
+    The confidence level is read as the probability that the answer is correct, and the truth level
+    as the probability that the post is factual, so 1 minus it is the probability of disinformation.
+
+    :param results: The path of a results csv, or the dictionary returned by load_results
+    :param max_level: The top of the level scale. If not given, the scale named in the prompt column is used,
+    otherwise MAX_LEVEL, raised to the highest level in the results if that is larger.
+    :return: A dictionary with the scale used, the confidence calibration, truth level calibration, ROC and PR curves
+    """
+    if isinstance(results, str):
+        results = load_results(results)
+    label, response = results['label'], results['response']
+    if max_level is None:
+        max_level = results.get('max_level')
+    if max_level is None:
+        levels = np.r_[results['confidence_level'], results['truth_level']]
+        max_level = int(max(MAX_LEVEL, np.nanmax(levels))) if not np.isnan(levels).all() else MAX_LEVEL
+    if max_level < 2:
+        raise ValueError(f"Invalid level scale: 1-{max_level}")
+    confidence = level_probability(results['confidence_level'], max_level)
+    disinformation = 1 - level_probability(results['truth_level'], max_level)
+
+    # Rows without a usable label, answer or level are left out of the parts that need them
+    answered = ~np.isnan(label) & ~np.isnan(response) & ~np.isnan(confidence)
+    correct = (label[answered] == response[answered]).astype(float)
+    scored = ~np.isnan(label) & ~np.isnan(disinformation)
+
+    return {
+        'rows': int(label.size),
+        'max_level': int(max_level),
+        'confidence_rows': int(answered.sum()),
+        'truth_rows': int(scored.sum()),
+        'confidence_calibration': reliability_curve(confidence[answered], correct, num_bins=max_level),
+        'truth_calibration': reliability_curve(disinformation[scored], label[scored], num_bins=max_level),
+        'roc': roc_curve(label[scored], disinformation[scored]),
+        'pr': pr_curve(label[scored], disinformation[scored]),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Calibration and ROC/PR analysis of prompt results csvs.")
+    parser.add_argument("paths", nargs="+", help="Results csvs to analyze")
+    parser.add_argument("--curves", action="store_true", help="Include the full curves, not just the summary")
+    parser.add_argument("--max-level", type=int, help="Top of the confidence and truth level scale (default: read from the prompt)")
+    args = parser.parse_args()
+
+    for path in args.paths:
+        try:
+            analysis = analyze_results(path, max_level=args.max_level)
+        except (OSError, ValueError) as e:
+            print(json.dumps({'path': path, 'error': str(e)}))
+            continue
+        if not args.curves:
+            analysis = {
+                'rows': analysis['rows'],
+                'max_level': analysis['max_level'],
+                'confidence_ece': analysis['confidence_calibration']['ece'],
+                'confidence_brier': analysis['confidence_calibration']['brier'],
+                'truth_ece': analysis['truth_calibration']['ece'],
+                'truth_brier': analysis['truth_calibration']['brier'],
+                'roc_auc': analysis['roc']['auc'],
+                'average_precision': analysis['pr']['average_precision'],
+            }
+        print(json.dumps({'path': path, **analysis}))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+import json
+from helper_functions.database import execute_sql, sql_results_one
+
+# Save the sampled rows and arguments for a task so it can be resumed later
+def save_checkpoint(task_id, run_args, row_order):
+    """
+    Save the starting checkpoint for a prompt run.
+
+    :param task_id: The id of the task in running_tasks
+    :param run_args: The arguments the run was started with (prompt, email, dataset info, ...)
+    :param row_order: The dataset row indices, in the order they will be evaluated
+    :return: A tuple containing a boolean indicating success and a message
+    """
+    query = "INSERT INTO running_task_checkpoints (task_id, run_args, row_order, rows_completed) VALUES (%s, %s, %s, 0);"
+    return execute_sql(query, (task_id, json.dumps(run_args), json.dumps(row_order),))
+
+# Record how many rows of the row order have been processed
+def update_checkpoint(task_id, rows_completed, stats=None):
+    """
+    Update the number of rows processed for a prompt run.
+
+    :param task_id: The id of the task in running_tasks
+    :param rows_completed: The number of rows of the row order that have been processed and written
+    :param stats: The run's stats so far (see MetricsAccumulator.stats)
+    :return: A tuple containing a boolean indicating success and a message
+    """
+    query = "UPDATE running_task_checkpoints SET rows_completed = %s, stats = %s, updated_at = utc_timestamp() WHERE task_id = %s;"
+    return execute_sql(query, (rows_completed, None if stats is None else json.dumps(stats), task_id,))
+
+# Get the checkpoint for a task
+def get_checkpoint(task_id):
+    """
+    Get the checkpoint for a prompt run.
+
+    :param task_id: The id of the task in running_tasks
+    :return: A tuple containing a boolean indicating success, a message, and the checkpoint as a dictionary
+    """
+    status, message, result = sql_results_one("SELECT run_args, row_order, rows_completed FROM running_task_checkpoints WHERE task_id = %s;", (task_id,))
+    if not status:
+        return False, message, None
+    if not result:
+        return False, "No checkpoint found for task", None
+    checkpoint = {
+        'run_args': json.loads(result[0]),
+        'row_order': json.loads(result[1]),
+        'rows_completed': int(result[2])
+    }
+    return True, "Good", checkpoint
+
+# Delete the checkpoint once a task has finished
+def delete_checkpoint(task_id):
+    return execute_sql("DELETE FROM running_task_checkpoints WHERE task_id = %s;", (task_id,))
+
+# Get the progress of a user's task
+def get_task_progress(uuid_name, user_id):
+    """
+    Get the status of a prompt run and, while it is running, the rows processed and the stats so far.
+
+    :param uuid_name: The uuid of the task
+    :param user_id: The id of the user who submitted the task
+    :return: A tuple containing a boolean indicating success, a message, and the progress as a dictionary (None if there is no such task)
+    """
+    query = """SELECT running_tasks.status, running_task_checkpoints.rows_completed, JSON_LENGTH(running_task_checkpoints.row_order), running_task_checkpoints.stats
+    FROM running_tasks
+    LEFT JOIN running_task_checkpoints ON running_task_checkpoints.task_id = running_tasks.process_id
+    WHERE running_tasks.uuid = %s AND running_tasks.user_id = %s;"""
+    status, message, result = sql_results_one(query, (uuid_name, user_id,))
+    if not status:
+        return False, message, None
+    if not result:
+        return True, "No task found", None
+    progress = {
+        'status': result[0],
+        'rows_completed': result[1],
+        'num_rows': result[2],
+        'stats': json.loads(result[3]) if result[3] else None
+    }
+    return True, "Good", progress
@@ -0,0 +1,32 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+def ordered_map(func, items, max_workers=8):
+    """
+    Apply a function to items on a thread pool, yielding results in input order.
+
+    At most max_workers calls run at once, and only a small window of results
+    is buffered ahead of the consumer, so memory stays bounded for large inputs.
+    If a call raises, the exception is raised here and the calls that haven't started are cancelled.
+
+    :param func: The function to call for each item
+    :param items: An iterable of items
+    :param max_workers: The maximum number of calls in flight
+    :return: A generator of results, in the same order as items
+    """
+    max_workers = max(1, int(max_workers))
+    window = max_workers * 2
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = deque()
+        try:
+            for item in items:
+                pending.append(executor.submit(func, item))
+                # Wait on the oldest request once the window is full
+                if len(pending) >= window:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+        finally:
+            # If a call raised or the consumer stopped early, don't start the calls still waiting
+            for future in pending:
+                future.cancel()
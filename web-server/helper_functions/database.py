@@ -1,20 +1,175 @@
 import os
+import threading
+import time
+from collections import deque
 import mysql.connector
+from helper_functions.query_metrics import record_query
+
+# Connections kept open when idle, and the most that can be open at once (per process)
+POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", 1))
+POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", 10))
+
+# Seconds to wait for a free connection before giving up
+POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", 10))
+
+# Connections idle longer than this are pinged before reuse, and closed if above the minimum
+POOL_IDLE_SECONDS = float(os.getenv("DB_POOL_IDLE_SECONDS", 60))
+
+
+class PooledConnection:
+    """
+    A connection checked out of the pool. Calling close() returns it to the pool instead of closing it,
+    so code written for plain connections works unchanged.
+    """
+    def __init__(self, pool, conn):
+        self._pool = pool
+        self._conn = conn
+
+    def close(self):
+        if self._conn is not None:
+            conn = self._conn
+            self._conn = None
+            self._pool.release(conn)
+
+    def __getattr__(self, name):
+        if self._conn is None:
+            raise mysql.connector.errors.OperationalError("Connection has been returned to the pool")
+        return getattr(self._conn, name)
+
+    def __del__(self):
+        # Return connections that were never closed
+        try:
+            self.close()
+        except Exception:
+            pass
+
+
+class ConnectionPool:
+    def __init__(self, min_size=POOL_MIN_SIZE, max_size=POOL_MAX_SIZE, timeout=POOL_TIMEOUT, idle_seconds=POOL_IDLE_SECONDS):
+        """
+        A thread-safe pool of database connections.
+
+        :param min_size: Idle connections kept open even when unused
+        :param max_size: The most connections open at once
+        :param timeout: Seconds to wait for a free connection
+        :param idle_seconds: Idle time after which a connection is checked before reuse
+        """
+        self.min_size = min_size
+        self.max_size = max(1, max_size)
+        self.timeout = timeout
+        self.idle_seconds = idle_seconds
+        self.idle = deque()  # (connection, time returned)
+        self.num_open = 0
+        self.condition = threading.Condition()
+
+    def connect(self):
+        return mysql.connector.connect(
+            host=os.getenv("DB_HOST"),
+            user=os.getenv("DB_USER"),
+            password=os.getenv("DB_PASSWORD"),
+            database=os.getenv("DB_DATABASE"),
+            # Discard unread rows (e.g. after fetchone) so the connection can be reused
+            consume_results=True
+        )
+
+    def acquire(self):
+        """
+        Check out a connection, reusing an idle one if possible.
+
+        :return: A PooledConnection
+        """
+        deadline = time.monotonic() + self.timeout
+        with self.condition:
+            while True:
+                if self.idle:
+                    # Most recently used first, so rarely used connections age out
+                    conn, returned_at = self.idle.pop()
+                    break
+                if self.num_open < self.max_size:
+                    self.num_open += 1
+                    conn, returned_at = None, None
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise mysql.connector.errors.PoolError(f"No database connection available after {self.timeout} seconds")
+                self.condition.wait(remaining)
+
+        try:
+            if conn is None:
+                conn = self.connect()
+            elif time.monotonic() - returned_at > self.idle_seconds and not self.is_healthy(conn):
+                self.close_connection(conn)
+                conn = self.connect()
+        except Exception:
+            self.discard()
+            raise
+        return PooledConnection(self, conn)
+
+    def is_healthy(self, conn):
+        try:
+            conn.ping(reconnect=False)
+            return True
+        except mysql.connector.Error:
+            return False
+
+    def release(self, conn):
+        """
+        Return a connection to the pool, ending any transaction left open on it.
+
+        :param conn: The mysql connection
+        """
+        try:
+            # A connection that only ran SELECTs still has an open transaction, which would give stale reads later
+            conn.rollback()
+        except mysql.connector.Error:
+            self.close_connection(conn)
+            self.discard()
+            return
+
+        now = time.monotonic()
+        expired = []
+        with self.condition:
+            self.idle.append((conn, now))
+            # Close connections that have been idle too long, keeping at least min_size open
+            while len(self.idle) > self.min_size and now - self.idle[0][1] > self.idle_seconds:
+                expired.append(self.idle.popleft()[0])
+                self.num_open -= 1
+            self.condition.notify()
+        for old_conn in expired:
+            self.close_connection(old_conn)
+
+    def discard(self):
+        # A connection was closed without being returned, so another one may be opened
+        with self.condition:
+            self.num_open -= 1
+            self.condition.notify()
+
+    def close_connection(self, conn):
+        try:
+            conn.close()
+        except mysql.connector.Error:
+            pass
+
+
+# Each process has its own pool, connections can't be shared with forked workers
+_pools = {}
+_pools_lock = threading.Lock()
+
+def get_pool():
+    pid = os.getpid()
+    with _pools_lock:
+        if pid not in _pools:
+            _pools[pid] = ConnectionPool()
+        return _pools[pid]
 
 # Get database connection
 def get_db_connection():
     """
-    Get a connection to the database.
+    Get a connection to the database from the connection pool. Close it to return it to the pool.
     
     :return: A connection to the database
     """
-    conn = mysql.connector.connect(
-        host=os.getenv("DB_HOST"),
-        user=os.getenv("DB_USER"),
-        password=os.getenv("DB_PASSWORD"),
-        database=os.getenv("DB_DATABASE")
-    )
-    return conn
+    return get_pool().acquire()
 
 # Execute generic sql query
 def execute_sql(query, values=None):
@@ -27,12 +182,14 @@ def execute_sql(query, values=None):
     """
     conn = get_db_connection()
     cursor = conn.cursor()
+    start = time.perf_counter()
     try:
         if values:
             cursor.execute(query, values)
         else:
             cursor.execute(query)
         conn.commit()
+        record_query(query, time.perf_counter() - start, cursor.rowcount)
     except mysql.connector.Error as err:
         print(f"Error executing SQL query: {err}")
         conn.rollback()
@@ -53,12 +210,14 @@ def execute_many_sql(query, values=None):
     """
     conn = get_db_connection()
     cursor = conn.cursor()
+    start = time.perf_counter()
     try:
         if values:
             cursor.executemany(query, values)
         else:
             cursor.executemany(query)
         conn.commit()
+        record_query(query, time.perf_counter() - start, cursor.rowcount)
     except mysql.connector.Error as err:
         print(f"Error executing SQL query: {err}")
         conn.rollback()
@@ -79,10 +238,12 @@ def execute_sql_return_id(query, values):
     """
     conn = get_db_connection()
     cursor = conn.cursor()
+    start = time.perf_counter()
     try:
         cursor.execute(query, values)
         conn.commit()
         last_insert_id = cursor.lastrowid
+        record_query(query, time.perf_counter() - start, cursor.rowcount)
     except mysql.connector.Error as err:
         print(f"Error executing SQL query: {err}")
         conn.rollback()
@@ -104,12 +265,14 @@ def sql_results_one(query, values=None):
     conn = get_db_connection()
     cursor = conn.cursor()
     results = None
+    start = time.perf_counter()
     try:
         if values:
             cursor.execute(query, values)
         else:
             cursor.execute(query)
         results = cursor.fetchone()
+        record_query(query, time.perf_counter() - start, 1 if results else 0)
     except mysql.connector.Error as err:
         print(f"Error executing SQL query: {err}")
         conn.rollback()
@@ -131,12 +294,14 @@ def sql_results_all(query, values=None):
     conn = get_db_connection()
     cursor = conn.cursor()
     results = None
+    start = time.perf_counter()
     try:
         if values:
             cursor.execute(query, values)
         else:
             cursor.execute(query)
         results = cursor.fetchall()
+        record_query(query, time.perf_counter() - start, len(results))
     except mysql.connector.Error as err:
         print(f"Error executing SQL query: {err}")
         conn.rollback()
@@ -204,20 +369,24 @@ class Database:
         :param values: The values to pass to the query
         :return: A tuple containing a boolean indicating success and a message
         """
+        start = time.perf_counter()
         try:
             if values:
                 self.cursor.execute(query, values)
             else:
                 self.cursor.execute(query)
+            record_query(query, time.perf_counter() - start, self.cursor.rowcount)
             return True, "Good"
         except mysql.connector.Error as err:
             print(f"Error executing SQL query: {err}")
             return False, f"Error executing SQL query: {err}"
     
     def execute_return_id(self, query, values):
+        start = time.perf_counter()
         try:
             self.cursor.execute(query, values)
             last_insert_id = self.cursor.lastrowid
+            record_query(query, time.perf_counter() - start, self.cursor.rowcount)
             return True, "Good", last_insert_id
         except mysql.connector.Error as err:
             print(f"Error executing SQL query: {err}")
@@ -268,4 +437,4 @@ class Database:
             self.rollback()
         elif self.in_transaction:
             self.commit()
-            self.disconnect()
\ No newline at end of file
+        self.disconnect()
\ No newline at end of file
@@ -0,0 +1,123 @@
+import os
+import threading
+import pyarrow as pa
+import pyarrow.compute as pc
+from helper_functions.dataset_index import get_dataset_index, read_rows
+from helper_functions.dataset_registry import get_datasets
+
+SCRIPT_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Directory where the columnar copies of datasets are stored, named by the sha256 of the csv
+CACHE_DIRECTORY = os.path.join(SCRIPT_DIRECTORY, "dynamic", "dataset_cache")
+
+COMPETITION_DATASETS_DIRECTORY = os.path.join(SCRIPT_DIRECTORY, "dynamic", "datasets")
+
+# Tables opened by this process, by the sha256 of the csv
+_tables = {}
+_tables_lock = threading.Lock()
+
+
+def _cache_path(sha256):
+    return os.path.join(CACHE_DIRECTORY, f"{sha256}.arrow")
+
+
+def build_dataset_cache(in_file, index=None):
+    """
+    Convert a dataset csv into an Arrow IPC file, with text as a string column and label as an integer column.
+
+    :param in_file: The path of the dataset csv
+    :param index: The dataset index, looked up if not given
+    :return: The path of the Arrow file
+    """
+    index = index or get_dataset_index(in_file)
+    rows = read_rows(in_file, range(len(index["offsets"])), index=index)
+    columns = {}
+    for column in index["columns"]:
+        columns[column] = pa.array([row.get(column) for row in rows], type=pa.string())
+    if "label" in columns:
+        try:
+            columns["label"] = pc.cast(columns["label"], pa.int64())
+        except (pa.ArrowInvalid, pa.ArrowNotImplementedError) as e:
+            print(f"Keeping labels of {in_file} as text: {str(e)}")
+    table = pa.table(columns)
+
+    os.makedirs(CACHE_DIRECTORY, exist_ok=True)
+    path = _cache_path(index["sha256"])
+    # Write to a temporary file first so other processes never open a partial file
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with pa.OSFile(temp_path, "wb") as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    os.replace(temp_path, path)
+    return path
+
+
+def get_dataset_table(in_file):
+    """
+    Get a dataset as a memory-mapped Arrow table, converting the csv the first time it is used.
+    A changed csv has a different sha256, so it gets a new table.
+
+    :param in_file: The path of the dataset csv
+    :return: A tuple containing the pyarrow Table and the dataset index
+    """
+    index = get_dataset_index(in_file)
+    sha256 = index["sha256"]
+    with _tables_lock:
+        table = _tables.get(sha256)
+    if table is not None:
+        return table, index
+
+    path = _cache_path(sha256)
+    if not os.path.exists(path):
+        build_dataset_cache(in_file, index=index)
+    # Reading from a memory map keeps the columns in the page cache instead of the process heap
+    table = pa.ipc.open_file(pa.memory_map(path, "r")).read_all()
+    if table.num_rows != len(index["offsets"]):
+        raise ValueError(f"Dataset cache for {in_file} has {table.num_rows} rows, expected {len(index['offsets'])}")
+
+    with _tables_lock:
+        _tables[sha256] = table
+    return table, index
+
+
+def read_dataset_rows(in_file, row_numbers):
+    """
+    Read the given rows of a dataset from its columnar cache, falling back to the csv if the cache can't be used.
+
+    :param in_file: The path of the dataset csv
+    :param row_numbers: The row numbers to read (0 is the first row after the header)
+    :return: A list of dictionaries mapping column names to values, in the order of row_numbers
+    """
+    row_numbers = list(row_numbers)
+    try:
+        table, index = get_dataset_table(in_file)
+    except (OSError, ValueError, pa.ArrowException) as e:
+        print(f"Error loading dataset cache for {in_file}, reading the csv instead: {str(e)}")
+        return read_rows(in_file, row_numbers)
+    return table.take(pa.array(row_numbers, type=pa.int64())).to_pylist()
+
+
+def cache_registered_datasets():
+    """
+    Build the columnar cache for every dataset in dataset_mapping.json and competition_datasets,
+    so the first run on a dataset doesn't pay for the conversion.
+    """
+    # Imported here so the cache can be used without a database connection
+    from helper_functions.database import sql_results_all
+
+    paths = [dataset["file_path"] for dataset in get_datasets().values()]
+
+    status, message, result = sql_results_all("SELECT competition_id, file_name FROM competition_datasets;")
+    if not status:
+        print(f"Error getting competition datasets: {message}")
+    else:
+        for comp_id, file_name in result or []:
+            paths.append(os.path.join(COMPETITION_DATASETS_DIRECTORY, str(comp_id), os.path.basename(file_name)))
+
+    for path in paths:
+        if not os.path.exists(path):
+            continue
+        try:
+            get_dataset_table(path)
+        except (OSError, ValueError, pa.ArrowException) as e:
+            print(f"Error caching dataset {path}: {str(e)}")
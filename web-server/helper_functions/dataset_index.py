@@ -0,0 +1,200 @@
+import csv
+import hashlib
+import io
+import json
+import mmap
+import os
+import random
+import threading
+
+# Directory where dataset indexes are stored
+INDEX_DIRECTORY = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "dynamic", "dataset_index")
+
+# Bump when the index format changes so old indexes are rebuilt
+INDEX_VERSION = 2
+
+# Keep recently used indexes in memory so repeated runs on a dataset skip reading the index file
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def _index_path(in_file):
+    path_hash = hashlib.sha256(os.path.abspath(in_file).encode("utf-8")).hexdigest()
+    return os.path.join(INDEX_DIRECTORY, f"{path_hash}.json")
+
+
+def _file_signature(in_file):
+    stat = os.stat(in_file)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def _iter_records(data):
+    """
+    Yield the (start, end) byte range of each csv record, including quoted fields that span lines.
+
+    :param data: The csv file contents (bytes or mmap)
+    """
+    size = len(data)
+    start = 0
+    while start < size:
+        end = start
+        quotes = 0
+        # A record only ends on a newline outside of quotes
+        while True:
+            line_end = data.find(b"\n", end)
+            line_end = size if line_end == -1 else line_end + 1
+            quotes += data[end:line_end].count(b'"')
+            end = line_end
+            if quotes % 2 == 0 or end >= size:
+                break
+        yield start, end
+        start = end
+
+
+def _parse_record(record):
+    return next(csv.reader(io.StringIO(record.decode("utf-8", errors="replace"))), [])
+
+
+def build_dataset_index(in_file):
+    """
+    Scan a dataset csv once, recording the byte offset of every row and the number of rows per label.
+
+    :param in_file: The path of the dataset csv
+    :return: The index as a dictionary with signature, sha256, columns, offsets, labels and label_counts
+    """
+    # mmap can't map an empty file, so check before opening it
+    if os.path.getsize(in_file) == 0:
+        raise ValueError(f"Dataset is empty: {in_file}")
+    with open(in_file, "rb") as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            sha256 = hashlib.sha256(data).hexdigest()
+            records = _iter_records(data)
+            header = next(records, None)
+            if header is None:
+                raise ValueError(f"Dataset is empty: {in_file}")
+            columns = [column.lstrip("\ufeff") for column in _parse_record(data[header[0]:header[1]])]
+            label_column = columns.index("label") if "label" in columns else None
+            offsets = []
+            labels = []
+            for start, end in records:
+                record = data[start:end]
+                # Skip blank lines, pandas does the same
+                if not record.strip():
+                    continue
+                offsets.append([start, end - start])
+                if label_column is not None:
+                    fields = _parse_record(record)
+                    labels.append(fields[label_column] if label_column < len(fields) else "")
+
+    label_counts = {}
+    for label in labels:
+        label_counts[label] = label_counts.get(label, 0) + 1
+    return {
+        "version": INDEX_VERSION,
+        "signature": _file_signature(in_file),
+        "sha256": sha256,
+        "columns": columns,
+        "offsets": offsets,
+        "labels": labels,
+        "label_counts": label_counts,
+    }
+
+
+def get_dataset_index(in_file):
+    """
+    Get the index for a dataset csv, building it if it is missing or the file has changed.
+
+    :param in_file: The path of the dataset csv
+    :return: The index as a dictionary (see build_dataset_index)
+    """
+    signature = _file_signature(in_file)
+    key = os.path.abspath(in_file)
+    with _indexes_lock:
+        index = _indexes.get(key)
+    if index and index["signature"] == signature:
+        return index
+
+    index_path = _index_path(in_file)
+    index = None
+    if os.path.exists(index_path):
+        try:
+            with open(index_path, "r", encoding="utf-8") as f:
+                index = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Error reading dataset index for {in_file}: {str(e)}")
+            index = None
+    if not index or index.get("version") != INDEX_VERSION or index.get("signature") != signature:
+        index = build_dataset_index(in_file)
+        os.makedirs(INDEX_DIRECTORY, exist_ok=True)
+        # Write to a temporary file first so other processes never read a partial index
+        temp_path = f"{index_path}.{os.getpid()}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(index, f)
+        os.replace(temp_path, index_path)
+
+    with _indexes_lock:
+        _indexes[key] = index
+    return index
+
+
+def sample_row_numbers(index, num_rows, stratified=False, rng=None):
+    """
+    Pick random row numbers from a dataset index.
+
+    :param index: The dataset index
+    :param num_rows: The number of rows to pick, limited to the number of rows in the dataset
+    :param stratified: If True, pick rows so each label keeps its share of the dataset
+    :param rng: Optional random.Random to use
+    :return: A list of row numbers in random order
+    """
+    rng = rng or random.Random()
+    # Every data row can be picked. Runs before the index used df.iloc[1:], which skipped the first data row
+    # as if it were a second header, so their samples never included row 0
+    total = len(index["offsets"])
+    num_rows = min(num_rows, total)
+    if not stratified or not index["labels"]:
+        return rng.sample(range(total), num_rows)
+
+    rows_by_label = {}
+    for row_number, label in enumerate(index["labels"]):
+        rows_by_label.setdefault(label, []).append(row_number)
+
+    # Split num_rows between labels by their share, giving leftover rows to the largest remainders
+    shares = {label: num_rows * len(rows) / total for label, rows in rows_by_label.items()}
+    counts = {label: int(share) for label, share in shares.items()}
+    leftover = num_rows - sum(counts.values())
+    for label in sorted(shares, key=lambda label: shares[label] - counts[label], reverse=True)[:leftover]:
+        counts[label] += 1
+
+    row_numbers = []
+    for label, rows in rows_by_label.items():
+        row_numbers.extend(rng.sample(rows, counts[label]))
+    rng.shuffle(row_numbers)
+    return row_numbers
+
+
+def read_rows(in_file, row_numbers, index=None):
+    """
+    Read only the given rows of a dataset csv.
+
+    :param in_file: The path of the dataset csv
+    :param row_numbers: The row numbers to read (0 is the first row after the header)
+    :param index: The dataset index, looked up if not given
+    :return: A list of dictionaries mapping column names to values, in the order of row_numbers
+    """
+    index = index or get_dataset_index(in_file)
+    columns = index["columns"]
+    offsets = index["offsets"]
+    rows = []
+    if not row_numbers:
+        return rows
+    # The file may have been emptied since it was indexed, and mmap can't map an empty file
+    if os.path.getsize(in_file) == 0:
+        raise ValueError(f"Dataset is empty: {in_file}")
+    with open(in_file, "rb") as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            for row_number in row_numbers:
+                start, length = offsets[row_number]
+                fields = _parse_record(data[start:start + length])
+                rows.append(dict(zip(columns, fields)))
+    return rows
@@ -0,0 +1,106 @@
+import json
+import os
+import threading
+from helper_functions.dataset_index import get_dataset_index
+
+SCRIPT_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATASETS_DIRECTORY = os.path.join(SCRIPT_DIRECTORY, "static", "datasets")
+DATASET_MAPPING_PATH = os.path.join(DATASETS_DIRECTORY, "dataset_mapping.json")
+
+# The mtimes the registry was built from: the mapping file and each dataset file
+_registry = {"mtimes": None, "datasets": {}}
+_registry_lock = threading.Lock()
+
+
+def _load_registry():
+    """
+    Read dataset_mapping.json and describe each dataset from its file: the actual number of rows,
+    the rows per label and the sha256 of the csv (from the dataset index, which is built once per file).
+
+    :return: A dictionary of dataset name to metadata
+    """
+    with open(DATASET_MAPPING_PATH, "r") as f:
+        mapping = json.load(f)
+
+    datasets = {}
+    for name, info in mapping.items():
+        directory = info.get("directory")
+        if not isinstance(directory, list) or len(directory) != 2:
+            print(f"Skipping dataset {name}: directory must be [folder, filename]")
+            continue
+        folder, filename = directory
+        file_path = os.path.realpath(os.path.join(DATASETS_DIRECTORY, folder, filename))
+        # Only files inside the datasets directory can be registered
+        if not file_path.startswith(os.path.realpath(DATASETS_DIRECTORY) + os.sep):
+            print(f"Skipping dataset {name}: path is outside of the datasets directory")
+            continue
+        if not os.path.isfile(file_path):
+            print(f"Skipping dataset {name}: {file_path} does not exist")
+            continue
+        try:
+            index = get_dataset_index(file_path)
+        except (OSError, ValueError) as e:
+            print(f"Skipping dataset {name}: {str(e)}")
+            continue
+
+        rows = len(index["offsets"])
+        if info.get("rows") is not None and info["rows"] != rows:
+            print(f"Dataset {name} lists {info['rows']} rows but has {rows}")
+        datasets[name] = {
+            "name": name,
+            "folder": folder,
+            "filename": filename,
+            "file_path": file_path,
+            "subject": info.get("subject", ""),
+            "rows": rows,
+            "label_counts": index["label_counts"],
+            "sha256": index["sha256"],
+        }
+    return datasets
+
+
+def _get_mtimes(datasets):
+    mtimes = [os.stat(DATASET_MAPPING_PATH).st_mtime_ns]
+    for dataset in datasets.values():
+        try:
+            mtimes.append(os.stat(dataset["file_path"]).st_mtime_ns)
+        except OSError:
+            mtimes.append(None)
+    return mtimes
+
+
+def get_datasets():
+    """
+    Get the registered datasets, reloading only when dataset_mapping.json or one of the datasets has changed.
+
+    :return: A dictionary of dataset name to metadata (name, folder, filename, file_path, subject, rows, label_counts, sha256)
+    """
+    datasets = _registry["datasets"]
+    try:
+        mtimes = _get_mtimes(datasets)
+    except OSError as e:
+        print(f"Error reading dataset mapping: {str(e)}")
+        return datasets
+    if mtimes == _registry["mtimes"]:
+        return datasets
+
+    with _registry_lock:
+        # Another thread may have reloaded while this one waited
+        if _registry["datasets"] is datasets:
+            try:
+                datasets = _load_registry()
+                _registry["datasets"] = datasets
+                _registry["mtimes"] = _get_mtimes(datasets)
+            except (OSError, ValueError) as e:
+                print(f"Error loading dataset mapping: {str(e)}")
+    return _registry["datasets"]
+
+
+def get_dataset(name):
+    """
+    Get a registered dataset by name.
+
+    :param name: The name of the dataset
+    :return: The dataset's metadata, or None if there is no such dataset
+    """
+    return get_datasets().get(name)
@@ -1,15 +1,13 @@
 import math
-import smtplib
 import os
 import sys
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
 from dotenv import load_dotenv
 import re
 import random
 import string
 from helper_functions.database import get_db_connection, execute_sql, sql_results_one
 from helper_functions.account_actions import create_password_reset_token, create_account_removal_token
+from helper_functions.email_outbox import queue_email
 
 # Determine the path to the .env file
 env_path = os.path.join(os.path.dirname(sys.argv[0]), '..', '.env')
@@ -18,14 +16,6 @@ env_path = os.path.join(os.path.dirname(sys.argv[0]), '..', '.env')
 load_dotenv(env_path)
 
 def send_email(receiver_email, csv_download_link, xlsx_download_link, stats, prompt):
-    sender_email = os.environ['EMAIL']
-    sender_password = os.environ['EMAIL_PASSWORD']
-
-    message = MIMEMultipart()
-    message['From'] = sender_email
-    message['To'] = receiver_email
-    message['Subject'] = "Disinformation Detection Results"
-
     # prep body variables
     stats["prompt"] = prompt
     stats["csv_download_link"] = csv_download_link
@@ -63,23 +53,8 @@ confusion-matrix-accuracy-recall-precision-false-positive-rate-and-f-scores-expl
 Your results xlsx file can be downloaded from the Disinformation Detection website using the following link: {xlsx_download_link}
 Alternatively, if you are unable to open xlsx files, you can download a csv file containing your results using the following link: {csv_download_link}
 """.format(**stats)
-    
-    # testing
-    print(body)
 
-    message.attach(MIMEText(body, 'plain'))
-
-    try:
-        server = smtplib.SMTP('smtp.gmail.com', 587)
-        server.starttls()
-        server.login(sender_email, sender_password)
-        text = message.as_string()
-        server.sendmail(sender_email, receiver_email, text)
-        print("Email sent successfully!")
-    except Exception as e:
-        print(f"An error occurred: {e}")
-    finally:
-        server.quit()
+    return queue_email(receiver_email, "Disinformation Detection Results", body)
 
 
 def check_email(email):
@@ -102,31 +77,11 @@ def send_verification_email(receiver_email):
     if not verification_code:
         return False, error_message
 
-    sender_email = os.environ['EMAIL']
-    sender_password = os.environ['EMAIL_PASSWORD']
-
-    message = MIMEMultipart()
-    message['From'] = sender_email
-    message['To'] = receiver_email
-    message['Subject'] = "Verify Your Email - Disinformation Detection"
+    subject = "Verify Your Email - Disinformation Detection"
     body = f"""
     Your verification code for Disinformation Detection is: {verification_code}
     """
-    message.attach(MIMEText(body, 'plain'))
-
-    server = None
-    try:
-        server = smtplib.SMTP('smtp.gmail.com', 587)
-        server.starttls()
-        server.login(sender_email, sender_password)
-        text = message.as_string()
-        server.sendmail(sender_email, receiver_email, text)
-        return True, "Email sent"
-    except Exception as e:
-        print(f"An error occurred: {e}")
-        return False, f"An error occurred: {e}"
-    finally:
-        server.quit()
+    return queue_email(receiver_email, subject, body)
 
 # Function to generate a random verification code
 def generate_verification_code(receiver_email):
@@ -180,30 +135,11 @@ def resend_verification_email(receiver_email):
     if not verification_code:
         return False, error_message
 
-    sender_email = os.environ['EMAIL']
-    sender_password = os.environ['EMAIL_PASSWORD']
-
-    message = MIMEMultipart()
-    message['From'] = sender_email
-    message['To'] = receiver_email
-    message['Subject'] = "Verify Your Email - Disinformation Detection"
+    subject = "Verify Your Email - Disinformation Detection"
     body = f"""
     Your verification code for Disinformation Detection is: {verification_code}
     """
-    message.attach(MIMEText(body, 'plain'))
-
-    try:
-        server = smtplib.SMTP('smtp.gmail.com', 587)
-        server.starttls()
-        server.login(sender_email, sender_password)
-        text = message.as_string()
-        server.sendmail(sender_email, receiver_email, text)
-        return True, "Email sent"
-    except Exception as e:
-        print(f"An error occurred: {e}")
-        return False, f"An error occurred: {e}"
-    finally:
-        server.quit()
+    return queue_email(receiver_email, subject, body)
 
 
 def validate_password(password):
@@ -272,25 +208,6 @@ def send_account_removal_email(base_url, user_id):
 
 
 # Send generic emails, this is a helper function
-def send_generic_email(receiver_email, subject, body):
-    # Get environment variables
-    sender_email = os.environ['EMAIL']
-    sender_password = os.environ['EMAIL_PASSWORD']
-    # Prepare message
-    message = MIMEMultipart()
-    message['From'] = sender_email
-    message['To'] = receiver_email
-    message['Subject'] = subject
-    message.attach(MIMEText(body, 'plain'))
-
-    try:
-        server = smtplib.SMTP('smtp.gmail.com', 587)
-        server.starttls()
-        server.login(sender_email, sender_password)
-        text = message.as_string()
-        server.sendmail(sender_email, receiver_email, text)
-        return True, "Email sent"
-    except Exception as e:
-        return False, f"An error occurred while sending the email: {e}"
-    finally:
-        server.quit()
\ No newline at end of file
+def send_generic_email(receiver_email, subject, body, db=None):
+    # The email is sent in the background by the email sender, see email_outbox
+    return queue_email(receiver_email, subject, body, db=db)
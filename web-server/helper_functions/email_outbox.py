@@ -0,0 +1,256 @@
+import os
+import smtplib
+import time
+from email.mime.text import MIMEText
+from email.mime.multipart import MIMEMultipart
+from helper_functions.database import execute_sql, Database
+
+# How emails are delivered: "smtp", or "console" to print them instead (for development)
+EMAIL_TRANSPORT = os.getenv("EMAIL_TRANSPORT", "smtp")
+
+# SMTP server settings. For a local debugging server use SMTP_HOST=localhost, SMTP_PORT=1025 and SMTP_STARTTLS=false.
+SMTP_HOST = os.getenv("SMTP_HOST", "smtp.gmail.com")
+SMTP_PORT = int(os.getenv("SMTP_PORT", 587))
+SMTP_STARTTLS = os.getenv("SMTP_STARTTLS", "true").lower() == "true"
+SMTP_TIMEOUT = float(os.getenv("SMTP_TIMEOUT", 30))
+
+# Seconds the SMTP connection is kept open with nothing to send
+SMTP_IDLE_SECONDS = float(os.getenv("SMTP_IDLE_SECONDS", 60))
+
+# Emails claimed from the outbox at a time
+EMAIL_BATCH_SIZE = int(os.getenv("EMAIL_BATCH_SIZE", 20))
+
+# Failed sends are retried after EMAIL_RETRY_SECONDS, doubling each attempt, until EMAIL_MAX_ATTEMPTS
+EMAIL_MAX_ATTEMPTS = int(os.getenv("EMAIL_MAX_ATTEMPTS", 5))
+EMAIL_RETRY_SECONDS = int(os.getenv("EMAIL_RETRY_SECONDS", 30))
+
+# Seconds to wait before checking an empty outbox again
+EMAIL_POLL_INTERVAL = float(os.getenv("EMAIL_POLL_INTERVAL", 2))
+
+INSERT_QUERY = "INSERT INTO email_outbox (receiver_email, subject, body) VALUES (%s, %s, %s);"
+
+CLAIM_QUERY = """SELECT id, receiver_email, subject, body, attempts FROM email_outbox
+WHERE status = 'PENDING' AND next_attempt_at <= utc_timestamp()
+ORDER BY next_attempt_at ASC, id ASC
+LIMIT %s
+FOR UPDATE SKIP LOCKED;"""
+
+
+class SMTPTransport:
+    def __init__(self, host=SMTP_HOST, port=SMTP_PORT, starttls=SMTP_STARTTLS, username=None, password=None, timeout=SMTP_TIMEOUT):
+        """
+        Sends emails over a single SMTP connection that is reused between emails.
+
+        :param host: The SMTP server
+        :param port: The SMTP port
+        :param starttls: Whether to upgrade the connection with STARTTLS
+        :param username: The login, EMAIL if not given
+        :param password: The password, EMAIL_PASSWORD if not given. Without a password no login is made.
+        :param timeout: Seconds to wait for the server
+        """
+        self.host = host
+        self.port = port
+        self.starttls = starttls
+        self.username = username or os.getenv("EMAIL")
+        self.password = password or os.getenv("EMAIL_PASSWORD")
+        self.timeout = timeout
+        self.server = None
+
+    def connect(self):
+        self.server = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        if self.starttls:
+            self.server.starttls()
+        if self.password:
+            self.server.login(self.username, self.password)
+
+    def send(self, sender_email, receiver_email, message):
+        """
+        Send a message, connecting first if needed.
+
+        :param sender_email: The sender address
+        :param receiver_email: The recipient address
+        :param message: The full message as a string
+        """
+        if self.server is None:
+            self.connect()
+            self.server.sendmail(sender_email, receiver_email, message)
+            return
+        try:
+            self.server.sendmail(sender_email, receiver_email, message)
+        except (smtplib.SMTPServerDisconnected, OSError):
+            # The server closed the idle connection, reconnect once
+            self.close()
+            self.connect()
+            self.server.sendmail(sender_email, receiver_email, message)
+
+    def close(self):
+        if self.server is None:
+            return
+        try:
+            self.server.quit()
+        except (smtplib.SMTPException, OSError):
+            pass
+        self.server = None
+
+
+class ConsoleTransport:
+    """Prints emails instead of sending them."""
+
+    def send(self, sender_email, receiver_email, message):
+        print(f"Email from {sender_email} to {receiver_email}:\n{message}")
+
+    def close(self):
+        pass
+
+
+EMAIL_TRANSPORTS = {
+    'smtp': SMTPTransport,
+    'console': ConsoleTransport,
+}
+
+def get_transport(name=EMAIL_TRANSPORT):
+    """
+    Create an email transport by name.
+
+    :param name: The name of the transport (smtp or console)
+    :return: The transport
+    """
+    if name not in EMAIL_TRANSPORTS:
+        raise ValueError(f"Unknown email transport: {name}")
+    return EMAIL_TRANSPORTS[name]()
+
+
+# Add an email to the outbox
+def queue_email(receiver_email, subject, body, db=None):
+    """
+    Store an email in the outbox, to be sent by the email sender in the background.
+
+    :param receiver_email: The recipient address
+    :param subject: The subject
+    :param body: The plain text body
+    :param db: An open Database transaction, so the email is only sent if the transaction commits
+    :return: A tuple containing a boolean indicating success and a message
+    """
+    if db is not None:
+        status, message = db.execute(INSERT_QUERY, (receiver_email, subject, body,))
+    else:
+        status, message = execute_sql(INSERT_QUERY, (receiver_email, subject, body,))
+    if not status:
+        return False, f"An error occurred while queueing the email: {message}"
+    return True, "Email sent"
+
+
+def build_message(sender_email, receiver_email, subject, body):
+    message = MIMEMultipart()
+    message['From'] = sender_email
+    message['To'] = receiver_email
+    message['Subject'] = subject
+    message.attach(MIMEText(body, 'plain'))
+    return message.as_string()
+
+
+def claim_emails(limit=EMAIL_BATCH_SIZE):
+    """
+    Claim the next emails that are due and mark them as SENDING.
+
+    :param limit: The most emails to claim
+    :return: A tuple containing a boolean indicating success, a message, and a list of (id, receiver_email, subject, body, attempts) tuples
+    """
+    with Database() as db:
+        status, message, result = db.execute_fetchall(CLAIM_QUERY, (limit,))
+        if not status:
+            db.rollback()
+            return False, message, None
+        if not result:
+            return True, "Outbox is empty", []
+        ids = [row[0] for row in result]
+        placeholders = ", ".join(["%s"] * len(ids))
+        status, message = db.execute(f"UPDATE email_outbox SET status = 'SENDING' WHERE id IN ({placeholders});", tuple(ids))
+        if not status:
+            db.rollback()
+            return False, message, None
+        db.commit()
+    return True, "Good", result
+
+
+def record_failure(email_id, attempts, error, permanent=False):
+    """
+    Schedule a retry of a failed email with exponential backoff, or mark it FAILED once it runs out of attempts.
+
+    :param email_id: The id of the email in email_outbox
+    :param attempts: The number of attempts made, including this one
+    :param error: The error of this attempt
+    :param permanent: Whether retrying can't help (e.g. the recipient was refused)
+    :return: A tuple containing a boolean indicating success and a message
+    """
+    if permanent or attempts >= EMAIL_MAX_ATTEMPTS:
+        query = "UPDATE email_outbox SET status = 'FAILED', attempts = %s, last_error = %s WHERE id = %s;"
+        return execute_sql(query, (attempts, str(error)[:1000], email_id,))
+    delay = EMAIL_RETRY_SECONDS * 2 ** (attempts - 1)
+    query = """UPDATE email_outbox SET status = 'PENDING', attempts = %s, last_error = %s,
+    next_attempt_at = utc_timestamp() + INTERVAL %s SECOND WHERE id = %s;"""
+    return execute_sql(query, (attempts, str(error)[:1000], delay, email_id,))
+
+
+def send_pending_emails(transport):
+    """
+    Send one batch of due emails from the outbox.
+
+    :param transport: The transport used to send the emails
+    :return: The number of emails claimed
+    """
+    status, message, emails = claim_emails()
+    if not status:
+        print(f"Error claiming emails: {message}")
+        return 0
+
+    sender_email = os.getenv("EMAIL")
+    for email_id, receiver_email, subject, body, attempts in emails:
+        attempts += 1
+        try:
+            transport.send(sender_email, receiver_email, build_message(sender_email, receiver_email, subject, body))
+        except smtplib.SMTPRecipientsRefused as e:
+            print(f"Email {email_id} to {receiver_email} was refused: {e}")
+            status, message = record_failure(email_id, attempts, e, permanent=True)
+        except Exception as e:
+            print(f"An error occurred sending email {email_id}: {e}")
+            # Start over with a fresh connection on the next attempt
+            transport.close()
+            status, message = record_failure(email_id, attempts, e)
+        else:
+            status, message = execute_sql("UPDATE email_outbox SET status = 'SENT', attempts = %s, sent_at = utc_timestamp() WHERE id = %s;", (attempts, email_id,))
+        if not status:
+            print("ERROR:", message)
+    return len(emails)
+
+
+def requeue_interrupted_emails():
+    """
+    Move emails left SENDING by a stopped sender back to PENDING.
+    They may have been delivered already, but a duplicate is better than a lost email.
+    Only call this when no email sender is running.
+
+    :return: A tuple containing a boolean indicating success and a message
+    """
+    return execute_sql("UPDATE email_outbox SET status = 'PENDING' WHERE status = 'SENDING';")
+
+
+def email_sender_loop(stop_event, transport=None):
+    """
+    Send emails from the outbox until a shutdown is requested, keeping the connection open while there is mail to send.
+
+    :param stop_event: Set when the sender should stop
+    :param transport: The transport to use, EMAIL_TRANSPORT if not given
+    """
+    transport = transport or get_transport()
+    last_sent = time.monotonic()
+    try:
+        while not stop_event.is_set():
+            if send_pending_emails(transport):
+                last_sent = time.monotonic()
+                continue
+            if time.monotonic() - last_sent >= SMTP_IDLE_SECONDS:
+                transport.close()
+            stop_event.wait(EMAIL_POLL_INTERVAL)
+    finally:
+        transport.close()
@@ -1,8 +1,11 @@
 from helper_functions.database import execute_sql
 
+# Fail running tasks that were not started through the task queue, they cannot be resumed
 def fail_running_tasks():
     try:
-        status, message = execute_sql("UPDATE running_tasks SET status = 'FAILED' WHERE status = 'RUNNING';")
+        query = """UPDATE running_tasks SET status = 'FAILED', end_time = utc_timestamp()
+        WHERE status = 'RUNNING' AND process_id NOT IN (SELECT task_id FROM task_queue);"""
+        status, message = execute_sql(query)
         if not status:
             print(f"Error failing running task: {message}")
             return False, f"Error failing running task: {message}"
@@ -0,0 +1,133 @@
+import json
+import uuid
+import mysql.connector
+from helper_functions.database import execute_sql, execute_sql_return_id, sql_results_one, Database, get_pool
+
+# MySQL lock held by the running worker.py for as long as it runs, so a second one can't requeue tasks the first is running
+WORKER_LOCK_NAME = "disinformation_detection_worker"
+
+# Claim the next pending task, preferring users with the fewest tasks currently running
+CLAIM_QUERY = """SELECT running_tasks.process_id, running_tasks.uuid, task_queue.run_args
+FROM running_tasks
+INNER JOIN task_queue ON task_queue.task_id = running_tasks.process_id
+LEFT JOIN (
+    SELECT user_id, COUNT(*) AS num_running FROM running_tasks WHERE status = 'RUNNING' GROUP BY user_id
+) AS user_load ON user_load.user_id = running_tasks.user_id
+WHERE running_tasks.status = 'PENDING'
+ORDER BY COALESCE(user_load.num_running, 0) ASC, running_tasks.start_time ASC, running_tasks.process_id ASC
+LIMIT 1
+FOR UPDATE OF running_tasks SKIP LOCKED;"""
+
+# Add a prompt run to the queue
+def enqueue_task(run_args):
+    """
+    Add a prompt run to the task queue as a PENDING task.
+
+    :param run_args: The arguments for the run (prompt, email, base_url, user_id, dataset_info, num_rows, comp_id)
+    :return: A tuple containing a boolean indicating success, a message, and the uuid of the task
+    """
+    uuid_name = str(uuid.uuid4())
+    status, message, task_id = execute_sql_return_id("INSERT INTO running_tasks (user_id, uuid, status) VALUES (%s, %s, 'PENDING');", (run_args["user_id"], uuid_name,))
+    if not status or not task_id:
+        return False, message, None
+
+    # Link the task to its competition
+    if run_args.get("comp_id"):
+        status, message = execute_sql("INSERT INTO running_task_competition (task_id, competition_id) VALUES (%s, %s);", (task_id, run_args["comp_id"],))
+        if not status:
+            execute_sql("DELETE FROM running_tasks WHERE process_id = %s;", (task_id,))
+            return False, message, None
+
+    status, message = execute_sql("INSERT INTO task_queue (task_id, run_args) VALUES (%s, %s);", (task_id, json.dumps(run_args),))
+    if not status:
+        execute_sql("DELETE FROM running_tasks WHERE process_id = %s;", (task_id,))
+        return False, message, None
+    return True, "Good", uuid_name
+
+# Claim the next task for a worker
+def claim_next_task():
+    """
+    Claim the next pending task and mark it as RUNNING.
+
+    :return: A tuple containing a boolean indicating success, a message, and a (task_id, uuid, run_args) tuple or None if the queue is empty
+    """
+    with Database() as db:
+        status, message, result = db.execute_fetchone(CLAIM_QUERY)
+        if not status:
+            db.rollback()
+            return False, message, None
+        if not result:
+            return True, "Queue is empty", None
+        task_id, uuid_name, run_args = result
+
+        status, message = db.execute("UPDATE running_tasks SET status = 'RUNNING' WHERE process_id = %s;", (task_id,))
+        if not status:
+            db.rollback()
+            return False, message, None
+        db.commit()
+    return True, "Good", (task_id, uuid_name, json.loads(run_args))
+
+# Check if a user already has a task queued or running
+def user_has_active_task(user_id):
+    """
+    Check if a user has a PENDING or RUNNING task.
+
+    :param user_id: The id of the user
+    :return: A tuple containing a boolean indicating success, a message, and whether the user has an active task
+    """
+    status, message, result = sql_results_one("SELECT process_id FROM running_tasks WHERE user_id = %s AND status IN ('PENDING', 'RUNNING') LIMIT 1;", (user_id,))
+    if not status:
+        return False, message, None
+    return True, "Good", bool(result)
+
+# Put tasks interrupted by a worker shutdown back in the queue
+def requeue_interrupted_tasks():
+    """
+    Move queued tasks left RUNNING by a stopped worker back to PENDING, so a worker
+    resumes them from their checkpoint (or starts them again if they have none).
+    Only call this while holding the worker lock (see acquire_worker_lock), so no other worker is running them.
+
+    :return: A tuple containing a boolean indicating success and a message
+    """
+    query = """UPDATE running_tasks SET status = 'PENDING'
+    WHERE status = 'RUNNING' AND process_id IN (SELECT task_id FROM task_queue);"""
+    return execute_sql(query)
+
+# Make sure only one worker.py runs at a time
+def acquire_worker_lock():
+    """
+    Take the worker lock on a connection of its own. MySQL holds the lock until that connection closes,
+    so it is released when the worker stops, even if it is killed.
+
+    :return: A tuple containing a boolean indicating success, a message, and the connection holding the lock
+    """
+    try:
+        conn = get_pool().connect()
+    except mysql.connector.Error as e:
+        return False, f"Unable to connect to the database: {str(e)}", None
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT GET_LOCK(%s, 0);", (WORKER_LOCK_NAME,))
+        result = cursor.fetchone()
+        cursor.close()
+    except mysql.connector.Error as e:
+        conn.close()
+        return False, f"Unable to take the worker lock: {str(e)}", None
+    if not result or result[0] != 1:
+        conn.close()
+        return False, "Another worker is already running", None
+    return True, "Good", conn
+
+# Check that the worker lock is still held
+def check_worker_lock(conn):
+    """
+    Ping the connection holding the worker lock, which also keeps it from timing out.
+
+    :param conn: The connection returned by acquire_worker_lock
+    :return: A tuple containing a boolean indicating whether the lock is still held and a message
+    """
+    try:
+        conn.ping(reconnect=False)
+    except mysql.connector.Error as e:
+        return False, f"Lost the connection holding the worker lock: {str(e)}"
+    return True, "Good"
@@ -0,0 +1,89 @@
+import decimal
+from helper_functions.database import sql_results_one, sql_results_all
+from helper_functions.pagination import keyset_condition, order_by_clause, split_page, cached_count
+
+# Keep the best fscore of each user in a competition, and the result it came from.
+# MySQL assigns left to right, so highest_fscore goes last and the other columns compare against its old value.
+UPSERT_QUERY = """INSERT INTO competition_leaderboard (competition_id, user_id, highest_fscore, result_id)
+VALUES (%s, %s, %s, %s)
+ON DUPLICATE KEY UPDATE
+    result_id = IF(VALUES(highest_fscore) > highest_fscore, VALUES(result_id), result_id),
+    updated_at = IF(VALUES(highest_fscore) > highest_fscore, utc_timestamp(), updated_at),
+    highest_fscore = GREATEST(highest_fscore, VALUES(highest_fscore));"""
+
+# Record a new competition result on the leaderboard
+def update_leaderboard(db, competition_id, user_id, result_id, fscore):
+    """
+    Update a user's leaderboard entry with a new result, keeping their highest fscore.
+
+    :param db: The Database the result_in_competition row was inserted with, so both are committed together
+    :param competition_id: The id of the competition
+    :param user_id: The id of the user
+    :param result_id: The id of the new result
+    :param fscore: The fscore of the new result
+    :return: A tuple containing a boolean indicating success and a message
+    """
+    return db.execute(UPSERT_QUERY, (competition_id, user_id, round(float(fscore), 2), result_id,))
+
+
+# Get a page of a competition's leaderboard
+def get_leaderboard_page(competition_id, per_page, after=None):
+    """
+    Get a page of a competition's leaderboard, best score first, starting after a cursor.
+    Ranks follow RANK(): tied scores share a rank and the next rank skips ahead.
+
+    :param competition_id: The id of the competition
+    :param per_page: The number of entries per page
+    :param after: The [highest_fscore, user_id] of the last entry on the previous page, or None for the first page
+    :return: A tuple containing a boolean indicating success, a message, a list of (full_name, highest_fscore, rank, fscore_ci) tuples,
+             and the cursor values for the next page (None on the last page). fscore_ci is [low, high], or None for results saved without intervals.
+    """
+    order_by = [("competition_leaderboard.highest_fscore", "DESC"), ("competition_leaderboard.user_id", "ASC")]
+    condition, condition_values = ("TRUE", ()) if after is None else keyset_condition(order_by, after[:2])
+    query = f"""SELECT users.full_name, competition_leaderboard.highest_fscore, competition_leaderboard.user_id,
+        results.fscore_ci_low, results.fscore_ci_high
+    FROM competition_leaderboard
+    INNER JOIN users ON users.user_id = competition_leaderboard.user_id
+    LEFT JOIN results ON results.id = competition_leaderboard.result_id
+    WHERE competition_leaderboard.competition_id = %s AND {condition}
+    ORDER BY {order_by_clause(order_by)}
+    LIMIT %s;"""
+    status, message, rows = sql_results_all(query, (competition_id,) + condition_values + (per_page + 1,))
+    if not status:
+        return False, message, None, None
+    rows, has_more = split_page(rows, per_page)
+    if not rows:
+        return True, "Good", [], None
+
+    # Continue the ranking from the previous page. The entries before the page are counted here rather than
+    # carried in the cursor, so the ranks shown can't be set by the client
+    if after is None:
+        position, rank, previous_score = 0, 1, rows[0][1]
+    else:
+        previous_score = decimal.Decimal(str(after[0]))
+        status, message, counts = sql_results_one(
+            """SELECT COUNT(*), COALESCE(SUM(highest_fscore > %s), 0) FROM competition_leaderboard
+            WHERE competition_id = %s AND (highest_fscore > %s OR (highest_fscore = %s AND user_id <= %s));""",
+            (previous_score, competition_id, previous_score, previous_score, after[1],)
+        )
+        if not status:
+            return False, message, None, None
+        # A first entry tied with the cursor shares the rank of every entry with that score
+        position, rank = int(counts[0]), int(counts[1]) + 1
+
+    entries = []
+    for full_name, highest_fscore, user_id, fscore_ci_low, fscore_ci_high in rows:
+        position += 1
+        if highest_fscore != previous_score:
+            rank = position
+            previous_score = highest_fscore
+        fscore_ci = [fscore_ci_low, fscore_ci_high] if fscore_ci_low is not None else None
+        entries.append((full_name, highest_fscore, rank, fscore_ci))
+
+    next_after = [rows[-1][1], rows[-1][2]] if has_more else None
+    return True, "Good", entries, next_after
+
+
+# Count the users on a competition's leaderboard
+def count_leaderboard(competition_id):
+    return cached_count("SELECT COUNT(*) FROM competition_leaderboard WHERE competition_id = %s;", (competition_id,))
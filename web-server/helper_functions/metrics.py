@@ -0,0 +1,138 @@
+import math
+import threading
+
+
+def _normalize(value):
+    # Values come from the model as text, or from the csv as text, so "1", " 1" and 1 are counted together
+    if value is None:
+        return None
+    text = str(value).strip()
+    if text == "":
+        return None
+    try:
+        return int(text)
+    except ValueError:
+        return text
+
+
+def _sort_key(value):
+    # Numbers first, then any text the model answered with
+    return (isinstance(value, str), value)
+
+
+def _ratio(numerator, denominator):
+    return numerator / denominator if denominator != 0 else 0
+
+
+class MetricsAccumulator:
+    def __init__(self):
+        """
+        Keeps the confusion matrix and the confidence and truth level histograms of a prompt run,
+        updated one row at a time, so the run's stats are available at any point without re-reading the results.
+        """
+        self.num_rows = 0
+        self.confusion = {}
+        self.confidence = {}
+        self.truth = {}
+        self.lock = threading.Lock()
+
+    def add(self, label, response, confidence_level, truth_level):
+        """
+        Count one evaluated row.
+
+        :param label: The dataset label (1 is disinformation)
+        :param response: The model's answer
+        :param confidence_level: The model's confidence level
+        :param truth_level: The model's truth level
+        """
+        label, response = _normalize(label), _normalize(response)
+        confidence_level, truth_level = _normalize(confidence_level), _normalize(truth_level)
+        with self.lock:
+            self.num_rows += 1
+            if label is not None and response is not None:
+                self.confusion[(label, response)] = self.confusion.get((label, response), 0) + 1
+            if confidence_level is not None:
+                self.confidence[confidence_level] = self.confidence.get(confidence_level, 0) + 1
+            if truth_level is not None:
+                self.truth[truth_level] = self.truth.get(truth_level, 0) + 1
+
+    def add_output_row(self, output_row):
+        """
+        Count a row of the output csv (see CSV_HEADERS in web_detect).
+        """
+        self.add(output_row[5], output_row[6], output_row[7], output_row[8])
+
+    def count(self, label, response):
+        return self.confusion.get((label, response), 0)
+
+    def confusion_table(self):
+        """
+        The confusion matrix as rows of [label, count per response..., total], ending with a "Total" row.
+
+        :return: A tuple of the response values (the columns) and the rows
+        """
+        with self.lock:
+            confusion = dict(self.confusion)
+        labels = sorted({label for label, _ in confusion}, key=_sort_key)
+        responses = sorted({response for _, response in confusion}, key=_sort_key)
+        rows = []
+        for label in labels:
+            counts = [confusion.get((label, response), 0) for response in responses]
+            rows.append([label] + counts + [sum(counts)])
+        totals = [sum(confusion.get((label, response), 0) for label in labels) for response in responses]
+        rows.append(["Total"] + totals + [sum(totals)])
+        return responses, rows
+
+    def histogram(self, name):
+        """
+        :param name: "confidence" or "truth"
+        :return: A list of (level, count) tuples, sorted by level
+        """
+        with self.lock:
+            counts = dict(self.confidence if name == "confidence" else self.truth)
+        return sorted(counts.items(), key=lambda item: _sort_key(item[0]))
+
+    def stats(self, digits=2):
+        """
+        Derive the run's metrics from the counts so far.
+
+        :param digits: Digits accuracy, precision, recall and fscore are rounded to
+        :return: A dictionary of the confusion counts, accuracy, precision, recall, fscore, the TPR/FPR/FNR/TNR rates and percentages
+        """
+        with self.lock:
+            tp, tn = self.count(1, 1), self.count(0, 0)
+            fn, fp = self.count(1, 0), self.count(0, 1)
+            num_rows = self.num_rows
+            classified = sum(self.confusion.values())
+
+        accuracy = _ratio(tp + tn, classified) # (TP + TN)/(TP + TN + FP + FN)
+        precision = _ratio(tp, tp + fp)
+        recall = _ratio(tp, tp + fn)
+        fscore = _ratio(2 * precision * recall, precision + recall)
+        tpr = _ratio(tp, tp + fn)
+        fpr = _ratio(fp, fp + tn)
+        fnr = _ratio(fn, fn + tp)
+        tnr = _ratio(tn, tn + fp)
+
+        num_correct = tp + tn
+        return {
+            'tPos': tp,
+            'tNeg': tn,
+            'fNeg': fn,
+            'fPos': fp,
+            'accuracy': round(accuracy, digits),
+            'precision': round(precision, digits),
+            'recall': round(recall, digits),
+            'fscore': round(fscore, digits),
+            'TPR': round(tpr, 3),
+            'FPR': round(fpr, 3),
+            'FNR': round(fnr, 3),
+            'TNR': round(tnr, 3),
+            'num_rows': num_rows,
+            'num_correct': num_correct,
+            'percent_correct': math.floor(_ratio(num_correct, num_rows) * 100),
+            'percent_TPR': round(_ratio(tp, num_rows) * 100),
+            'percent_FPR': round(_ratio(fp, num_rows) * 100),
+            'percent_TNR': round(_ratio(tn, num_rows) * 100),
+            'percent_FNR': round(_ratio(fn, num_rows) * 100)
+        }
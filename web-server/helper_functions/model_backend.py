@@ -0,0 +1,200 @@
+import abc
+import hashlib
+import os
+import random
+import re
+import time
+
+# Backend used for prompt runs unless the run asks for another one
+DEFAULT_BACKEND = os.getenv("MODEL_BACKEND", "gemini")
+
+SAFETY_SETTINGS = [
+    {
+        "category": "HARM_CATEGORY_HARASSMENT",
+        "threshold": "BLOCK_NONE",
+    },
+    {
+        "category": "HARM_CATEGORY_HATE_SPEECH",
+        "threshold": "BLOCK_NONE",
+    },
+    {
+        "category": "HARM_CATEGORY_SEXUALLY_EXPLICIT",
+        "threshold": "BLOCK_NONE",
+    },
+    {
+        "category": "HARM_CATEGORY_DANGEROUS",
+        "threshold": "BLOCK_NONE",
+    },
+]
+
+
+class RateLimitError(Exception):
+    """Raised by a backend when the provider reports a quota error (HTTP 429)."""
+
+
+class AuthError(Exception):
+    """Raised by a backend when the provider rejects the API key."""
+
+
+class ModelBackend(abc.ABC):
+    model_name = None
+    api_key = None
+    # Whether requests count against a provider's quota, and so go through the API key's shared rate limiter
+    rate_limited = True
+    # Set once the provider rejects the API key, so the remaining requests of the run are not sent
+    key_rejected = False
+
+    @abc.abstractmethod
+    def generate(self, prompt, max_output_tokens=800):
+        """
+        Send a prompt to the model.
+
+        :param prompt: The full prompt to send
+        :param max_output_tokens: The maximum number of tokens in the response
+        :return: The response text, or None if the response was blocked or empty
+        """
+
+
+class GeminiBackend(ModelBackend):
+    model_name = 'gemini-pro'
+
+    def __init__(self, api_key):
+        import google.generativeai as genai
+        from google.api_core.exceptions import ResourceExhausted, Unauthenticated, PermissionDenied, InvalidArgument
+        self.quota_error = ResourceExhausted
+        self.auth_errors = (Unauthenticated, PermissionDenied)
+        self.invalid_argument = InvalidArgument
+        self.api_key = api_key
+        genai.configure(api_key=api_key)
+        self.model = genai.GenerativeModel(model_name=self.model_name)
+
+    def generate(self, prompt, max_output_tokens=800):
+        try:
+            res = self.model.generate_content(
+                contents=prompt,
+                generation_config={
+                    'temperature': 0,
+                    'max_output_tokens': max_output_tokens
+                },
+                safety_settings=SAFETY_SETTINGS
+            )
+        except self.quota_error as e:
+            raise RateLimitError(str(e))
+        except self.auth_errors as e:
+            raise AuthError(str(e))
+        except self.invalid_argument as e:
+            # A bad key is reported as an invalid argument (API_KEY_INVALID)
+            if "API key" in str(e) or "API_KEY" in str(e):
+                raise AuthError(str(e))
+            raise
+
+        # Checks if the prompt was blocked
+        if str(res.prompt_feedback).replace("\n", "") == "block_reason: OTHER":
+            print("Prompt Blocked")
+            return None
+
+        # Checks for if response is empty
+        if res.parts == []:
+            print("Response is empty")
+            return None
+        return res.text
+
+
+class OpenAIBackend(ModelBackend):
+    model_name = 'gpt-3.5-turbo'
+
+    def __init__(self, api_key):
+        import openai
+        self.quota_error = openai.RateLimitError
+        self.auth_errors = (openai.AuthenticationError, openai.PermissionDeniedError)
+        self.api_key = api_key
+        self.client = openai.OpenAI(api_key=api_key)
+
+    def generate(self, prompt, max_output_tokens=800):
+        try:
+            response = self.client.chat.completions.create(
+                model=self.model_name,
+                messages=[{"role": "user", "content": prompt}],
+                temperature=0,
+                max_tokens=max_output_tokens
+            )
+        except self.quota_error as e:
+            raise RateLimitError(str(e))
+        except self.auth_errors as e:
+            raise AuthError(str(e))
+
+        content = response.choices[0].message.content if response.choices else None
+        if not content:
+            print("Response is empty")
+            return None
+        return content
+
+
+class StubBackend(ModelBackend):
+    model_name = 'stub'
+    rate_limited = False
+
+    def __init__(self, api_key=None, latency=None, latency_jitter=None, error_rate=None, rate_limit_rate=None, response_template=None, seed=None):
+        """
+        An offline backend that answers every post with canned XML, for load testing.
+        Answers are derived from a hash of the post, so the same prompt always gets the same answer.
+
+        :param latency: Seconds each request takes (STUB_LATENCY)
+        :param latency_jitter: Random extra seconds added to each request (STUB_LATENCY_JITTER)
+        :param error_rate: Fraction of requests that raise an error (STUB_ERROR_RATE)
+        :param rate_limit_rate: Fraction of requests that raise a RateLimitError (STUB_RATE_LIMIT_RATE)
+        :param response_template: XML for a single response, formatted with answer, confidence_level, truth_level and id
+        :param seed: Seed for the latency jitter and injected errors (STUB_SEED)
+        """
+        self.latency = float(os.getenv("STUB_LATENCY", 0.5)) if latency is None else latency
+        self.latency_jitter = float(os.getenv("STUB_LATENCY_JITTER", 0)) if latency_jitter is None else latency_jitter
+        self.error_rate = float(os.getenv("STUB_ERROR_RATE", 0)) if error_rate is None else error_rate
+        self.rate_limit_rate = float(os.getenv("STUB_RATE_LIMIT_RATE", 0)) if rate_limit_rate is None else rate_limit_rate
+        self.response_template = response_template or (
+            "<response{id}>\n<answer>{answer}</answer>\n<confidence_level>{confidence_level}</confidence_level>\n"
+            "<truth_level>{truth_level}</truth_level>\n<explanation>Stub response.</explanation>\n</response>"
+        )
+        self.random = random.Random(os.getenv("STUB_SEED") if seed is None else seed)
+
+    def generate(self, prompt, max_output_tokens=800):
+        time.sleep(self.latency + self.random.random() * self.latency_jitter)
+        roll = self.random.random()
+        if roll < self.rate_limit_rate:
+            raise RateLimitError("Stub rate limit")
+        if roll < self.rate_limit_rate + self.error_rate:
+            raise RuntimeError("Stub error")
+
+        # Batched prompts get one response per <post id="n">
+        posts = re.findall(r'<post id="(\d+)">(.*?)</post>', prompt, re.DOTALL)
+        if posts:
+            return "\n".join(self.respond(text, f' id="{n}"') for n, text in posts)
+        return self.respond(prompt, "")
+
+    def respond(self, text, id_attribute):
+        digest = hashlib.sha256(text.encode("utf-8")).digest()
+        return self.response_template.format(
+            id=id_attribute,
+            answer=digest[0] % 2,
+            confidence_level=digest[1] % 12 + 1,
+            truth_level=digest[2] % 12 + 1
+        )
+
+
+BACKENDS = {
+    'gemini': GeminiBackend,
+    'openai': OpenAIBackend,
+    'stub': StubBackend,
+}
+
+def get_backend(name, api_key, **options):
+    """
+    Create a model backend by name.
+
+    :param name: The name of the backend (gemini, openai or stub)
+    :param api_key: The API key for the provider
+    :param options: Extra options passed to the backend
+    :return: The ModelBackend
+    """
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown model backend: {name}")
+    return BACKENDS[name](api_key, **options)
@@ -0,0 +1,125 @@
+import base64
+import datetime
+import decimal
+import json
+import os
+import threading
+import time
+from helper_functions.database import sql_results_one
+
+# Seconds a total count is reused before it is counted again
+COUNT_CACHE_SECONDS = float(os.getenv("PAGINATION_COUNT_TTL", 60))
+
+# Largest page a client can ask for
+MAX_PER_PAGE = 100
+
+_counts = {}
+_counts_lock = threading.Lock()
+
+
+def encode_cursor(values):
+    """
+    Encode the sort key of the last row on a page as an opaque cursor.
+
+    :param values: A list of the sort key values (and any extra state needed to continue)
+    :return: A url-safe string
+    """
+    def convert(value):
+        if isinstance(value, decimal.Decimal):
+            return str(value)
+        if isinstance(value, datetime.datetime):
+            return value.isoformat(sep=' ')
+        if isinstance(value, datetime.date):
+            return value.isoformat()
+        return value
+    data = json.dumps([convert(value) for value in values], separators=(',', ':'))
+    return base64.urlsafe_b64encode(data.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor, length):
+    """
+    Decode a cursor made by encode_cursor.
+
+    :param cursor: The cursor from the request, or None for the first page
+    :param length: The number of values the cursor must contain
+    :return: The list of values, or None for the first page
+    :raises ValueError: If the cursor is not valid
+    """
+    if not cursor:
+        return None
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")).decode("utf-8"))
+    except (ValueError, UnicodeError) as e:
+        raise ValueError(f"Invalid cursor: {str(e)}")
+    if not isinstance(values, list) or len(values) != length:
+        raise ValueError("Invalid cursor")
+    return values
+
+
+def keyset_condition(order_by, values):
+    """
+    Build the WHERE condition selecting rows after a cursor, for any mix of sort directions.
+    For ORDER BY a DESC, b ASC this is: a < %s OR (a = %s AND b > %s)
+
+    :param order_by: A list of (column expression, "ASC" or "DESC") tuples, ending with a unique column
+    :param values: The sort key values of the last row on the previous page
+    :return: A tuple of the SQL condition and its parameters
+    """
+    clauses = []
+    params = []
+    for i, (column, direction) in enumerate(order_by):
+        parts = [f"{previous} = %s" for previous, _ in order_by[:i]]
+        parts.append(f"{column} {'<' if direction.upper() == 'DESC' else '>'} %s")
+        clauses.append("(" + " AND ".join(parts) + ")")
+        params.extend(values[:i + 1])
+    return "(" + " OR ".join(clauses) + ")", tuple(params)
+
+
+def order_by_clause(order_by):
+    return ", ".join(f"{column} {direction}" for column, direction in order_by)
+
+
+def get_per_page(request, default=10):
+    """
+    Read per_page from the request, limited to 1..MAX_PER_PAGE.
+    """
+    per_page = request.args.get('per_page', default, type=int) or default
+    return max(1, min(per_page, MAX_PER_PAGE))
+
+
+def split_page(rows, per_page):
+    """
+    Split the rows of a query fetched with LIMIT per_page + 1.
+
+    :return: A tuple of the rows on the page and whether there is another page
+    """
+    return rows[:per_page], len(rows) > per_page
+
+
+def cached_count(query, values=None):
+    """
+    Run a COUNT(*) query, reusing its result for COUNT_CACHE_SECONDS.
+    Totals are for display only, so being slightly out of date is fine.
+
+    :param query: The SQL count query
+    :param values: The values to pass to the query
+    :return: A tuple containing a boolean indicating success, a message, and the count
+    """
+    key = (query, tuple(values or ()))
+    now = time.monotonic()
+    with _counts_lock:
+        cached = _counts.get(key)
+    if cached and now - cached[1] < COUNT_CACHE_SECONDS:
+        return True, "Good", cached[0]
+
+    status, message, result = sql_results_one(query, values)
+    if not status:
+        return False, message, None
+    count = result[0] if result else 0
+    with _counts_lock:
+        # Drop expired counts so the cache doesn't grow with every user and competition
+        for old_key in [old_key for old_key, (_, counted_at) in _counts.items() if now - counted_at >= COUNT_CACHE_SECONDS]:
+            del _counts[old_key]
+        _counts[key] = (count, now)
+    return True, "Good", count
@@ -1,3 +1,7 @@
+import re
+import xml.etree.ElementTree as ET
+from xml.sax.saxutils import escape
+
 def get_instructions():
     instructions = """Your response should have these sections:
 <answer> - a one number response of either "1" if it is dissinformation or "0" if it is factual.
@@ -15,4 +19,41 @@ Here is the post you should evaluate:"""
 def append_instructions(prompt):
     instructions = get_instructions()
     fixed_prompt = str(prompt) + "\n" + instructions
-    return fixed_prompt
\ No newline at end of file
+    return fixed_prompt
+
+def get_batch_instructions():
+    instructions = """You will be given several posts, each inside a <post id="n"> tag.
+Your response for every post should have these sections:
+<answer> - a one number response of either "1" if it is dissinformation or "0" if it is factual.
+<confidence_level> - a level from 1-12 on how confident you are that your answer from Section 1 is correct.
+<truth_level> - a level from 1-12 on how truthful the twitter post is.
+<explanation> - An explanation of why the post is fact or fake and why you gave the confidence level you did.
+Your response should be in XML format, with one response for every post, using the id of the post:
+<response id="n">
+<SECTION_NAME> <!-- Replace SECTION_NAME with the name of the section. Include your answer for the section within. --> </SECTION_NAME>
+<!-- Do this for all sections -->
+</response>
+Here are the posts you should evaluate:"""
+    return instructions
+
+def append_batch_instructions(prompt, posts):
+    instructions = get_batch_instructions()
+    post_tags = "\n".join(f'<post id="{n}">{escape(post)}</post>' for n, post in enumerate(posts, start=1))
+    fixed_prompt = str(prompt) + "\n" + instructions + "\n" + post_tags
+    return fixed_prompt
+
+def split_batch_response(response):
+    # Parse each <response id="n"> element on its own, so one malformed response doesn't lose the others
+    responses = {}
+    starts = list(re.finditer(r'<response\s+id="(\d+)"\s*>', response))
+    for i, start in enumerate(starts):
+        segment_end = starts[i + 1].start() if i + 1 < len(starts) else len(response)
+        segment = response[start.start():segment_end]
+        close = segment.find("</response>")
+        if close == -1:
+            continue
+        try:
+            responses[int(start.group(1))] = ET.fromstring(segment[:close + len("</response>")])
+        except ET.ParseError:
+            continue
+    return responses
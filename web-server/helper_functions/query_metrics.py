@@ -0,0 +1,148 @@
+import os
+import re
+import threading
+import time
+
+# Queries slower than this many seconds are written to the slow query log (0 turns it off)
+SLOW_QUERY_SECONDS = float(os.getenv("SLOW_QUERY_SECONDS", 1.0))
+
+# File the slow query log is appended to, printed to stdout if not set
+SLOW_QUERY_LOG = os.getenv("SLOW_QUERY_LOG")
+
+# Most distinct statements tracked, so queries built with inline values can't grow the table forever
+MAX_TRACKED_QUERIES = 1000
+
+_query_stats = {}
+_request_stats = {}
+_stats_lock = threading.Lock()
+_log_lock = threading.Lock()
+_request = threading.local()
+
+
+def normalize_sql(query):
+    """
+    Reduce a query to its shape, so the same statement with different values is counted together.
+
+    :param query: The SQL query
+    :return: The query with values replaced by ? and whitespace collapsed
+    """
+    query = re.sub(r"'(?:[^'\\]|\\.|'')*'", "?", query)
+    query = re.sub(r'"(?:[^"\\]|\\.|"")*"', "?", query)
+    query = re.sub(r"%s", "?", query)
+    query = re.sub(r"\b\d+(?:\.\d+)?\b", "?", query)
+    query = re.sub(r"\(\s*\?(?:\s*,\s*\?)*\s*\)", "(?)", query)
+    return re.sub(r"\s+", " ", query).strip()
+
+
+def record_query(query, seconds, rows=None):
+    """
+    Record a finished query in the per-statement stats and the current request's totals.
+
+    :param query: The SQL query
+    :param seconds: How long the query took, including fetching the results
+    :param rows: Rows returned or affected, if known
+    """
+    statement = normalize_sql(query)
+    with _stats_lock:
+        stats = _query_stats.get(statement)
+        if stats is None and len(_query_stats) < MAX_TRACKED_QUERIES:
+            stats = _query_stats[statement] = {'count': 0, 'total_seconds': 0.0, 'max_seconds': 0.0, 'rows': 0}
+        if stats is not None:
+            stats['count'] += 1
+            stats['total_seconds'] += seconds
+            stats['max_seconds'] = max(stats['max_seconds'], seconds)
+            if rows is not None and rows > 0:
+                stats['rows'] += rows
+
+    if getattr(_request, "active", False):
+        _request.queries += 1
+        _request.seconds += seconds
+
+    if SLOW_QUERY_SECONDS > 0 and seconds >= SLOW_QUERY_SECONDS:
+        log_slow_query(statement, seconds, rows)
+
+
+def log_slow_query(statement, seconds, rows):
+    line = f"{time.strftime('%Y-%m-%d %H:%M:%S')} slow query {seconds * 1000:.1f} ms, rows={rows}: {statement}"
+    if not SLOW_QUERY_LOG:
+        print(line)
+        return
+    try:
+        with _log_lock:
+            with open(SLOW_QUERY_LOG, "a", encoding="utf-8") as log_file:
+                log_file.write(line + "\n")
+    except OSError as e:
+        print(f"Error writing slow query log: {str(e)}")
+        print(line)
+
+
+def start_request():
+    """
+    Start counting the queries made by the current request (thread).
+    """
+    _request.active = True
+    _request.queries = 0
+    _request.seconds = 0.0
+
+
+def end_request():
+    """
+    Stop counting queries for the current request.
+
+    :return: A tuple of the number of queries and the total seconds spent in them
+    """
+    _request.active = False
+    return getattr(_request, "queries", 0), getattr(_request, "seconds", 0.0)
+
+
+def record_request(endpoint, queries, seconds):
+    """
+    Add a finished request's query count and database time to the stats for its endpoint.
+
+    :param endpoint: The name of the endpoint that handled the request
+    :param queries: The number of queries the request made
+    :param seconds: The total seconds the request spent in queries
+    """
+    with _stats_lock:
+        stats = _request_stats.setdefault(endpoint, {'requests': 0, 'queries': 0, 'db_seconds': 0.0, 'max_queries': 0, 'max_db_seconds': 0.0})
+        stats['requests'] += 1
+        stats['queries'] += queries
+        stats['db_seconds'] += seconds
+        stats['max_queries'] = max(stats['max_queries'], queries)
+        stats['max_db_seconds'] = max(stats['max_db_seconds'], seconds)
+
+
+def get_query_stats(limit=50):
+    """
+    Get the recorded stats for each statement, slowest in total first.
+
+    :param limit: The number of statements to return
+    :return: A list of dictionaries with query, count, total_seconds, mean_seconds, max_seconds and rows
+    """
+    with _stats_lock:
+        stats = [dict(query=statement, **values) for statement, values in _query_stats.items()]
+    for values in stats:
+        values['mean_seconds'] = values['total_seconds'] / values['count']
+    stats.sort(key=lambda values: values['total_seconds'], reverse=True)
+    return stats[:limit]
+
+
+def get_request_stats():
+    """
+    Get the query count and database time of each endpoint, most database time first.
+
+    :return: A list of dictionaries with endpoint, requests, queries, db_seconds, max_queries, max_db_seconds and the means per request
+    """
+    with _stats_lock:
+        stats = [dict(endpoint=endpoint, **values) for endpoint, values in _request_stats.items()]
+    for values in stats:
+        values['mean_queries'] = values['queries'] / values['requests']
+        values['mean_db_seconds'] = values['db_seconds'] / values['requests']
+    stats.sort(key=lambda values: values['db_seconds'], reverse=True)
+    return stats
+
+
+def reset_query_stats():
+    with _stats_lock:
+        _query_stats.clear()
+        _request_stats.clear()
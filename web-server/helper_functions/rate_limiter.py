@@ -0,0 +1,257 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+SCRIPTS_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+PARENT_DIRECTORY = os.path.dirname(SCRIPTS_DIRECTORY)
+
+# The token buckets of every API key are kept here, so all worker processes on this machine share one budget per key
+RATE_LIMIT_PATH = os.getenv("RATE_LIMIT_PATH", os.path.join(PARENT_DIRECTORY, "dynamic", "rate_limits.sqlite3"))
+
+# Default quota for a single API key, override with environment variables
+REQUESTS_PER_MINUTE = int(os.getenv("RATE_LIMIT_RPM", 60))
+TOKENS_PER_MINUTE = int(os.getenv("RATE_LIMIT_TPM", 32000))
+
+# Adaptive backoff settings used when the API reports a quota error (429)
+MIN_RATE_SCALE = 0.1
+RATE_RECOVERY_STEP = 0.05
+MAX_BACKOFF_SECONDS = 60
+
+
+class TokenBucket:
+    def __init__(self, rate_per_minute):
+        """
+        A token bucket that refills continuously at rate_per_minute.
+
+        :param rate_per_minute: The number of tokens added to the bucket per minute, and the bucket capacity
+        """
+        self.capacity = float(rate_per_minute)
+        self.tokens = float(rate_per_minute)
+        self.updated = time.monotonic()
+
+    def refill(self, now, scale=1.0):
+        """
+        Add the tokens earned since the last refill.
+
+        :param now: The current monotonic time
+        :param scale: A multiplier applied to the refill rate
+        """
+        elapsed = now - self.updated
+        self.tokens = min(self.capacity, self.tokens + elapsed * self.capacity * scale / 60)
+        self.updated = now
+
+    def wait_time(self, amount, scale=1.0):
+        """
+        Get the number of seconds until amount tokens are available.
+
+        :param amount: The number of tokens needed
+        :param scale: A multiplier applied to the refill rate
+        :return: The number of seconds to wait, 0 if the tokens are available now
+        """
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0
+        return (amount - self.tokens) * 60 / (self.capacity * scale)
+
+
+class RateLimiter:
+    def __init__(self, requests_per_minute=REQUESTS_PER_MINUTE, tokens_per_minute=TOKENS_PER_MINUTE):
+        """
+        Pace requests against a requests-per-minute and tokens-per-minute budget, within this process only.
+        Used where no budget needs sharing (the stub backend and benchmarks), prompt runs use SharedRateLimiter.
+
+        :param requests_per_minute: The request budget per minute
+        :param tokens_per_minute: The input token budget per minute
+        """
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.rate_scale = 1.0
+        self.backoff_until = 0
+        self.consecutive_throttles = 0
+        self.lock = threading.Lock()
+
+    def acquire(self, num_tokens=0):
+        """
+        Block until a request using num_tokens input tokens fits in the budget, then reserve it.
+
+        :param num_tokens: The estimated number of input tokens for the request
+        """
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.requests.refill(now, self.rate_scale)
+                self.tokens.refill(now, self.rate_scale)
+                wait = max(
+                    self.backoff_until - now,
+                    self.requests.wait_time(1, self.rate_scale),
+                    self.tokens.wait_time(num_tokens, self.rate_scale)
+                )
+                if wait <= 0:
+                    self.requests.tokens -= 1
+                    self.tokens.tokens -= min(num_tokens, self.tokens.capacity)
+                    return
+            time.sleep(wait)
+
+    def report_success(self):
+        """
+        Slowly raise the request rate back towards the full quota after a successful request.
+        """
+        with self.lock:
+            self.consecutive_throttles = 0
+            self.rate_scale = min(1.0, self.rate_scale + RATE_RECOVERY_STEP)
+
+    def report_throttled(self):
+        """
+        Halve the request rate and pause all requests after the API reports a quota error.
+        """
+        with self.lock:
+            self.consecutive_throttles += 1
+            self.rate_scale = max(MIN_RATE_SCALE, self.rate_scale / 2)
+            backoff = min(MAX_BACKOFF_SECONDS, 2 ** self.consecutive_throttles)
+            self.backoff_until = max(self.backoff_until, time.monotonic() + backoff)
+
+
+class SharedRateLimiter:
+    def __init__(self, key_hash, path=RATE_LIMIT_PATH, requests_per_minute=REQUESTS_PER_MINUTE, tokens_per_minute=TOKENS_PER_MINUTE):
+        """
+        Pace requests for one API key like RateLimiter, with the buckets and backoff stored in SQLite,
+        so every thread and process using the key shares one budget.
+
+        :param key_hash: The sha256 of the API key, the row the state is kept in
+        :param path: The path to the SQLite file
+        :param requests_per_minute: The request budget per minute
+        :param tokens_per_minute: The input token budget per minute
+        """
+        self.key_hash = key_hash
+        self.path = path
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+
+    def _update(self, change):
+        """
+        Run change on the key's state inside a write transaction, so no other process changes it in between.
+
+        :param change: Called with a dictionary of the state (requests, tokens, rate_scale, backoff_until,
+                       consecutive_throttles), which it may modify. Its return value is returned.
+        """
+        conn, lock = _get_connection(self.path)
+        with lock:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute("""SELECT request_tokens, input_tokens, updated, rate_scale, backoff_until, consecutive_throttles
+                FROM rate_limits WHERE key = ?""", (self.key_hash,)).fetchone()
+                now = time.time()
+                requests = TokenBucket(self.requests_per_minute)
+                tokens = TokenBucket(self.tokens_per_minute)
+                state = {'requests': requests, 'tokens': tokens, 'rate_scale': 1.0, 'backoff_until': 0, 'consecutive_throttles': 0, 'now': now}
+                requests.updated = tokens.updated = now
+                if row is not None:
+                    requests.tokens, tokens.tokens, updated = min(row[0], requests.capacity), min(row[1], tokens.capacity), row[2]
+                    requests.updated = tokens.updated = min(updated, now)
+                    state.update(rate_scale=row[3], backoff_until=row[4], consecutive_throttles=row[5])
+                requests.refill(now, state['rate_scale'])
+                tokens.refill(now, state['rate_scale'])
+
+                result = change(state)
+
+                conn.execute("""INSERT OR REPLACE INTO rate_limits
+                (key, request_tokens, input_tokens, updated, rate_scale, backoff_until, consecutive_throttles)
+                VALUES (?, ?, ?, ?, ?, ?, ?)""", (
+                    self.key_hash, requests.tokens, tokens.tokens, now,
+                    state['rate_scale'], state['backoff_until'], state['consecutive_throttles']
+                ))
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        return result
+
+    def acquire(self, num_tokens=0):
+        """
+        Block until a request using num_tokens input tokens fits in the key's budget, then reserve it.
+
+        :param num_tokens: The estimated number of input tokens for the request
+        """
+        def reserve(state):
+            requests, tokens, rate_scale = state['requests'], state['tokens'], state['rate_scale']
+            wait = max(
+                state['backoff_until'] - state['now'],
+                requests.wait_time(1, rate_scale),
+                tokens.wait_time(num_tokens, rate_scale)
+            )
+            if wait <= 0:
+                requests.tokens -= 1
+                tokens.tokens -= min(num_tokens, tokens.capacity)
+            return wait
+
+        while True:
+            wait = self._update(reserve)
+            if wait <= 0:
+                return
+            time.sleep(wait)
+
+    def report_success(self):
+        """
+        Slowly raise the request rate back towards the full quota after a successful request.
+        """
+        def recover(state):
+            state['consecutive_throttles'] = 0
+            state['rate_scale'] = min(1.0, state['rate_scale'] + RATE_RECOVERY_STEP)
+        self._update(recover)
+
+    def report_throttled(self):
+        """
+        Halve the request rate and pause all requests with this key, in every process, after the API reports a quota error.
+        """
+        def throttle(state):
+            state['consecutive_throttles'] += 1
+            state['rate_scale'] = max(MIN_RATE_SCALE, state['rate_scale'] / 2)
+            backoff = min(MAX_BACKOFF_SECONDS, 2 ** state['consecutive_throttles'])
+            state['backoff_until'] = max(state['backoff_until'], state['now'] + backoff)
+        self._update(throttle)
+
+
+# SQLite connections can't be shared with forked workers, so each process opens its own
+_connections = {}
+_connections_lock = threading.Lock()
+
+def _get_connection(path):
+    key = (os.getpid(), path)
+    with _connections_lock:
+        if key not in _connections:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Transactions are started explicitly with BEGIN IMMEDIATE
+            conn = sqlite3.connect(path, check_same_thread=False, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""CREATE TABLE IF NOT EXISTS rate_limits (
+                key TEXT PRIMARY KEY,
+                request_tokens REAL NOT NULL,
+                input_tokens REAL NOT NULL,
+                updated REAL NOT NULL,
+                rate_scale REAL NOT NULL,
+                backoff_until REAL NOT NULL,
+                consecutive_throttles INTEGER NOT NULL
+            )""")
+            _connections[key] = (conn, threading.Lock())
+        return _connections[key]
+
+def get_rate_limiter(api_key):
+    """
+    Get the rate limiter for an API key, shared by every task using the key in any worker process.
+
+    :param api_key: The API key requests are made with
+    :return: The SharedRateLimiter for the key
+    """
+    key_hash = hashlib.sha256(str(api_key).encode()).hexdigest()
+    return SharedRateLimiter(key_hash)
+
+def estimate_tokens(text):
+    """
+    Roughly estimate the number of tokens in a piece of text (about 4 characters per token).
+
+    :param text: The text to estimate
+    :return: The estimated number of tokens
+    """
+    return len(text) // 4 + 1
@@ -0,0 +1,165 @@
+import csv
+import hashlib
+import json
+import os
+import re
+import threading
+from helper_functions.stats import write_results_workbook, cell_value, NUMERIC_COLUMNS
+
+SCRIPT_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# The csv written during a run is the canonical copy of its results, every other format is derived from it
+RESULTS_DIRECTORY = os.path.join(SCRIPT_DIRECTORY, "dynamic", "prompt_results")
+
+# Derived formats, built on the first download and kept here
+ARTIFACT_DIRECTORY = os.path.join(SCRIPT_DIRECTORY, "dynamic", "report_cache")
+
+# Rows per row group when converting to parquet
+PARQUET_BATCH_ROWS = 10000
+
+# Columns written by the app as integers, everything else (including the model's answers) is kept as text in parquet
+PARQUET_INTEGER_COLUMNS = {"id", "label", "correct"}
+
+# Download names are <uuid>.<format>
+FILENAME_PATTERN = re.compile(r"^([0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12})\.([a-z]+)$")
+
+# Content hashes of the csvs seen by this process, by path and (size, mtime)
+_hashes = {}
+_hashes_lock = threading.Lock()
+
+
+def build_xlsx(in_file, out_file):
+    write_results_workbook(in_file, out_file)
+
+
+def build_parquet(in_file, out_file):
+    # Imported here so the other formats work without pyarrow
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+    import pyarrow.parquet as pq
+    # Types are fixed up front since model answers can turn up as text in any block
+    with open(in_file, mode="r", newline="", encoding='utf-8') as csv_file:
+        header = next(csv.reader(csv_file), [])
+    column_types = {column: pa.int64() if column in PARQUET_INTEGER_COLUMNS else pa.string() for column in header}
+    reader = pa_csv.open_csv(
+        in_file,
+        read_options=pa_csv.ReadOptions(block_size=1 << 22),
+        convert_options=pa_csv.ConvertOptions(column_types=column_types, strings_can_be_null=True)
+    )
+    with pq.ParquetWriter(out_file, reader.schema) as writer:
+        for batch in reader:
+            writer.write_batch(batch, row_group_size=PARQUET_BATCH_ROWS)
+
+
+def build_json(in_file, out_file):
+    # Written one row at a time, so the run is never held in memory
+    with open(in_file, mode="r", newline="", encoding='utf-8') as csv_file, open(out_file, mode="w", encoding='utf-8') as json_file:
+        reader = csv.reader(csv_file)
+        header = next(reader, [])
+        numeric = [column in NUMERIC_COLUMNS for column in header]
+        json_file.write("[")
+        for i, line in enumerate(reader):
+            row = {column: cell_value(value, is_numeric) for column, value, is_numeric in zip(header, line, numeric)}
+            json_file.write(("," if i else "") + "\n" + json.dumps(row, ensure_ascii=False))
+        json_file.write("\n]\n")
+
+
+# Format name: (version, builder). Bump the version when a builder's output changes,
+# so artifacts built by the old version are not served again.
+ARTIFACT_FORMATS = {
+    'xlsx': (1, build_xlsx),
+    'parquet': (1, build_parquet),
+    'json': (1, build_json),
+}
+
+
+def _content_hash(path):
+    stat = os.stat(path)
+    signature = (stat.st_size, stat.st_mtime_ns)
+    with _hashes_lock:
+        cached = _hashes.get(path)
+    if cached and cached[0] == signature:
+        return cached[1]
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    sha256 = digest.hexdigest()
+    with _hashes_lock:
+        _hashes[path] = (signature, sha256)
+    return sha256
+
+
+def get_report_file(filename):
+    """
+    Get the file to send for a results download. The csv and files from before formats were built on demand
+    are served from the results directory, other formats are built from the csv the first time they are asked for.
+    Built files are named by run uuid, format version and the csv's content hash, so a changed csv or builder gets a new file,
+    and the run's older files of that format are deleted.
+
+    :param filename: The requested file name, <uuid>.<format>
+    :return: A tuple containing a boolean indicating success, a message, and the path of the file
+    """
+    match = FILENAME_PATTERN.match(filename)
+    if not match:
+        return False, "File not found", None
+    uuid_name, extension = match.groups()
+
+    existing = os.path.join(RESULTS_DIRECTORY, filename)
+    if os.path.isfile(existing):
+        return True, "Good", existing
+
+    in_file = os.path.join(RESULTS_DIRECTORY, f"{uuid_name}.csv")
+    if extension not in ARTIFACT_FORMATS or not os.path.isfile(in_file):
+        return False, "File not found", None
+    version, builder = ARTIFACT_FORMATS[extension]
+
+    try:
+        sha256 = _content_hash(in_file)
+    except OSError as e:
+        print(f"Error reading results {in_file}: {str(e)}")
+        return False, "File not found", None
+    path = os.path.join(ARTIFACT_DIRECTORY, f"{uuid_name}.v{version}.{sha256[:16]}.{extension}")
+    if os.path.isfile(path):
+        return True, "Good", path
+
+    os.makedirs(ARTIFACT_DIRECTORY, exist_ok=True)
+    # Build under a temporary name so a concurrent download never gets a partial file
+    temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        builder(in_file, temp_path)
+        os.replace(temp_path, path)
+    except Exception as e:
+        print(f"Error building {extension} for {uuid_name}: {str(e)}")
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        return False, "Unable to create the file, please try again", None
+    remove_stale_artifacts(uuid_name, extension, path)
+    return True, "Good", path
+
+
+def remove_stale_artifacts(uuid_name, extension, current_path):
+    """
+    Delete the files built for a run's earlier csv contents or an older builder, keeping only the current one.
+
+    :param uuid_name: The uuid of the run
+    :param extension: The format of the files
+    :param current_path: The path of the file just built, which is kept
+    """
+    pattern = re.compile(rf"^{re.escape(uuid_name)}\.v\d+\.[0-9a-f]{{16}}\.{re.escape(extension)}$")
+    try:
+        names = os.listdir(ARTIFACT_DIRECTORY)
+    except OSError as e:
+        print(f"Error listing {ARTIFACT_DIRECTORY}: {str(e)}")
+        return
+    for name in names:
+        path = os.path.join(ARTIFACT_DIRECTORY, name)
+        if path == current_path or not pattern.match(name):
+            continue
+        try:
+            # A download still sending the old file keeps its open copy
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            print(f"Error removing {path}: {str(e)}")
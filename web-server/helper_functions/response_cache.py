@@ -0,0 +1,133 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+SCRIPTS_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+PARENT_DIRECTORY = os.path.dirname(SCRIPTS_DIRECTORY)
+
+# Cache settings, override with environment variables
+CACHE_PATH = os.getenv("RESPONSE_CACHE_PATH", os.path.join(PARENT_DIRECTORY, "dynamic", "response_cache.sqlite3"))
+CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", 200000))
+CACHE_TTL_SECONDS = int(os.getenv("RESPONSE_CACHE_TTL_SECONDS", 30 * 24 * 3600))
+
+# How many inserts happen between eviction passes
+EVICTION_INTERVAL = 500
+
+
+class ResponseCache:
+    def __init__(self, path=CACHE_PATH, max_entries=CACHE_MAX_ENTRIES, ttl_seconds=CACHE_TTL_SECONDS):
+        """
+        A persistent model response cache stored in SQLite, with LRU and TTL eviction.
+
+        :param path: The path to the SQLite file
+        :param max_entries: The maximum number of responses kept
+        :param ttl_seconds: How long a response stays valid after it was stored
+        """
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self.inserts = 0
+        self.lock = threading.Lock()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""CREATE TABLE IF NOT EXISTS responses (
+            key TEXT PRIMARY KEY,
+            response TEXT NOT NULL,
+            created_at REAL NOT NULL,
+            last_used REAL NOT NULL
+        )""")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used)")
+        self.conn.commit()
+
+    @staticmethod
+    def make_key(model_name, instructions, prompt, text):
+        """
+        Build the content-addressed key for a request.
+
+        :param model_name: The name of the model
+        :param instructions: The formatting instructions sent with the prompt
+        :param prompt: The user's prompt
+        :param text: The text of the post being evaluated
+        :return: The cache key
+        """
+        payload = json.dumps([model_name, instructions, prompt, text])
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        """
+        Look up a cached response.
+
+        :param key: The cache key
+        :return: The cached response text, or None if there is no valid entry
+        """
+        now = time.time()
+        with self.lock:
+            row = self.conn.execute("SELECT response, created_at FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None or now - row[1] > self.ttl_seconds:
+                self.misses += 1
+                return None
+            self.conn.execute("UPDATE responses SET last_used = ? WHERE key = ?", (now, key))
+            self.conn.commit()
+            self.hits += 1
+            return row[0]
+
+    def set(self, key, response):
+        """
+        Store a response in the cache.
+
+        :param key: The cache key
+        :param response: The response text
+        """
+        now = time.time()
+        with self.lock:
+            self.conn.execute("INSERT OR REPLACE INTO responses (key, response, created_at, last_used) VALUES (?, ?, ?, ?)", (key, response, now, now))
+            self.conn.commit()
+            self.inserts += 1
+            if self.inserts % EVICTION_INTERVAL == 0:
+                self.evict()
+
+    def evict(self):
+        """
+        Remove expired responses, then the least recently used responses over the size bound.
+        Must be called with the lock held.
+        """
+        self.conn.execute("DELETE FROM responses WHERE created_at < ?", (time.time() - self.ttl_seconds,))
+        count = self.conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        if count > self.max_entries:
+            self.conn.execute("DELETE FROM responses WHERE key IN (SELECT key FROM responses ORDER BY last_used ASC LIMIT ?)", (count - self.max_entries,))
+        self.conn.commit()
+
+    def stats(self):
+        """
+        Get the cache statistics for this process.
+
+        :return: A dictionary with the hits, misses and hit rate
+        """
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else 0
+            }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_response_cache():
+    """
+    Get the process-wide response cache.
+
+    :return: The ResponseCache
+    """
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ResponseCache()
+        return _cache
@@ -0,0 +1,80 @@
+import os
+import time
+from helper_functions.database import execute_many_sql
+
+# Rows buffered before they are inserted, and the longest rows wait in the buffer
+RESULT_ROWS_BATCH_SIZE = int(os.getenv("RESULT_ROWS_BATCH_SIZE", 100))
+RESULT_ROWS_FLUSH_SECONDS = float(os.getenv("RESULT_ROWS_FLUSH_SECONDS", 5))
+
+# Re-running a row after a resume replaces the stored result instead of failing on the primary key
+INSERT_QUERY = """INSERT INTO results_rows
+(task_id, row_id, position, label, response, confidence_level, truth_level, correct, explanation)
+VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+ON DUPLICATE KEY UPDATE
+    position = VALUES(position), label = VALUES(label), response = VALUES(response),
+    confidence_level = VALUES(confidence_level), truth_level = VALUES(truth_level),
+    correct = VALUES(correct), explanation = VALUES(explanation);"""
+
+
+def _to_small_int(value):
+    # Model output is free text, so anything that doesn't fit the TINYINT columns is stored as NULL
+    try:
+        number = int(str(value).strip())
+    except (TypeError, ValueError):
+        return None
+    return number if 0 <= number <= 127 else None
+
+
+class ResultRowWriter:
+    def __init__(self, task_id, batch_size=RESULT_ROWS_BATCH_SIZE, flush_seconds=RESULT_ROWS_FLUSH_SECONDS):
+        """
+        Buffers the per-row results of a prompt run and inserts them into results_rows in batches.
+
+        :param task_id: The id of the task in running_tasks
+        :param batch_size: Rows buffered before they are inserted
+        :param flush_seconds: Seconds after which buffered rows are inserted on the next add, even if the batch isn't full
+        """
+        self.task_id = task_id
+        self.batch_size = max(1, batch_size)
+        self.flush_seconds = flush_seconds
+        self.rows = []
+        self.last_flush = time.monotonic()
+        self.retry_pending = False
+
+    def add(self, position, output_row):
+        """
+        Add a row of the output csv (see CSV_HEADERS in web_detect).
+
+        :param position: The position of the row in the run's row order
+        :param output_row: The output csv row
+        """
+        row_id, label, response, confidence_level, truth_level, correct, explanation = (
+            output_row[0], output_row[5], output_row[6], output_row[7], output_row[8], output_row[9], output_row[10]
+        )
+        self.rows.append((
+            self.task_id, int(row_id), position, _to_small_int(label), None if response is None else str(response)[:16],
+            _to_small_int(confidence_level), _to_small_int(truth_level), int(correct), explanation,
+        ))
+        # After a failed insert, wait flush_seconds before trying again rather than retrying on every row
+        batch_full = len(self.rows) >= self.batch_size and not self.retry_pending
+        if batch_full or time.monotonic() - self.last_flush >= self.flush_seconds:
+            self.flush()
+
+    def flush(self):
+        """
+        Insert the buffered rows with a single multi-row insert.
+        Rows of a failed insert are kept in the buffer and inserted with the next flush.
+
+        :return: A tuple containing a boolean indicating success and a message
+        """
+        self.last_flush = time.monotonic()
+        if not self.rows:
+            return True, "Good"
+        rows = self.rows
+        self.rows = []
+        status, message = execute_many_sql(INSERT_QUERY, rows)
+        if not status:
+            print(f"ERROR: Failed to save {len(rows)} result rows for task {self.task_id}: {message}")
+            self.rows = rows + self.rows
+        self.retry_pending = not status
+        return status, message
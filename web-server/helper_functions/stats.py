@@ -1,8 +1,10 @@
+import csv
 import os
 import pandas as pd
-from openpyxl import load_workbook
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
 from openpyxl.styles import PatternFill, Font
-import math
+from helper_functions.metrics import MetricsAccumulator
 import seaborn as sns
 import matplotlib.pyplot as plt
 
@@ -76,232 +78,151 @@ def visualize(inFileName):
     plt.show()
 
 
-def compute_sheet_stats(inFileName, outFileName):
-    # Define file paths
-    script_directory = os.path.dirname(os.path.abspath(__file__))
-    parent_directory = os.path.dirname(script_directory)
-    inFileLoc = os.path.join(parent_directory, "dynamic", "prompt_results", inFileName)
-    outFileLoc = os.path.join(parent_directory, "dynamic", "prompt_results", outFileName)
-
-    # Read data from CSV into DataFrame
-    df = pd.read_csv(inFileLoc, header=0)
-
-    # Creating the pivot table
-    pivot_table = pd.pivot_table(df, values='id', index='label', columns='response', aggfunc='count', fill_value=0)
-
-    # Adding a total column and row
-    pivot_table['Total'] = pivot_table.sum(axis=1)
-    pivot_table.loc['Total'] = pivot_table.sum()
-
-    # Get values
-    try:
-        correctDisinfo = pivot_table.at[1, 1]
-    except KeyError:
-        correctDisinfo = 0
-    try:
-        correctNoDisinfo = pivot_table.at[0, 0]
-    except KeyError:
-        correctNoDisinfo = 0
-    try:
-        falseNegative = pivot_table.at[1, 0]
-    except KeyError:
-        falseNegative = 0
-    try:
-        falsePositive = pivot_table.at[0, 1]
-    except KeyError:
-        falsePositive = 0
-
-    # Calculate statistics
-    # accuracy = (correctDisinfo + correctNoDisinfo) / pivot_table.loc['Total', 'Total']
-    # precision = correctDisinfo / (correctDisinfo + falsePositive)
-    # recall = correctDisinfo / (correctDisinfo + falseNegative)
-    # f1_score = (2 * precision * recall) / (precision + recall)
-    # tpr = correctDisinfo / (correctDisinfo + falseNegative) # Compute True Positive Rate (TPR)
-    # fpr = falsePositive / (falsePositive + correctNoDisinfo) # Compute False Positive Rate (FPR)
-    # fnr = falseNegative / (falseNegative + correctDisinfo) # Compute False Negative Rate (FNR)
-    # tnr = correctNoDisinfo / (correctNoDisinfo + falsePositive) # Compute True Negative Rate (TNR)
-    # Compute Accuracy
-    accuracy_denominator = pivot_table.loc['Total', 'Total']
-    accuracy = (correctDisinfo + correctNoDisinfo) / accuracy_denominator if accuracy_denominator != 0 else 0 # (TP + TN)/(TP + TN + FP + FN)
+# Columns of the results csv that hold numbers, written to the xlsx as numbers
+NUMERIC_COLUMNS = {"id", "label", "response", "confidence_level", "truth_level", "correct"}
 
-    # Compute Precision
-    precision_denominator = correctDisinfo + falsePositive
-    precision = correctDisinfo / precision_denominator if precision_denominator != 0 else 0
+HEADER_FILL = PatternFill(start_color="ADD8E6", end_color="ADD8E6", fill_type="solid")
 
-    # Compute Recall
-    recall_denominator = correctDisinfo + falseNegative
-    recall = correctDisinfo / recall_denominator if recall_denominator != 0 else 0
 
-    # Compute F1 Score
-    f1_score_denominator = precision + recall
-    f1_score = (2 * precision * recall) / f1_score_denominator if f1_score_denominator != 0 else 0
+def cell_value(value, numeric):
+    if value == "":
+        return None
+    if numeric:
+        try:
+            return int(value)
+        except ValueError:
+            try:
+                return float(value)
+            except ValueError:
+                return value
+    return value
 
-    # Compute True Positive Rate (TPR)
-    tpr_denominator = correctDisinfo + falseNegative
-    tpr = correctDisinfo / tpr_denominator if tpr_denominator != 0 else 0
 
-    # Compute False Positive Rate (FPR)
-    fpr_denominator = falsePositive + correctNoDisinfo # denom = FP + TN
-    fpr = falsePositive / fpr_denominator if fpr_denominator != 0 else 0 # FP/(FP + TN)
+def _styled_row(sheet, values, width, fill=None):
+    # Write-only sheets can only be styled through WriteOnlyCell, padded to the width of the table
+    row = []
+    for value in list(values) + [None] * (width - len(values)):
+        cell = WriteOnlyCell(sheet, value=value)
+        cell.font = Font(bold=True)
+        if fill is not None:
+            cell.fill = fill
+        row.append(cell)
+    return row
 
-    # Compute False Negative Rate (FNR)
-    fnr_denominator = falseNegative + correctDisinfo
-    fnr = falseNegative / fnr_denominator if fnr_denominator != 0 else 0
 
-    # Compute True Negative Rate (TNR)
-    tnr_denominator = correctNoDisinfo + falsePositive
-    tnr = correctNoDisinfo / tnr_denominator if tnr_denominator != 0 else 0
+def compute_sheet_stats(inFileName, outFileName, metrics=None):
+    """
+    Write the results xlsx of a csv in the prompt results directory and return the run's stats.
 
-    # Round numbers
-    accuracy = round(accuracy, 3)
-    precision = round(precision, 3)
-    recall = round(recall, 3)
-    f1_score = round(f1_score, 3)
-    tpr = round(tpr, 3)
-    fpr = round(fpr, 3)
-    fnr = round(fnr, 3)
-    tnr = round(tnr, 3)
-
-    # Pivot table for confidence_level
-    pivot_table_confidence = pd.pivot_table(df, values='id', index='confidence_level', aggfunc='count', fill_value=0)
-
-    # Pivot table for truth_level
-    pivot_table_truth = pd.pivot_table(df, values='id', index='truth_level', aggfunc='count', fill_value=0)
-
-    # Create ExcelWriter object
-    with pd.ExcelWriter(outFileLoc, engine='openpyxl') as writer:
-        # Write DataFrame to the first sheet named "Results"
-        df.to_excel(writer, sheet_name='Results', index=False)
-
-    # Load the workbook after it has been saved
-    wb = load_workbook(outFileLoc)
-
-    # Create a new sheet named "Pivots"
-    pivot_sheet = wb.create_sheet(title='Stats')
-
-    # Set the width of columns manualy
-    pivot_sheet.column_dimensions['A'].width = 40
-    pivot_sheet.column_dimensions['B'].width = 20
-    pivot_sheet.column_dimensions['C'].width = 20
-    pivot_sheet.column_dimensions['D'].width = 20
-
-    # Write individual values to the "Pivots" sheet
+    :param inFileName: The name of the results csv
+    :param outFileName: The name of the xlsx to write
+    :param metrics: The MetricsAccumulator of the run, counted from the csv while it is copied if not given
+    :return: The stats dictionary (see MetricsAccumulator.stats)
+    """
+    # Define file paths
+    script_directory = os.path.dirname(os.path.abspath(__file__))
+    parent_directory = os.path.dirname(script_directory)
+    inFileLoc = os.path.join(parent_directory, "dynamic", "prompt_results", inFileName)
+    outFileLoc = os.path.join(parent_directory, "dynamic", "prompt_results", outFileName)
+    return write_results_workbook(inFileLoc, outFileLoc, metrics=metrics)
+
+
+def write_results_workbook(inFileLoc, outFileLoc, metrics=None):
+    """
+    Write the results xlsx (the results and a stats sheet) in a single pass and return the run's stats.
+    The results are streamed from the csv into a write-only workbook, so the run is never held in memory.
+
+    :param inFileLoc: The path of the results csv
+    :param outFileLoc: The path of the xlsx to write
+    :param metrics: The MetricsAccumulator of the run, counted from the csv while it is copied if not given
+    :return: The stats dictionary (see MetricsAccumulator.stats)
+    """
+    count_rows = metrics is None
+    if count_rows:
+        metrics = MetricsAccumulator()
+
+    wb = Workbook(write_only=True)
+
+    # Copy the csv to the "Results" sheet
+    results_sheet = wb.create_sheet(title='Results')
+    with open(inFileLoc, mode="r", newline="", encoding='utf-8') as csv_file:
+        reader = csv.reader(csv_file)
+        header = next(reader, [])
+        numeric = [column in NUMERIC_COLUMNS for column in header]
+        results_sheet.append(_styled_row(results_sheet, header, len(header)))
+        if count_rows:
+            columns = [header.index(column) for column in ("label", "response", "confidence_level", "truth_level")]
+        for line in reader:
+            results_sheet.append([cell_value(value, is_numeric) for value, is_numeric in zip(line, numeric)])
+            if count_rows:
+                metrics.add(*[line[column] for column in columns])
+
+    stats = metrics.stats()
+    sheet_stats = metrics.stats(digits=3)
+
+    # Summary values
     values = {
-        'Correct Disinformation': correctDisinfo,
-        'Correct No Disinformation': correctNoDisinfo,
-        'False Negative (missed disinformation)': falseNegative,
-        'False Positive (claimed disinfo when it wasn\'t)': falsePositive,
-        'Accuracy': accuracy,
-        'Precision': precision,
-        'Recall': recall,
-        'F1_score': f1_score,
-        'True Positive Rate (TPR)': tpr,
-        'False Positive Rate (FPR)': fpr,
-        'False Negative Rate (FNR)': fnr,
-        'True Negative Rate (TNR)': tnr
+        'Correct Disinformation': sheet_stats['tPos'],
+        'Correct No Disinformation': sheet_stats['tNeg'],
+        'False Negative (missed disinformation)': sheet_stats['fNeg'],
+        'False Positive (claimed disinfo when it wasn\'t)': sheet_stats['fPos'],
+        'Accuracy': sheet_stats['accuracy'],
+        'Precision': sheet_stats['precision'],
+        'Recall': sheet_stats['recall'],
+        'F1_score': sheet_stats['fscore'],
+        'True Positive Rate (TPR)': sheet_stats['TPR'],
+        'False Positive Rate (FPR)': sheet_stats['FPR'],
+        'False Negative Rate (FNR)': sheet_stats['FNR'],
+        'True Negative Rate (TNR)': sheet_stats['TNR']
     }
 
-    # Add a starting explanation row
-    pivot_sheet.cell(row=1, column=1, value="Summary statistics")
-    pivot_header_row_indices = [pivot_sheet.max_row]
-
-    for i, (key, value) in enumerate(values.items()):
-        pivot_sheet.cell(row=i+2, column=1, value=key)
-        pivot_sheet.cell(row=i+2, column=2, value=value)
-
+    # Lay out the "Stats" sheet as (row, is header row) pairs, rows are written once the width is known
+    stats_rows = [(["Summary statistics"], True)]
+    stats_rows += [([key, value], False) for key, value in values.items()]
     # Add border for end of summary
-    pivot_header_row_indices.append(pivot_sheet.max_row+1)
-
-    # Add empty rows
-    pivot_sheet.append([])
-    pivot_sheet.append([])
-    pivot_sheet.append([])
-    pivot_sheet.append([])
-
-    # Prepare Pivot headers
-    pivot_sheet.append(["Confusion Matrix for Accuracy"])
-    pivot_header_row_indices.append(pivot_sheet.max_row)
-    pivot_sheet.append(["Dataset Truth Values", "AI Claimed False", "AI Claimed True", "Total"])
-    pivot_header_row_indices.append(pivot_sheet.max_row)
-    # Write pivot tables for label, confidence_level, and truth_level beneath the individual values
-    for r in pd.DataFrame(pivot_table).iterrows():
+    stats_rows.append(([], True))
+    stats_rows += [([], False)] * 3
+
+    # Confusion matrix
+    stats_rows.append((["Confusion Matrix for Accuracy"], True))
+    stats_rows.append((["Dataset Truth Values", "AI Claimed False", "AI Claimed True", "Total"], True))
+    _, confusion_rows = metrics.confusion_table()
+    for row in confusion_rows:
         row_label = "Grand Total"
-        if str(r[0]) == "0":
+        if str(row[0]) == "0":
             row_label = "Actually False"
-        if str(r[0]) == "1":
+        if str(row[0]) == "1":
             row_label = "Actually True"
-        # Append row
-        pivot_sheet.append([row_label]+r[1].tolist())
-    pivot_header_row_indices.append(pivot_sheet.max_row)
-
-    # Add empty rows
-    pivot_sheet.append([])
-    pivot_sheet.append([])
-    pivot_sheet.append([])
-
-    # Pivot for confidence level
-    # Prepare Headers
-    pivot_sheet.append(["AI Confidence Rating", "Count of Responses"])
-    pivot_header_row_indices.append(pivot_sheet.max_row)
-    # Append Rows
-    confidence_total = 0
-    for r in pd.DataFrame(pivot_table_confidence).iterrows():
-        pivot_sheet.append([r[0]]+r[1].tolist())
-        confidence_total += sum(value for value in r[1].tolist())
-    # Add Grand Total row
-    pivot_sheet.append(["Grand Total", confidence_total])
-    pivot_header_row_indices.append(pivot_sheet.max_row)
-
-    # Add empty rows
-    pivot_sheet.append([])
-    pivot_sheet.append([])
-    pivot_sheet.append([])
-
-    pivot_sheet.append(["AI Truth Level Rating", "Count of Responses"])
-    pivot_header_row_indices.append(pivot_sheet.max_row)
-    # Append Rows
-    truth_total = 0
-    for r in pd.DataFrame(pivot_table_truth).iterrows():
-        pivot_sheet.append([r[0]]+r[1].tolist())
-        truth_total += sum(value for value in r[1].tolist())
-    # Add Grand Total row
-    pivot_sheet.append(["Grand Total", truth_total])
-    pivot_header_row_indices.append(pivot_sheet.max_row)
-
-    # Apply fill color only to pivot header rows
-    for row_index in pivot_header_row_indices:
-        for cell in pivot_sheet[row_index]:
-            cell.fill = PatternFill(start_color="ADD8E6", end_color="ADD8E6", fill_type="solid")
-            cell.font = Font(bold=True)
-
-    # Save the workbook
-    wb.save(outFileLoc)
-
-    # Make stats variable
-    numCorrect = correctDisinfo + correctNoDisinfo
-    numRows = df.shape[0]
-
-    stats = {
-        'tPos': correctDisinfo,
-        'tNeg': correctNoDisinfo,
-        'fNeg': falseNegative,
-        'fPos': falsePositive,
-        'accuracy': round(accuracy, 2),
-        'precision': round(precision, 2),
-        'recall': round(recall, 2),
-        'fscore': round(f1_score, 2),
-        'TPR': tpr,
-        'FPR': fpr,
-        'FNR': fnr,
-        'TNR': tnr,
-        'num_rows': numRows,
-        'num_correct': numCorrect,
-        'percent_correct': math.floor((numCorrect / numRows) * 100),
-        'percent_TPR': round((correctDisinfo / numRows) * 100),
-        'percent_FPR': round((falsePositive / numRows) * 100),
-        'percent_TNR': round((correctNoDisinfo / numRows) * 100),
-        'percent_FNR': round((falseNegative / numRows) * 100)
-    }
-
-    # Return the filename and stats
+        stats_rows.append(([row_label] + row[1:], row_label == "Grand Total"))
+    stats_rows += [([], False)] * 3
+
+    # Confidence and truth level histograms
+    for title, name in (("AI Confidence Rating", "confidence"), ("AI Truth Level Rating", "truth")):
+        stats_rows.append(([title, "Count of Responses"], True))
+        total = 0
+        for level, count in metrics.histogram(name):
+            stats_rows.append(([level, count], False))
+            total += count
+        stats_rows.append((["Grand Total", total], True))
+        stats_rows += [([], False)] * 3
+
+    while stats_rows[-1] == ([], False):
+        stats_rows.pop()
+
+    stats_sheet = wb.create_sheet(title='Stats')
+    # Set the width of columns manualy
+    stats_sheet.column_dimensions['A'].width = 40
+    stats_sheet.column_dimensions['B'].width = 20
+    stats_sheet.column_dimensions['C'].width = 20
+    stats_sheet.column_dimensions['D'].width = 20
+    width = max(len(row) for row, _ in stats_rows)
+    for row, is_header in stats_rows:
+        stats_sheet.append(_styled_row(stats_sheet, row, width, HEADER_FILL) if is_header else row)
+
+    # Save to a temporary file first so a download never gets a partial workbook
+    temp_path = f"{outFileLoc}.{os.getpid()}.tmp"
+    wb.save(temp_path)
+    os.replace(temp_path, outFileLoc)
+
+    # Return the stats
     return stats
@@ -0,0 +1,106 @@
+import os
+import threading
+import time
+from helper_functions.database import sql_results_one, sql_results_all
+
+# Seconds a cached lookup is trusted. Changes made through this process are invalidated right away,
+# changes made by other processes (or directly in the database) show up after at most this long.
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", 60))
+
+
+class TTLCache:
+    def __init__(self, ttl_seconds=USER_CACHE_TTL, max_entries=10000):
+        """
+        A small thread-safe in-process cache whose entries expire after ttl_seconds.
+
+        :param ttl_seconds: Seconds an entry is kept
+        :param max_entries: Entries kept before expired entries are dropped
+        """
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.entries = {}
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        """
+        :return: A tuple of whether the key was found and its value
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return False, None
+            if entry[1] <= time.monotonic():
+                del self.entries[key]
+                return False, None
+            return True, entry[0]
+
+    def set(self, key, value):
+        now = time.monotonic()
+        with self.lock:
+            if len(self.entries) >= self.max_entries:
+                self.entries = {k: entry for k, entry in self.entries.items() if entry[1] > now}
+                # Still full of live entries, start over rather than grow without bound
+                if len(self.entries) >= self.max_entries:
+                    self.entries.clear()
+            self.entries[key] = (value, now + self.ttl_seconds)
+
+    def invalidate(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+
+_roles = TTLCache()
+_memberships = TTLCache()
+
+
+# Get the roles of a user
+def get_user_roles(user_id):
+    """
+    Get the names of a user's roles, from the cache if possible.
+
+    :param user_id: The id of the user
+    :return: A tuple containing a boolean indicating success, a message, and a list of role names
+    """
+    found, roles = _roles.get(int(user_id))
+    if found:
+        return True, "Good", roles
+    status, message, result = sql_results_all("SELECT role_name FROM user_roles JOIN roles ON user_roles.role_id = roles.role_id WHERE user_roles.user_id = %s;", (user_id,))
+    if not status:
+        return False, message, None
+    roles = [row[0] for row in result]
+    _roles.set(int(user_id), roles)
+    return True, "Good", roles
+
+# Remember roles that were loaded some other way (e.g. at login)
+def cache_user_roles(user_id, roles):
+    _roles.set(int(user_id), list(roles))
+
+# Forget cached roles after they change
+def invalidate_user_roles(user_ids):
+    for user_id in user_ids:
+        _roles.invalidate(int(user_id))
+
+
+# Check if a user is in a competition
+def is_competition_member(competition_id, user_id):
+    """
+    Check if a user is a participant of a competition, from the cache if possible.
+
+    :param competition_id: The id of the competition
+    :param user_id: The id of the user
+    :return: A tuple containing a boolean indicating success, a message, and whether the user is a participant
+    """
+    key = (str(competition_id), int(user_id))
+    found, is_member = _memberships.get(key)
+    if found:
+        return True, "Good", is_member
+    status, message, result = sql_results_one("SELECT 1 FROM competition_participants WHERE competition_id = %s AND user_id = %s LIMIT 1;", (competition_id, user_id,))
+    if not status:
+        return False, message, None
+    is_member = bool(result)
+    _memberships.set(key, is_member)
+    return True, "Good", is_member
+
+# Forget a cached membership after the user joins or leaves
+def invalidate_competition_member(competition_id, user_id):
+    _memberships.invalidate((str(competition_id), int(user_id)))
@@ -1,25 +1,35 @@
-from flask import Flask, render_template, request, send_from_directory, redirect, url_for, session, flash
-from web_detect import run_prompt
-import threading
 import os
 import sys
 from dotenv import load_dotenv
+
+# Determine the path to the .env file
+env_path = os.path.join(os.path.dirname(sys.argv[0]), '..', '.env')
+
+# Load .env variables before the helpers read their settings
+load_dotenv(env_path)
+
+from flask import Flask, render_template, request, send_file, redirect, url_for, session, flash, jsonify
+from web_detect import enqueue_prompt, check_run_api_key
 from helper_functions.email_functions import check_email, send_verification_email, resend_verification_email, validate_password, send_reset_password_email
-from helper_functions.api import test_gemini_key, test_chatgpt_key
 from routes.documents import documents_routes
 from routes.account import account_routes
 from routes.admin import admin_routes
 from routes.competition import competition_routes
 from routes.organizer import organizer_routes
-from helper_functions.fail_running_tasks import fail_running_tasks
+from helper_functions.job_queue import user_has_active_task
 import mysql.connector
 from helper_functions.database import get_db_connection, execute_sql, sql_results_one, sql_results_all, execute_sql_return_id
 from helper_functions.prompt import append_instructions, get_instructions
+from helper_functions.query_metrics import start_request, end_request, record_request
+from helper_functions.user_cache import cache_user_roles, get_user_roles
+from helper_functions.dataset_registry import get_dataset
+from helper_functions.checkpoint import get_task_progress
+from helper_functions.pagination import get_per_page, decode_cursor, encode_cursor, keyset_condition, order_by_clause, split_page
+from helper_functions.report_artifacts import get_report_file
 from helper_functions.account_actions import is_valid_password_token, get_user_from_token, validate_user_name
 from flask_wtf import CSRFProtect
 import hashlib
 import secrets
-import json
 
 
 # Decorator used to exempt route from requiring login
@@ -27,11 +37,8 @@ def login_exempt(f):
     f.login_exempt = True
     return f
 
-# Determine the path to the .env file
-env_path = os.path.join(os.path.dirname(sys.argv[0]), '..', '.env')
-
-# Load .env variables
-load_dotenv(env_path)
+# Who gets the Server-Timing header with each response's database time: "admin", "all" or "off"
+SERVER_TIMING = os.getenv("SERVER_TIMING", "admin")
 
 # Initialize App
 app = Flask(__name__)
@@ -47,6 +54,25 @@ csrf = CSRFProtect()
 csrf.init_app(app)
 
 
+@app.before_request
+def start_query_metrics():
+    start_request()
+
+@app.after_request
+def record_query_metrics(response):
+    queries, seconds = end_request()
+    record_request(request.endpoint or "unknown", queries, seconds)
+    # Report the database work done for this request in the browser's network timing panel, to admins only by default
+    if SERVER_TIMING == "all" or (SERVER_TIMING == "admin" and is_admin_session()):
+        response.headers["Server-Timing"] = f'db;dur={seconds * 1000:.1f};desc="{queries} queries"'
+    return response
+
+def is_admin_session():
+    if 'user_id' not in session:
+        return False
+    status, message, user_roles = get_user_roles(session['user_id'])
+    return status and 'admin' in user_roles
+
 @app.before_request
 def default_login_required():
     # exclude 404 errors and static routes
@@ -87,11 +113,16 @@ def login():
             flash("Invalid email format", 'error')
             return render_template("register.html")
 
-        conn = get_db_connection()
-        cursor = conn.cursor()
         try:
-            # Execute the SQL query to fetch the hashed password associated with the username
-            status, message, result = sql_results_one("SELECT user_id, password, salt, confirmed, full_name FROM users WHERE email = %s;", (email,))
+            # Fetch the user, their roles and their gemini key in one query
+            query = """SELECT users.user_id, users.password, users.salt, users.confirmed, users.full_name,
+                (SELECT GROUP_CONCAT(roles.role_name) FROM user_roles JOIN roles ON user_roles.role_id = roles.role_id WHERE user_roles.user_id = users.user_id),
+                (SELECT `key` FROM gemini_keys WHERE gemini_keys.user_id = users.user_id)
+            FROM users WHERE email = %s;"""
+            status, message, result = sql_results_one(query, (email,))
+            if not status:
+                flash(f"Unknown error occurred during login: {message}", 'error')
+                return render_template("login.html")
 
             # If no result found for the given username, return False
             if not result:
@@ -117,21 +148,11 @@ def login():
             session["full_name"] = result[4]
 
             # Add any roles if user has them
-            # Fetch user roles from the database
-            status, message, user_roles = sql_results_all("SELECT role_name FROM user_roles JOIN roles ON user_roles.role_id = roles.role_id WHERE user_roles.user_id = %s;", (session["user_id"],))
-            if status:
-                session["user_roles"] = [role[0] for role in user_roles]
-            else:
-                print(f"Failed to fetch user roles: {message}")
-                flash(f"Failed to fetch user roles: {message}", 'error')
-                return render_template("login.html")
-            
+            session["user_roles"] = result[5].split(",") if result[5] else []
+            cache_user_roles(session["user_id"], session["user_roles"])
+
             # Get gemini key if they have one
-            status, message, result = sql_results_one("SELECT `key` FROM gemini_keys WHERE user_id = %s;", (session["user_id"],))
-            if status and result:
-                session["gemini_key"] = result[0]
-            else:
-                session["gemini_key"] = None
+            session["gemini_key"] = result[6]
 
             # Redirect them to their requested page
             if session.get('attempted_route'):
@@ -142,8 +163,6 @@ def login():
         except mysql.connector.Error as err:
             flash(f"Unknown error occurred during login: {err}", 'error')
             return render_template("login.html")
-        finally:
-            conn.close()
 
 @app.route('/logout')
 @login_exempt
@@ -270,6 +289,7 @@ def verify_email():
             cursor.execute(sql, val)
             conn.commit()
             cursor.close()
+            conn.close()
 
             # Remove the old verification code
             conn = get_db_connection()
@@ -316,37 +336,21 @@ def submit_prompt():
     prompt = request.form['prompt']
     dataset_name = request.form['dataset']
     num_rows = request.form.get('num-rows', type=int)
-    api_key = session["gemini_key"]
-    
-    # If the user doesn't have a gemini key, redirect them to the account page
-    if api_key is None:
-        flash("Please enter a Gemini key before testing prompts.", 'info')
-        return redirect(url_for('account.account_page'))
 
     # Check if the specified number of rows exceeds the maximum allowed
     if num_rows is None or (max_rows is not None and (num_rows < 1 or num_rows > max_rows)):
-        num__rows = 300  # Default to 300 rows if invalid or not specified
+        num_rows = 300  # Default to 300 rows if invalid or not specified
 
-    # Validate dataset name against mapping
-    dataset_mapping = load_dataset_mapping()
-    if dataset_name not in dataset_mapping:
+    # Validate dataset name against the registry
+    dataset = get_dataset(dataset_name)
+    if dataset is None:
         flash("Invalid dataset selected.", 'error')
         return redirect(url_for('index'))
-    
-    # Get folder and filename for the selected dataset
-    dataset_info = dataset_mapping.get(dataset_name)
-    if dataset_info is None or 'directory' not in dataset_info:
-        flash("Dataset not in allowed list.", 'error')
-        return redirect(url_for('index'))
-
-    dataset_folder, dataset_filename = dataset_info.get('directory', (None, None))
-    if dataset_folder is None or dataset_filename is None:
-        flash("Invalid dataset information.", 'error')
-        return redirect(url_for('index'))
-    dataset_subject = dataset_info.get('subject', '')
+    # A run can't use more rows than the dataset has
+    num_rows = min(num_rows, dataset["rows"])
 
-    # Check to see if user has another prompt currently running
-    status, message, result = sql_results_all("SELECT * FROM running_tasks WHERE user_id = %s AND status = 'RUNNING';", (session["user_id"],))
+    # Check to see if user has another prompt queued or running
+    status, message, result = user_has_active_task(session["user_id"])
     if not status:
         flash(f"Error checking for running tasks: {message}", 'error')
         return redirect(url_for('index'))
@@ -354,8 +358,12 @@ def submit_prompt():
         flash("You already have a prompt running. Please wait for it to finish before submitting another.", 'error')
         return redirect(url_for('index'))
     
-    # Test API key before starting
-    success, message = test_gemini_key(api_key=api_key)
+    # Test the API key for the model backend before starting
+    success, message, has_key = check_run_api_key(session["user_id"])
+    if not has_key:
+        # If the user doesn't have a key, redirect them to the account page
+        flash(message, 'info')
+        return redirect(url_for('account.account_page'))
     if not success:
         flash(f"API Key error: {message}", 'error')
         return redirect(url_for('index'))
@@ -369,14 +377,17 @@ def submit_prompt():
     # Prepare dataset info
     dataset_info = {
         'name': dataset_name,
-        'folder': dataset_folder,
-        'filename': dataset_filename,
-        'subject': dataset_subject
+        'folder': dataset["folder"],
+        'filename': dataset["filename"],
+        'subject': dataset["subject"],
+        'file_path': dataset["file_path"]
     }
 
-    # Create a thread and pass the function to it
-    thread = threading.Thread(target=run_prompt, args=(api_key,prompt,email,base_url,user_id,dataset_info,num_rows,None,))
-    thread.start()
+    # Queue the prompt run for the workers
+    status, message, task_uuid = enqueue_prompt(prompt, email, base_url, user_id, dataset_info, num_rows, None)
+    if not status:
+        flash(f"Error queueing prompt: {message}", 'error')
+        return redirect(url_for('index'))
     
     # Save their prompt to the session to be displayed later
     full_prompt = append_instructions(prompt=prompt)
@@ -385,6 +396,79 @@ def submit_prompt():
     # Redirect to the confirmation page
     return redirect(url_for('confirmation'))
 
+# Get the progress and stats so far of one of the user's prompt runs
+@app.route('/task-progress/<task_uuid>', methods=['GET'])
+def task_progress(task_uuid):
+    status, message, progress = get_task_progress(task_uuid, session["user_id"])
+    if not status:
+        return jsonify({'error': message}), 500
+    if progress is None:
+        return jsonify({'error': 'Task not found'}), 404
+    return jsonify(progress)
+
+# Sort orders for a user's results, each served by an index on results (user_id, ...)
+RESULTS_HISTORY_ORDERS = {
+    'recent': [("results.finish_time", "DESC"), ("results.id", "DESC")],
+    'fscore': [("results.fscore", "DESC"), ("results.id", "DESC")],
+}
+
+@app.route('/results-history', methods=['GET'])
+def results_history():
+    # Get the sort order, filter, per_page and cursor parameters
+    sort = request.args.get('sort', 'recent')
+    if sort not in RESULTS_HISTORY_ORDERS:
+        return jsonify({'error': 'Invalid sort'}), 400
+    min_fscore = request.args.get('min_fscore', type=float)
+    per_page = get_per_page(request)
+    try:
+        after = decode_cursor(request.args.get('cursor'), 2)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    # Filter and sort on the typed metric columns, so the (user_id, finish_time) and (user_id, fscore) indexes are used
+    order_by = RESULTS_HISTORY_ORDERS[sort]
+    conditions, values = ["results.user_id = %s", f"{order_by[0][0]} IS NOT NULL"], [session["user_id"]]
+    if min_fscore is not None:
+        conditions.append("results.fscore >= %s")
+        values.append(min_fscore)
+    if after is not None:
+        condition, condition_values = keyset_condition(order_by, after)
+        conditions.append(condition)
+        values.extend(condition_values)
+    query = f"""SELECT results.uuid, results.finish_time, results.accuracy, results.`precision`, results.recall, results.fscore,
+        results.fscore_ci_low, results.fscore_ci_high, results.id
+    FROM results
+    WHERE {" AND ".join(conditions)}
+    ORDER BY {order_by_clause(order_by)}
+    LIMIT %s;"""
+    status, message, rows = sql_results_all(query, tuple(values) + (per_page + 1,))
+    if not status:
+        return jsonify({'error': message}), 500
+    rows, has_more = split_page(rows, per_page)
+
+    # Format the results to be easily passable to the frontend
+    results = []
+    for row in rows:
+        results.append({
+            'uuid': row[0],
+            'finish_time': str(row[1]),
+            'accuracy': row[2],
+            'precision': row[3],
+            'recall': row[4],
+            'fscore': row[5],
+            'fscore_ci': [row[6], row[7]] if row[6] is not None else None
+        })
+
+    # The cursor holds the sort column and id of the last result on the page
+    next_cursor = None
+    if has_more:
+        next_cursor = encode_cursor([rows[-1][1] if sort == 'recent' else rows[-1][5], rows[-1][8]])
+    return jsonify({
+        'results': results,
+        'next_cursor': next_cursor,
+        'per_page': per_page
+    })
+
 # Recieves request to download a file and redirects to downloading route
 @app.route('/download/<path:filename>',  methods=['GET'])
 def download(filename):
@@ -394,8 +478,12 @@ def download(filename):
 # Define the route for downloading files
 @app.route('/download-file/<path:filename>',  methods=['GET'])
 def download_file(filename):
+    # Formats other than the csv are created the first time they are downloaded
+    status, message, path = get_report_file(filename)
+    if not status:
+        return message, 404 if message == "File not found" else 500
     # Send the file to the user
-    return send_from_directory("dynamic/prompt_results", filename)
+    return send_file(path, download_name=filename)
 
 @app.route('/confirmation', methods=["GET"])
 def confirmation():
@@ -513,12 +601,7 @@ def generate_salt():
 # Hash the password with the provided salt
 def hash_password(password, salt):
     return hashlib.sha256((password + salt).encode()).hexdigest()
-
-def load_dataset_mapping():
-    with open('static/datasets/dataset_mapping.json', 'r') as f:
-        return json.load(f)
 ## --------- End Helper Functions --------- ##
 
 if __name__ == '__main__':
-    fail_running_tasks()
     app.run(host='0.0.0.0', port=8080, debug=True)
@@ -1,6 +1,6 @@
 from flask import Blueprint, render_template, request, redirect, url_for, flash, session
 from helper_functions.database import execute_sql, sql_results_one
-from helper_functions.api import test_gemini_key, test_chatgpt_key
+from helper_functions.api import validate_gemini_key, validate_chatgpt_key
 from helper_functions.database import execute_sql, sql_results_one
 from helper_functions.account_actions import is_valid_account_removal_token, delete_account_removal_token_for_user, validate_user_name
 from helper_functions.email_functions import send_account_removal_email
@@ -165,10 +165,10 @@ def helper_save_query_key(api_key_type, api_key):
 def helper_test_query_key(api_key_type, api_key):
     # Test api key by type
     if api_key_type == 'gemini_key':
-        status, message = test_gemini_key(api_key)
+        status, message = validate_gemini_key(api_key)
         return status, message
     elif api_key_type == 'chatgpt_key':
-        status, message = test_chatgpt_key(api_key)
+        status, message = validate_chatgpt_key(api_key)
         return status, message
     else:
         return False, "Invalid API key type"
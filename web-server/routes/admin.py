@@ -3,13 +3,25 @@ from functools import wraps
 import json
 from helper_functions.database import execute_sql, sql_results_one, sql_results_all, execute_many_sql, execute_sql_return_id, Database
 from helper_functions.email_functions import send_generic_email
+from helper_functions.query_metrics import get_query_stats, get_request_stats
+from helper_functions.user_cache import get_user_roles, invalidate_user_roles
+from helper_functions.pagination import encode_cursor, decode_cursor, keyset_condition, get_per_page, split_page, cached_count
 
 admin_routes = Blueprint('admin', __name__, template_folder='admin')
 
 def admin_required(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
-        if 'user_roles' not in session or 'admin' not in session['user_roles']:
+        if 'user_id' not in session:
+            flash("You need to be an admin to access this page.", 'error')
+            return redirect(url_for('login'))
+        # Check the user's current roles, which are cached so this rarely needs the database
+        status, message, user_roles = get_user_roles(session['user_id'])
+        if not status:
+            flash(message, 'error')
+            return redirect(url_for('index'))
+        session["user_roles"] = user_roles
+        if 'admin' not in user_roles:
             flash("You need to be an admin to access this page.", 'error')
             return redirect(url_for('login'))
         return f(*args, **kwargs)
@@ -28,15 +40,26 @@ def admin_dashboard():
 @admin_routes.route('/users', methods=['GET'])
 @admin_required
 def get_users():
-    page = request.args.get('page', 1, type=int)
-    per_page = request.args.get('per_page', 10, type=int)
-    start = (page - 1) * per_page
+    per_page = get_per_page(request)
+    try:
+        after = decode_cursor(request.args.get('cursor'), 1)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
 
-    status, message, users = sql_results_all("SELECT user_id, email, roles FROM users_and_roles LIMIT %s OFFSET %s", (per_page, start))
+    # Page through users by id, then look up the roles of only the users on the page
+    condition, condition_values = ("TRUE", ()) if after is None else keyset_condition([("user_id", "ASC")], after)
+    query = f"""SELECT page_users.user_id, page_users.email, GROUP_CONCAT(roles.role_name) AS roles
+    FROM (SELECT user_id, email FROM users WHERE {condition} ORDER BY user_id ASC LIMIT %s) AS page_users
+    LEFT JOIN user_roles ON page_users.user_id = user_roles.user_id
+    LEFT JOIN roles ON user_roles.role_id = roles.role_id
+    GROUP BY page_users.user_id, page_users.email
+    ORDER BY page_users.user_id ASC;"""
+    status, message, users = sql_results_all(query, condition_values + (per_page + 1,))
     if not status:
         return jsonify({'error': message}), 500
+    users, has_more = split_page(users, per_page)
     
-    status, message, total = sql_results_one("SELECT COUNT(*) FROM users;")
+    status, message, total = cached_count("SELECT COUNT(*) FROM users;")
     if not status:
         return jsonify({'error': message}), 500
 
@@ -54,10 +77,23 @@ def get_users():
     return jsonify({
         'users': formatted_users,
         'total': total,
-        'page': page,
+        'next_cursor': encode_cursor([users[-1][0]]) if has_more else None,
         'per_page': per_page
     })
 
+@admin_routes.route('/query-metrics', methods=['GET'])
+@admin_required
+def get_query_metrics():
+    """
+    Database timings recorded by this server process since it started:
+    the slowest statements by total time, and the query count and database time of each endpoint.
+    """
+    limit = request.args.get('limit', 50, type=int)
+    return jsonify({
+        'queries': get_query_stats(limit),
+        'endpoints': get_request_stats()
+    })
+
 @admin_routes.route('/actions', methods=['POST'])
 @admin_required
 def admin_actions():
@@ -132,6 +168,7 @@ def admin_actions():
         status, message = execute_many_sql("INSERT INTO user_roles (user_id, role_id) VALUES (%s, %s)", user_role_values)
         if not status:
             return jsonify({'error': message}), 500
+        invalidate_user_roles(user_ids)
         
         # Return success
         return_message = "Added the {} role from selected users.".format(role)
@@ -155,6 +192,7 @@ def admin_actions():
         status, message = execute_sql(query, tuple(values))
         if not status:
             return jsonify({'error': message}), 500
+        invalidate_user_roles(user_ids)
         
         # Return success
         return_message = "Removed the {} role from selected users.".format(role)
@@ -221,12 +259,12 @@ def add_organizer(user_id):
             return False, "User email not found"
         receiver_email = receiver_email[0]
 
-        # Send email to organizer
+        # Queue email to organizer, it is only sent if the transaction commits
         base_url = request.host_url
         subject = "You have now been added as an organizer. Let's get started!"
         body = "Hello! You have been added as an organizer. You can now start creating your competition. " \
                 "Please click on the link below to get started: {}/organizer/dashboard/{}".format(base_url, comp_id)
-        status, message = send_generic_email(receiver_email, subject, body)
+        status, message = send_generic_email(receiver_email, subject, body, db=db)
         if not status:
             db.rollback()
             return False, message
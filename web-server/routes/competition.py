@@ -1,11 +1,15 @@
 from flask import Blueprint, render_template, flash, redirect, url_for, request, session, jsonify
 from helper_functions.database import execute_sql, sql_results_one, sql_results_all
 from helper_functions.prompt import append_instructions, get_instructions
-from web_detect import run_prompt
-import json
-from helper_functions.api import test_gemini_key
+from web_detect import enqueue_prompt, check_run_api_key, get_api_key
+from helper_functions.model_backend import DEFAULT_BACKEND
+from helper_functions.job_queue import user_has_active_task
+from helper_functions.leaderboard import get_leaderboard_page, count_leaderboard
+from helper_functions.user_cache import is_competition_member, invalidate_competition_member
+from helper_functions.dataset_registry import get_datasets
+from helper_functions.pagination import encode_cursor, decode_cursor, keyset_condition, order_by_clause, get_per_page, split_page, cached_count
 from helper_functions.security import check_filename_for_traversal
-import threading
+import decimal
 import os
 
 SCRIPTS_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
@@ -109,7 +113,7 @@ def register(join_link):
             return redirect(url_for('competition_routes.register', join_link=join_link))
         
         # Check if user is already part of the competition  
-        status, message, result = sql_results_one("SELECT * FROM competition_participants WHERE competition_id = %s AND user_id = %s", (competition_id, session["user_id"],))
+        status, message, result = is_competition_member(competition_id, session["user_id"])
         if not status:
             flash(f"Error occurred while joining competition: {message}", "error")
             return redirect(url_for('index'))
@@ -121,15 +125,17 @@ def register(join_link):
         if not status:
             flash(f"Error occurred while joining competition: {message}", "error")
             return redirect(url_for('index'))
+        invalidate_competition_member(competition_id, session["user_id"])
         
         flash("Successfully registered for competition", "success")
         return redirect(url_for('competition_routes.competition_page', competition_id=competition_id))
 
 @competition_routes.route('/prompt-editor/<comp_id>', methods=['GET', 'POST'])
 def prompt_editor(comp_id):
-    # Ensure user has a Gemini key before testing prompts
-    if not session.get("gemini_key"):
-        flash("Please enter a Gemini key before testing prompts.", 'info')
+    # Ensure user has a key for the model backend before testing prompts
+    if not get_api_key(session["user_id"], DEFAULT_BACKEND):
+        key_name = "OpenAI" if DEFAULT_BACKEND == 'openai' else "Gemini"
+        flash(f"Please enter a {key_name} key before testing prompts.", 'info')
         return redirect(url_for('account.account_page'))
     
     # Check if user is in competition, and get competition details
@@ -146,11 +152,8 @@ def prompt_editor(comp_id):
     comp_name = result[0]
 
     if request.method == 'GET':
-        # Load dataset names
-        dataset_mapping = load_dataset_mapping()
-
-        # Create a list of tuples containing dataset name and max rows
-        datasets = {name: mapping["rows"] for name, mapping in dataset_mapping.items()}
+        # Create a dictionary of dataset name to max rows
+        datasets = {name: dataset["rows"] for name, dataset in get_datasets().items()}
         
         # Get instructions for the prompt
         instructions = "\n" + get_instructions()
@@ -162,7 +165,6 @@ def prompt_editor(comp_id):
         # Get prompt and email
         prompt = request.form['prompt']
         email = session["email"]
-        api_key = session["gemini_key"]
 
         # Get dataset for the competition
         status, message, result = sql_results_one("SELECT file_name, num_rows, subject, friendly_name FROM competition_datasets WHERE competition_id = %s", (comp_id,))
@@ -187,8 +189,8 @@ def prompt_editor(comp_id):
         # Get dataset file path
         dataset_path = os.path.join(DATASETS_DIRECTORY, str(comp_id), dataset_filename)
 
-        # Check to see if user has another prompt currently running
-        status, message, result = sql_results_all("SELECT * FROM running_tasks WHERE user_id = %s AND status = 'RUNNING';", (session["user_id"],))
+        # Check to see if user has another prompt queued or running
+        status, message, result = user_has_active_task(session["user_id"])
         if not status:
             flash(f"Error checking for running tasks: {message}", 'error')
             return redirect(url_for('competition_routes.prompt_editor', comp_id=comp_id))
@@ -196,8 +198,11 @@ def prompt_editor(comp_id):
             flash("You already have a prompt running. Please wait for it to finish before submitting another.", 'error')
             return redirect(url_for('competition_routes.prompt_editor', comp_id=comp_id))
         
-        # Test API key before starting
-        success, message = test_gemini_key(api_key=api_key)
+        # Test the API key for the model backend before starting
+        success, message, has_key = check_run_api_key(session["user_id"])
+        if not has_key:
+            flash(message, 'info')
+            return redirect(url_for('account.account_page'))
         if not success:
             flash(f"API Key error: {message}", 'error')
             return redirect(url_for('competition_routes.prompt_editor', comp_id=comp_id))
@@ -217,9 +222,11 @@ def prompt_editor(comp_id):
             'num_rows': num_rows
         }
 
-        # Create a thread and pass the function to it
-        thread = threading.Thread(target=run_prompt, args=(api_key,prompt,email,base_url,user_id,dataset_info,num_rows,comp_id,))
-        thread.start()
+        # Queue the prompt run for the workers
+        status, message, task_uuid = enqueue_prompt(prompt, email, base_url, user_id, dataset_info, num_rows, comp_id)
+        if not status:
+            flash(f"Error queueing prompt: {message}", 'error')
+            return redirect(url_for('competition_routes.prompt_editor', comp_id=comp_id))
         
         # Save their prompt to the session to be displayed later
         full_prompt = append_instructions(prompt=prompt)
@@ -231,24 +238,30 @@ def prompt_editor(comp_id):
 @competition_routes.route('/scoreboard/<comp_id>', methods=['GET'])
 def get_scoreboard(comp_id):
     # Confirm user is in competition
-    status, message, result = sql_results_one("SELECT * FROM competition_participants WHERE competition_id = %s AND user_id = %s", (comp_id, session["user_id"],))
+    status, message, result = is_competition_member(comp_id, session["user_id"])
     if not status:
         return jsonify({'error': message}), 500
     if not result:
         return jsonify({'error': 'User is not in competition'}), 403
     
-    # Get the page and per_page parameters
-    page = request.args.get('page', 1, type=int)
-    per_page = request.args.get('per_page', 10, type=int)
-    start = (page - 1) * per_page
+    # Get the per_page and cursor parameters
+    per_page = get_per_page(request)
+    try:
+        after = decode_cursor(request.args.get('cursor'), 2)
+        if after is not None:
+            after = [decimal.Decimal(str(after[0])), int(after[1])]
+            if not after[0].is_finite():
+                raise ValueError("score is not a number")
+    except (ValueError, TypeError, decimal.InvalidOperation) as e:
+        return jsonify({'error': f"Invalid cursor: {str(e)}"}), 400
 
     # Get the top scores for the competition
-    status, message, scores = sql_results_all("SELECT full_name, highest_fscore, ranking FROM competition_scoreboard_fscore WHERE competition_id = %s ORDER BY highest_fscore DESC LIMIT %s OFFSET %s", (comp_id, per_page, start))
+    status, message, scores, next_after = get_leaderboard_page(comp_id, per_page, after)
     if not status:
         return jsonify({'error': message}), 500
     
     # Get the total number of scores for the competition
-    status, message, total = sql_results_one("SELECT COUNT(*) FROM competition_scoreboard_fscore;")
+    status, message, total = count_leaderboard(comp_id)
     if not status:
         return jsonify({'error': message}), 500
 
@@ -258,7 +271,8 @@ def get_scoreboard(comp_id):
         formatted_score = {
             'name': score[0],
             'score': score[1],
-            'rank': score[2]
+            'rank': score[2],
+            'ci': score[3]
         }
         formatted_scoreboard.append(formatted_score)
     
@@ -266,27 +280,42 @@ def get_scoreboard(comp_id):
     return jsonify({
         'scoreboard': formatted_scoreboard,
         'total': total,
-        'page': page,
+        'next_cursor': encode_cursor(next_after) if next_after else None,
         'per_page': per_page
     })
 
 @competition_routes.route('/registered/', methods=['GET'])
 def get_registered_competitions():
-    # Get the page and per_page parameters
-    page = request.args.get('page', 1, type=int)
-    per_page = request.args.get('per_page', 10, type=int)
-    start = (page - 1) * per_page
+    # Get the per_page and cursor parameters
+    per_page = get_per_page(request)
+    try:
+        after = decode_cursor(request.args.get('cursor'), 2)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
 
-    # Get the registered competition information for the user
-    query = """SELECT competition_id, name, highest_fscore, ranking, start_date, end_date
-    FROM registered_leaderboard_view 
-    WHERE user_id = %s ORDER BY highest_fscore DESC LIMIT %s OFFSET %s"""
-    status, message, scores = sql_results_all(query, (session["user_id"], per_page, start,))
+    # Get the registered competition information for the user, best score first.
+    # Competitions without a score sort last, and the rank is counted only for the rows on the page.
+    order_by = [("COALESCE(competition_leaderboard.highest_fscore, -1)", "DESC"), ("competitions.id", "ASC")]
+    condition, condition_values = ("TRUE", ()) if after is None else keyset_condition(order_by, after)
+    query = f"""SELECT competitions.id, competitions.name, competition_leaderboard.highest_fscore,
+        (SELECT COUNT(*) + 1 FROM competition_leaderboard AS higher
+         WHERE higher.competition_id = competition_leaderboard.competition_id AND higher.highest_fscore > competition_leaderboard.highest_fscore) AS ranking,
+        competitions.start_date, competitions.end_date, COALESCE(competition_leaderboard.highest_fscore, -1) AS sort_score
+    FROM competition_participants
+    INNER JOIN competitions ON competitions.id = competition_participants.competition_id
+    LEFT JOIN competition_leaderboard
+        ON competition_leaderboard.competition_id = competition_participants.competition_id
+        AND competition_leaderboard.user_id = competition_participants.user_id
+    WHERE competition_participants.user_id = %s AND {condition}
+    ORDER BY {order_by_clause(order_by)}
+    LIMIT %s"""
+    status, message, scores = sql_results_all(query, (session["user_id"],) + condition_values + (per_page + 1,))
     if not status:
         return jsonify({'error': message}), 500
+    scores, has_more = split_page(scores, per_page)
     
     # Get the total number of competitions
-    status, message, total = sql_results_one("SELECT COUNT(*) FROM registered_leaderboard_view WHERE user_id = %s;", (session["user_id"],))
+    status, message, total = cached_count("SELECT COUNT(*) FROM competition_participants WHERE user_id = %s;", (session["user_id"],))
     if not status:
         return jsonify({'error': message}), 500
 
@@ -296,8 +325,8 @@ def get_registered_competitions():
         formatted_score = {
             'competition_id': score[0],
             'name': score[1],
-            'score': score[2],
-            'rank': score[3],
+            'score': score[2] if score[2] is not None else 'N/A',
+            'rank': score[3] if score[2] is not None else 'N/A',
             'start_date': str(score[4])[:-9],
             'end_date': str(score[5])[:-9] if score[4] else ""
         }
@@ -307,29 +336,34 @@ def get_registered_competitions():
     return jsonify({
         'competitions': registered_competitions,
         'total': total,
-        'page': page,
+        'next_cursor': encode_cursor([scores[-1][6], scores[-1][0]]) if has_more else None,
         'per_page': per_page
     })
 
 @competition_routes.route('/available/', methods=['GET'])
 def get_available_competitions():
-    # Get the page and per_page parameters
-    page = request.args.get('page', 1, type=int)
-    per_page = request.args.get('per_page', 10, type=int)
-    start = (page - 1) * per_page
+    # Get the per_page and cursor parameters
+    per_page = get_per_page(request)
+    try:
+        after = decode_cursor(request.args.get('cursor'), 1)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
 
     # Get the available competition information
-    query = """SELECT name, start_date, end_date, join_link
+    condition, condition_values = ("TRUE", ()) if after is None else keyset_condition([("competitions.id", "ASC")], after)
+    query = f"""SELECT name, start_date, end_date, join_link, competitions.id
     FROM competitions
     LEFT JOIN competition_settings ON competitions.id = competition_settings.competition_id
-    WHERE public = TRUE
-    LIMIT %s OFFSET %s;"""
-    status, message, scores = sql_results_all(query, (per_page, start,))
+    WHERE public = TRUE AND {condition}
+    ORDER BY competitions.id ASC
+    LIMIT %s;"""
+    status, message, scores = sql_results_all(query, condition_values + (per_page + 1,))
     if not status:
         return jsonify({'error': message}), 500
+    scores, has_more = split_page(scores, per_page)
     
     # Get the total number of competitions
-    status, message, total = sql_results_one("SELECT COUNT(*) FROM competitions LEFT JOIN competition_settings ON competitions.id = competition_settings.competition_id WHERE public = TRUE;")
+    status, message, total = cached_count("SELECT COUNT(*) FROM competitions LEFT JOIN competition_settings ON competitions.id = competition_settings.competition_id WHERE public = TRUE;")
     if not status:
         return jsonify({'error': message}), 500
 
@@ -348,10 +382,7 @@ def get_available_competitions():
     return jsonify({
         'competitions': available_competitions,
         'total': total,
-        'page': page,
+        'next_cursor': encode_cursor([scores[-1][4]]) if has_more else None,
         'per_page': per_page
     })
 
-def load_dataset_mapping():
-    with open('static/datasets/dataset_mapping.json', 'r') as f:
-        return json.load(f)
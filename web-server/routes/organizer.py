@@ -1,28 +1,27 @@
 from flask import Blueprint, render_template, url_for, redirect, jsonify, request, session, flash
 from functools import wraps
 from helper_functions.database import execute_sql, sql_results_one, sql_results_all, execute_many_sql, execute_sql_return_id
+from helper_functions.user_cache import get_user_roles
 
 def organizer_required(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
         flash_message = "You need to be an organizer to access this page."
-        # First check session for user_roles, then check if 'organizer' is in the user_roles list
-        if 'user_roles' not in session:
+        if 'user_id' not in session:
             flash(flash_message, 'error')
             return redirect(url_for('login'))
-        if 'organizer' not in session['user_roles']:
-            # Check the database to see if the user is an organizer
-            status, message, user_roles = sql_results_one("SELECT roles FROM users_and_roles WHERE user_id = %s", (session['user_id'],))
-            # If the query fails, return an error
-            if not status:
-                flash(message, 'error')
-                return redirect(url_for('index'))
-            # If the user is not an organizer, return an error
-            if 'organizer' not in user_roles[0]:
-                flash(flash_message, 'error')
-                return redirect(url_for('index'))
-            # If the user is an organizer, update session to reflect that
-            session["user_roles"] = [role[0] for role in user_roles]
+        # Check the user's current roles, which are cached so this rarely needs the database
+        status, message, user_roles = get_user_roles(session['user_id'])
+        # If the query fails, return an error
+        if not status:
+            flash(message, 'error')
+            return redirect(url_for('index'))
+        # Keep the session up to date with role changes
+        session["user_roles"] = user_roles
+        # If the user is not an organizer, return an error
+        if 'organizer' not in user_roles:
+            flash(flash_message, 'error')
+            return redirect(url_for('index'))
         return f(*args, **kwargs)
     return decorated_function
 
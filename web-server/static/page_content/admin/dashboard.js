@@ -1,11 +1,15 @@
 document.addEventListener('DOMContentLoaded', (event) => {
-    let currentPage = 1;
+    // Cursor for the start of each page visited so far, the first page has none
+    const cursors = [null];
+    let currentPage = 0;
     const perPage = 10;
 
     function fetchUsers(page) {
-        fetch(`/admin/users?page=${page}&per_page=${perPage}`)
+        const cursor = cursors[page] ? `&cursor=${encodeURIComponent(cursors[page])}` : '';
+        fetch(`/admin/users?per_page=${perPage}${cursor}`)
             .then(response => response.json())
             .then(data => {
+                cursors[page + 1] = data.next_cursor;
                 const userTable = document.getElementById('userTable');
                 userTable.innerHTML = '';
                 data.users.forEach(user => {
@@ -35,8 +39,8 @@ document.addEventListener('DOMContentLoaded', (event) => {
                 });
 
                 // Enable/disable pagination buttons
-                document.getElementById('prevPage').parentElement.classList.toggle('disabled', page === 1);
-                document.getElementById('nextPage').parentElement.classList.toggle('disabled', data.users.length < perPage);
+                document.getElementById('prevPage').parentElement.classList.toggle('disabled', page === 0);
+                document.getElementById('nextPage').parentElement.classList.toggle('disabled', !data.next_cursor);
             });
     }
 
@@ -72,7 +76,7 @@ document.addEventListener('DOMContentLoaded', (event) => {
 
     document.getElementById('prevPage').addEventListener('click', function(event) {
         event.preventDefault();
-        if (currentPage > 1) {
+        if (currentPage > 0) {
             currentPage--;
             fetchUsers(currentPage);
         }
@@ -80,8 +84,10 @@ document.addEventListener('DOMContentLoaded', (event) => {
 
     document.getElementById('nextPage').addEventListener('click', function(event) {
         event.preventDefault();
-        currentPage++;
-        fetchUsers(currentPage);
+        if (cursors[currentPage + 1]) {
+            currentPage++;
+            fetchUsers(currentPage);
+        }
     });
 
     document.getElementById('actionSelect').addEventListener('change', function() {
@@ -1,13 +1,17 @@
 const comp_id = document.getElementById('comp_id').value;
 
 document.addEventListener('DOMContentLoaded', (event) => {
-    let currentPage = 1;
+    // Cursor for the start of each page visited so far, the first page has none
+    const cursors = [null];
+    let currentPage = 0;
     const perPage = 10;
 
     function fetchScoreboard(page) {
-        fetch(`/competition/scoreboard/${comp_id}?page=${page}&per_page=${perPage}`)
+        const cursor = cursors[page] ? `&cursor=${encodeURIComponent(cursors[page])}` : '';
+        fetch(`/competition/scoreboard/${comp_id}?per_page=${perPage}${cursor}`)
             .then(response => response.json())
             .then(data => {
+                cursors[page + 1] = data.next_cursor;
                 const scoreboard = document.getElementById('scoreboard');
                 scoreboard.innerHTML = '';
                 data.scoreboard.forEach(score => {
@@ -18,7 +22,8 @@ document.addEventListener('DOMContentLoaded', (event) => {
                     row.appendChild(nameCell);
 
                     const scoreCell = document.createElement('td');
-                    scoreCell.textContent = score.score;
+                    // Show the 95% interval of the score, when the result has one
+                    scoreCell.textContent = score.ci ? `${score.score} (${score.ci[0].toFixed(2)} - ${score.ci[1].toFixed(2)})` : score.score;
                     row.appendChild(scoreCell);
 
                     const rankCell = document.createElement('td');
@@ -29,8 +34,8 @@ document.addEventListener('DOMContentLoaded', (event) => {
                 });
 
                 // Enable/disable pagination buttons
-                document.getElementById('prevPage').parentElement.classList.toggle('disabled', page === 1);
-                document.getElementById('nextPage').parentElement.classList.toggle('disabled', data.scoreboard.length < perPage);
+                document.getElementById('prevPage').parentElement.classList.toggle('disabled', page === 0);
+                document.getElementById('nextPage').parentElement.classList.toggle('disabled', !data.next_cursor);
             });
     }
 
@@ -51,7 +56,7 @@ document.addEventListener('DOMContentLoaded', (event) => {
 
     document.getElementById('prevPage').addEventListener('click', function(event) {
         event.preventDefault();
-        if (currentPage > 1) {
+        if (currentPage > 0) {
             currentPage--;
             fetchScoreboard(currentPage);
         }
@@ -59,8 +64,10 @@ document.addEventListener('DOMContentLoaded', (event) => {
 
     document.getElementById('nextPage').addEventListener('click', function(event) {
         event.preventDefault();
-        currentPage++;
-        fetchScoreboard(currentPage);
+        if (cursors[currentPage + 1]) {
+            currentPage++;
+            fetchScoreboard(currentPage);
+        }
     });
 
     // Initial fetch
@@ -1,197 +1,306 @@
 import csv
-import google.generativeai as genai
 import os
-import uuid
 from helper_functions.email_functions import send_email
-import pandas as pd
-from helper_functions.stats import compute_sheet_stats
-from helper_functions.database import execute_sql, sql_results_one, execute_sql_return_id
+from helper_functions.metrics import MetricsAccumulator
+from helper_functions.bootstrap import bootstrap_intervals
+from helper_functions.database import execute_sql, sql_results_one, execute_sql_return_id, Database
 import xml.etree.ElementTree as ET
-from helper_functions.prompt import append_instructions, get_instructions
+from helper_functions.prompt import append_instructions, get_instructions, get_batch_instructions, append_batch_instructions, split_batch_response
 import json
+import time
+from helper_functions.concurrency import ordered_map
+from helper_functions.rate_limiter import get_rate_limiter, estimate_tokens, RateLimiter
+from helper_functions.response_cache import get_response_cache, ResponseCache
+from helper_functions.checkpoint import save_checkpoint, update_checkpoint, get_checkpoint, delete_checkpoint
+from helper_functions.job_queue import enqueue_task
+from helper_functions.leaderboard import update_leaderboard
+from helper_functions.result_rows import ResultRowWriter
+from helper_functions.model_backend import get_backend, DEFAULT_BACKEND, RateLimitError, AuthError
+from helper_functions.api import invalidate_api_key_check, validate_gemini_key, validate_chatgpt_key
+from helper_functions.dataset_index import get_dataset_index, sample_row_numbers
+from helper_functions.dataset_cache import read_dataset_rows
 
+SCRIPT_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+RESULTS_DIRECTORY = os.path.join(SCRIPT_DIRECTORY, "dynamic", "prompt_results")
 
-def run_prompt(api_key, prompt, email, base_url, user_id, dataset_info, num_rows=300, comp_id=None):
-    og_prompt = prompt
-    instructions = get_instructions()
-    prompt = append_instructions(prompt)
+# Columns of the output csv
+CSV_HEADERS = [
+    "id", "dataset", "text", "subject", "prompt", "label", "response", "confidence_level", "truth_level", "correct", "response_explanation"
+]
+
+# Number of model requests kept in flight per task
+PROMPT_CONCURRENCY = int(os.getenv("PROMPT_CONCURRENCY", 8))
+
+# Number of times a request is retried after a quota error before the row is dropped
+MAX_RATE_LIMIT_RETRIES = 5
+
+# Number of posts sent to the model in one request, 1 disables batching
+PROMPT_BATCH_SIZE = int(os.getenv("PROMPT_BATCH_SIZE", 1))
+
+# Output token budget for each post in a request, and the most a batched request may ask for
+MAX_OUTPUT_TOKENS = 800
+MAX_BATCH_OUTPUT_TOKENS = int(os.getenv("MAX_BATCH_OUTPUT_TOKENS", 8192))
+
+# Number of rows processed between writes to the output csv and checkpoint updates
+CHECKPOINT_INTERVAL = int(os.getenv("CHECKPOINT_INTERVAL", 10))
+
+# How rows are sampled from a dataset: "random" or "stratified" (keeps the share of each label)
+DATASET_SAMPLING = os.getenv("DATASET_SAMPLING", "random")
+
+
+def enqueue_prompt(prompt, email, base_url, user_id, dataset_info, num_rows=300, comp_id=None, backend=None):
+    """
+    Queue a prompt run for the worker processes.
+
+    :return: A tuple containing a boolean indicating success, a message, and the uuid of the task
+    """
     if num_rows < 1:
         print("Too few rows requested, using the default of 300")
         num_rows = 300
-    # Declare main variables
-    script_directory = os.path.dirname(os.path.abspath(__file__))
-    datasets_directory = os.path.join(script_directory, "static", "datasets")
-    in_file = dataset_info["file_path"]
-    uuid_name = str(uuid.uuid4())
-    out_csv_file_name = f"{uuid_name}.csv"
-    out_xlsx_file_name = f"{uuid_name}.xlsx"
-    out_file = os.path.join(script_directory, "dynamic", "prompt_results", out_csv_file_name)
-    csv_download_path = base_url + f"download/{out_csv_file_name}"
-    xlsx_download_path = base_url + f"download/{out_xlsx_file_name}"
-    data = []
-    dataset_name = dataset_info["name"]
-    subject = dataset_info["subject"]
-    i = 0
-
-    # Inserts a new task into the database. (user_id : the variable user_id, uuid : the variable uuid_name, status : "RUNNING")
-    status, message, result = execute_sql_return_id("INSERT INTO running_tasks (user_id, uuid, status) VALUES (%s, %s, 'RUNNING');", (user_id, uuid_name,))
-    if not status or not result:
-        print("ERROR:", message)
-        return None
-    task_id = result
+    run_args = {
+        'prompt': prompt,
+        'email': email,
+        'base_url': base_url,
+        'user_id': user_id,
+        'dataset_info': dataset_info,
+        'num_rows': num_rows,
+        'comp_id': comp_id,
+        # The backend is chosen with MODEL_BACKEND. It is recorded when the run is queued, so a resumed run keeps it.
+        'backend': backend or DEFAULT_BACKEND
+    }
+    return enqueue_task(run_args)
 
-    # Insert task_id into running_task_competition table
-    if comp_id:
-        status, message = execute_sql("INSERT INTO running_task_competition (task_id, competition_id) VALUES (%s, %s);", (task_id, comp_id,))
-        if not status:
-            print("ERROR:", message)
-            mark_task_failed(uuid_name)
-            return None
 
-    # Configure Gemini API
-    genai.configure(api_key=api_key)
-    model = genai.GenerativeModel(model_name='gemini-pro')
+def execute_task(task_id, uuid_name, run_args):
+    """
+    Run a task claimed from the queue, resuming from its checkpoint if it has one.
 
-    # # Pulls data in from csv file and organizes it in a list of dictionaries
-    # with open(in_file, 'r', encoding='utf-8', errors='ignore') as in_csv:
-    #     reader = csv.DictReader(in_csv)
-    #     in_data = list(reader)
-    # Read the CSV file into a pandas DataFrame
-    df = pd.read_csv(in_file, header=0)
+    :param task_id: The id of the task in running_tasks
+    :param uuid_name: The uuid of the task
+    :param run_args: The arguments the task was queued with
+    """
+    status, message, checkpoint = get_checkpoint(task_id)
+    if status:
+        return resume_prompt(task_id, uuid_name)
 
-    # Skip the first row (headers)
-    df = df.iloc[1:]
+    # Get the user's current API key
+    api_key = get_api_key(run_args["user_id"], run_args.get("backend") or DEFAULT_BACKEND)
+    if not api_key:
+        print(f"ERROR: No API key for task {uuid_name}")
+        mark_task_failed(uuid_name)
+        return None
+    return run_prompt(task_id, uuid_name, api_key, run_args)
 
-    # Shuffle the DataFrame
-    df = df.sample(frac=1)
 
-    # If the user requests more rows than are in the dataset, limit the number of rows to the number of rows in the dataset
-    num_rows_df = len(df)
-    if num_rows > num_rows_df:
-        num_rows = num_rows_df
+def run_prompt(task_id, uuid_name, api_key, run_args):
+    # Declare main variables
+    in_file = run_args["dataset_info"]["file_path"]
+    num_rows = run_args["num_rows"]
+    out_file = os.path.join(RESULTS_DIRECTORY, f"{uuid_name}.csv")
 
-    # Grab the first num_rows rows
-    random_rows = df.head(num_rows)
+    sampling = run_args.get("sampling") or DATASET_SAMPLING
+    random_rows = sample_rows(in_file, num_rows, stratified=(sampling == "stratified"))
 
-    # Establish headers
-    headers = [
-        "id", "dataset", "text", "subject", "prompt", "label", "response", "confidence_level", "truth_level", "correct", "response_explanation"
-    ]
+    # Save the sampled row order so the run can be resumed after a restart
+    row_order = [index for index, row in random_rows]
+    status, message = save_checkpoint(task_id, run_args, row_order)
+    if not status:
+        print("ERROR:", message)
+        mark_task_failed(uuid_name)
+        return None
 
     # Write the header row
     with open(out_file, mode="a", newline="", encoding='utf-8') as csv_file:
         csv_writer = csv.writer(csv_file)
-        csv_writer.writerow(headers)
+        csv_writer.writerow(CSV_HEADERS)
 
-    # Loops through every row of data in the csv file
-    num_iters = 0
-    for index, row in random_rows.iterrows():
-        print(str(num_iters) + ":")
-        try:
-            num_iters += 1
-            # Add text to current prompt and strips text of any ";"
-            full_prompt = prompt + row["text"]
-
-            # Interact with Gemini to fill out response, response_explanation, confidence, truthful_level, and correct
-            res = model.generate_content(
-            contents=full_prompt,
-            generation_config={
-            'temperature': 0,
-            'max_output_tokens': 800
-            },
-            safety_settings=[
-            {
-                "category": "HARM_CATEGORY_HARASSMENT",
-                "threshold": "BLOCK_NONE",
-            },
-            {
-                "category": "HARM_CATEGORY_HATE_SPEECH",
-                "threshold": "BLOCK_NONE",
-            },
-            {
-                "category": "HARM_CATEGORY_SEXUALLY_EXPLICIT",
-                "threshold": "BLOCK_NONE",
-            },
-            {
-                "category": "HARM_CATEGORY_DANGEROUS",
-                "threshold": "BLOCK_NONE",
-            },
-            ])
-
-            # Checks if the prompt was blocked
-            if str(res.prompt_feedback).replace("\n", "") == "block_reason: OTHER":
-                print(str(i) + ": Prompt Blocked")
-                continue
+    rows = [(position, index, row) for position, (index, row) in enumerate(random_rows)]
+    return process_rows(task_id, uuid_name, api_key, run_args, rows)
 
-            # Checks for if response is empty
-            if res.parts == []:
-                print(str(i) + ": Response is empty")
-                continue
 
-            # Extract relevant information from the XML content
-            res = res.text
-            root = ET.fromstring(res)
-            answer = root.find('answer').text
-            confidence_level = root.find('confidence_level').text
-            truth_level = root.find('truth_level').text
-            explanation = root.find('explanation').text
-            
-            # Determines if AI was correct or not
-            label = int(row["label"])
-            if label == 0:
-                if str(label) == str(answer):
-                    correct = 1
-                else:
-                    correct = 0
-            else:
-                if str(label) == str(answer):
-                    correct = 1
-                else:
-                    correct = 0
-
-            # Create the new row of data for output csv
-            new_list = []
-            new_list.append(index) # id
-            new_list.append(dataset_name) # dataset
-            new_list.append(row["text"]) # text
-            new_list.append(subject) # subject
-            new_list.append(prompt.replace("\n", "")) # prompt
-            new_list.append(row["label"]) # label
-            new_list.append(answer) # response
-            new_list.append(confidence_level) # confidence_level
-            new_list.append(truth_level) # truth_level
-            new_list.append(correct) # correct
-            new_list.append(explanation) # response_explanation
-
-            data.append(new_list)
-
-            if num_iters % 50 == 0:
-                with open(out_file, mode="a", newline="", encoding='utf-8') as csv_file:
-                    csv_writer = csv.writer(csv_file)
-                    csv_writer.writerows(data)
-                
-                # Clear the data list after writing to the CSV file
-                data = []
+def sample_rows(in_file, num_rows, stratified=False):
+    """
+    Pick num_rows random rows from a dataset, reading only those rows from the file.
 
-        except AttributeError as e:
-            print(f"(server error) Error extracting data from XML: {str(e)} response: {str(res)}")
-            continue
-        except ValueError as e:
-            print(f"(server error) Error extracting data from XML: {str(e)} response: {str(res)}")
-            continue
-        except Exception as e:
-            print(f"(server error) Exception: {str(e)}")
-            continue  # Move on to the next iteration
+    :param in_file: The path of the dataset csv
+    :param num_rows: The number of rows to sample, limited to the number of rows in the dataset
+    :param stratified: If True, keep the share of each label the same as in the dataset
+    :return: A list of (dataset index, row) tuples, in evaluation order
+    """
+    index = get_dataset_index(in_file)
+    row_numbers = sample_row_numbers(index, num_rows, stratified=stratified)
+    return list(zip(row_numbers, read_dataset_rows(in_file, row_numbers)))
+
+
+def resume_prompt(task_id, uuid_name):
+    """
+    Resume a prompt run from its checkpoint, skipping rows that were already processed.
+
+    :param task_id: The id of the task in running_tasks
+    :param uuid_name: The uuid of the task
+    """
+    status, message, checkpoint = get_checkpoint(task_id)
+    if not status:
+        print("ERROR:", message)
+        mark_task_failed(uuid_name)
+        return None
+    run_args = checkpoint["run_args"]
+    row_order = checkpoint["row_order"]
+    rows_completed = checkpoint["rows_completed"]
 
+    # Get the user's current API key
+    api_key = get_api_key(run_args["user_id"], run_args.get("backend") or DEFAULT_BACKEND)
+    if not api_key:
+        print(f"ERROR: No API key for task {uuid_name}")
+        mark_task_failed(uuid_name)
+        return None
 
-    # Write the data to the out_file csv
-    if data:
+    # Rows written after the last checkpoint update are already in the output file,
+    # count them in the run's stats as well
+    out_file = os.path.join(RESULTS_DIRECTORY, f"{uuid_name}.csv")
+    written_ids = set()
+    metrics = MetricsAccumulator()
+    unsaved_rows = []
+    if os.path.exists(out_file):
+        positions = {index: position for position, index in enumerate(row_order)}
+        with open(out_file, mode="r", newline="", encoding='utf-8') as csv_file:
+            reader = csv.reader(csv_file)
+            next(reader, None)
+            for line in reader:
+                written_ids.add(int(line[0]))
+                metrics.add_output_row(line)
+                # Rows past the checkpoint may not have reached results_rows before the restart, store them again
+                position = positions.get(int(line[0]))
+                if position is not None and position >= rows_completed:
+                    unsaved_rows.append((position, line))
+    else:
         with open(out_file, mode="a", newline="", encoding='utf-8') as csv_file:
             csv_writer = csv.writer(csv_file)
-            csv_writer.writerows(data)
+            csv_writer.writerow(CSV_HEADERS)
+
+    # Only the remaining rows of the original sample are read and evaluated
+    remaining = [(position, row_order[position]) for position in range(rows_completed, len(row_order)) if row_order[position] not in written_ids]
+    dataset_rows = read_dataset_rows(run_args["dataset_info"]["file_path"], [index for position, index in remaining])
+    rows = [(position, index, row) for (position, index), row in zip(remaining, dataset_rows)]
+
+    print(f"Resuming task {uuid_name} at row {rows_completed} of {len(row_order)}")
+    return process_rows(task_id, uuid_name, api_key, run_args, rows, metrics=metrics, unsaved_rows=unsaved_rows)
+
+
+def get_api_key(user_id, backend):
+    """
+    Get the API key a user saved for a model backend.
+
+    :param user_id: The id of the user
+    :param backend: The name of the model backend
+    :return: The API key, or None if the user has no key
+    """
+    # The stub backend runs offline and doesn't need a key, each user gets a key of their own so runs stay apart
+    if backend == 'stub':
+        return f"stub-{user_id}"
+    key_table = 'chat_gpt_keys' if backend == 'openai' else 'gemini_keys'
+    status, message, result = sql_results_one(f"SELECT `key` FROM {key_table} WHERE user_id = %s;", (user_id,))
+    if not status:
+        print("ERROR: Unable to get API key:", message)
+        return None
+    if not result or not result[0]:
+        return None
+    return result[0]
+
+
+def check_run_api_key(user_id, backend=None):
+    """
+    Check the key a prompt run will be made with, before queueing it.
+
+    :param user_id: The id of the user
+    :param backend: The name of the model backend, defaults to MODEL_BACKEND
+    :return: A tuple containing a boolean indicating whether the key is usable, a message,
+    and a boolean indicating whether the user has saved a key at all
+    """
+    backend = backend or DEFAULT_BACKEND
+    # The stub backend makes no requests, so there is no key to check
+    if backend == 'stub':
+        return True, "Good", True
+
+    key_name = "OpenAI" if backend == 'openai' else "Gemini"
+    api_key = get_api_key(user_id, backend)
+    if not api_key:
+        return False, f"Please enter a {key_name} key before testing prompts.", False
+
+    if backend == 'openai':
+        status, message = validate_chatgpt_key(api_key)
+    else:
+        status, message = validate_gemini_key(api_key)
+    return status, message, True
+
+
+def process_rows(task_id, uuid_name, api_key, run_args, rows, metrics=None, unsaved_rows=None):
+    """
+    Evaluate the rows of a prompt run, checkpointing progress, then compute stats and save the results.
+
+    :param task_id: The id of the task in running_tasks
+    :param uuid_name: The uuid of the task
+    :param api_key: The API key for the model backend
+    :param run_args: The arguments the run was started with
+    :param rows: A list of (position in row order, dataset index, row) tuples to evaluate
+    :param metrics: The MetricsAccumulator with the rows already written, when resuming
+    :param unsaved_rows: (position, output csv row) tuples already in the csv but possibly not in results_rows, when resuming
+    """
+    og_prompt = run_args["prompt"]
+    email = run_args["email"]
+    base_url = run_args["base_url"]
+    user_id = run_args["user_id"]
+    comp_id = run_args["comp_id"]
+    instructions = get_instructions()
+    prompt = append_instructions(og_prompt)
+    out_csv_file_name = f"{uuid_name}.csv"
+    out_xlsx_file_name = f"{uuid_name}.xlsx"
+    out_file = os.path.join(RESULTS_DIRECTORY, out_csv_file_name)
+    csv_download_path = base_url + f"download/{out_csv_file_name}"
+    xlsx_download_path = base_url + f"download/{out_xlsx_file_name}"
 
-    # Create xlsx with stats
-    stats = compute_sheet_stats(out_csv_file_name, out_xlsx_file_name)
+    # Configure the model backend
+    model = get_backend(run_args.get("backend") or DEFAULT_BACKEND, api_key)
+    if model.rate_limited:
+        limiter = get_rate_limiter(api_key)
+    else:
+        # Offline backends have no quota to respect, so they get a limiter that never waits
+        limiter = RateLimiter(requests_per_minute=10 ** 9, tokens_per_minute=10 ** 12)
+    cache = get_response_cache()
+
+    # Store each row's result in the database, in batches, and count it in the stats
+    metrics = metrics or MetricsAccumulator()
+    row_writer = ResultRowWriter(task_id)
+    for position, output_row in unsaved_rows or []:
+        row_writer.add(position, output_row)
+    def on_row(position, output_row):
+        row_writer.add(position, output_row)
+        metrics.add_output_row(output_row)
+
+    # Record progress and the stats so far so a restart resumes after the last written row.
+    # The checkpoint only moves past rows once they are stored, otherwise a resume would skip rows missing from results_rows.
+    def on_flush(position):
+        status, message = row_writer.flush()
+        if not status:
+            return
+        status, message = update_checkpoint(task_id, position + 1, metrics.stats())
+        if not status:
+            print("ERROR:", message)
+
+    try:
+        evaluate_rows(model, limiter, cache, run_args, rows, out_file, on_flush=on_flush, on_row=on_row)
+    except AuthError as e:
+        # The key was rejected, so every remaining row would fail the same way
+        print(f"API key rejected, stopping task {uuid_name}: {str(e)}")
+        row_writer.flush()
+        mark_task_failed(uuid_name)
+        return None
+    row_writer.flush()
+
+    print(f"Response cache stats: {cache.stats()}")
+
+    # The stats were counted as rows came in. The xlsx is created from the csv when it is first downloaded.
+    stats = metrics.stats()
 
     # Send CSV file as attachment via email
     send_email(email, csv_download_path, xlsx_download_path, stats, prompt)
@@ -203,6 +312,11 @@ def run_prompt(api_key, prompt, email, base_url, user_id, dataset_info, num_rows
         print("ERROR:", message)
         mark_task_failed(uuid_name)
         return None
+
+    # The task is finished, so it no longer needs a checkpoint
+    status, message = delete_checkpoint(task_id)
+    if not status:
+        print("ERROR:", message)
     
     # Insert results into results table
     results_stats = {
@@ -215,6 +329,8 @@ def run_prompt(api_key, prompt, email, base_url, user_id, dataset_info, num_rows
         'recall': float(stats["recall"]),
         'fscore': float(stats["fscore"]),
     }
+    # Intervals for the metrics, so scores that only differ by sampling noise can be told apart
+    results_stats['ci'] = bootstrap_intervals(results_stats['tPos'], results_stats['tNeg'], results_stats['fPos'], results_stats['fNeg']) or {}
     # Convert results_stats to JSON string
     results_stats_json = json.dumps(results_stats)
 
@@ -231,15 +347,92 @@ def run_prompt(api_key, prompt, email, base_url, user_id, dataset_info, num_rows
         return None
     
     # If the competition_id is not None, insert the result_id into the competition_results table
+    # and update the competition leaderboard in the same transaction
     if comp_id:
-        status, message = execute_sql("INSERT INTO result_in_competition (result_id, competition_id) VALUES (%s, %s);", (result_id, comp_id,))
-        if not status:
-            print("ERROR:", message)
-            return None
+        with Database() as db:
+            status, message = db.execute("INSERT INTO result_in_competition (result_id, competition_id) VALUES (%s, %s);", (result_id, comp_id,))
+            if status:
+                status, message = update_leaderboard(db, comp_id, user_id, result_id, results_stats['fscore'])
+            if not status:
+                db.rollback()
+                print("ERROR:", message)
+                return None
 
     return None
 
 
+def evaluate_rows(model, limiter, cache, run_args, rows, out_file, on_flush=None, on_row=None, timings=None):
+    """
+    Evaluate rows concurrently and append the results to the output csv in row order.
+
+    :param model: The model backend
+    :param limiter: The rate limiter for the API key
+    :param cache: The response cache
+    :param run_args: The arguments the run was started with
+    :param rows: A list of (position in row order, dataset index, row) tuples to evaluate
+    :param out_file: The path of the output csv
+    :param on_flush: Called with the position of the last written row after each write to the csv
+    :param on_row: Called with the position and output csv row of each evaluated row, in row order
+    :param timings: Optional dictionary that collects "row_latencies" and "csv_write_seconds"
+    :raises AuthError: If the API key is rejected, the rows written so far stay in the csv
+    """
+    og_prompt = run_args["prompt"]
+    dataset_name = run_args["dataset_info"]["name"]
+    subject = run_args["dataset_info"]["subject"]
+    instructions = get_instructions()
+    data = []
+
+    # Group rows into batches of posts sent in a single request
+    batch_size = max(1, int(run_args.get("batch_size") or PROMPT_BATCH_SIZE))
+    batches = [rows[i:i + batch_size] for i in range(0, len(rows), batch_size)]
+
+    def evaluate(batch):
+        start = time.perf_counter()
+        if len(batch) == 1:
+            position, index, row = batch[0]
+            results = [(position, evaluate_row(model, limiter, cache, og_prompt, instructions, index, row, dataset_name, subject))]
+        else:
+            results = evaluate_batch(model, limiter, cache, og_prompt, instructions, batch, dataset_name, subject)
+        if timings is not None:
+            timings["row_latencies"].extend([time.perf_counter() - start] * len(batch))
+        return results
+
+    def write_data(data):
+        start = time.perf_counter()
+        with open(out_file, mode="a", newline="", encoding='utf-8') as csv_file:
+            csv_writer = csv.writer(csv_file)
+            csv_writer.writerows(data)
+        if timings is not None:
+            timings["csv_write_seconds"] += time.perf_counter() - start
+
+    if timings is not None:
+        timings.setdefault("row_latencies", [])
+        timings.setdefault("csv_write_seconds", 0)
+
+    # Evaluate batches concurrently, keeping results in the sampled order
+    num_iters = 0
+    results = (result for batch_results in ordered_map(evaluate, batches, max_workers=PROMPT_CONCURRENCY) for result in batch_results)
+    try:
+        for position, new_list in results:
+            num_iters += 1
+            if new_list is not None:
+                data.append(new_list)
+                if on_row:
+                    on_row(position, new_list)
+
+            if num_iters % CHECKPOINT_INTERVAL == 0:
+                write_data(data)
+
+                # Clear the data list after writing to the CSV file
+                data = []
+                if on_flush:
+                    on_flush(position)
+    finally:
+        # Write the data to the out_file csv, also when the run is stopped early
+        if data:
+            write_data(data)
+
+
 def mark_task_failed(uuid_name):
     try:
         # Marks as failed in the database running_tasks table.
@@ -251,4 +444,210 @@ def mark_task_failed(uuid_name):
         return None
     except Exception as e:
         print(f"Unable to mark task as failed: {str(e)}")
-        return None
\ No newline at end of file
+        return None
+
+
+def evaluate_row(model, limiter, cache, og_prompt, instructions, index, row, dataset_name, subject):
+    """
+    Query the model for a single dataset row, using the response cache when possible.
+
+    :param model: The model backend
+    :param limiter: The rate limiter for the API key
+    :param cache: The response cache
+    :param og_prompt: The user's prompt, without instructions
+    :param instructions: The formatting instructions appended to the prompt
+    :param index: The index of the row in the dataset
+    :param row: The dataset row
+    :param dataset_name: The name of the dataset
+    :param subject: The subject of the dataset
+    :return: The row to write to the output csv, or None if the row could not be evaluated
+    """
+    res = None
+    try:
+        # Add text to current prompt
+        prompt = append_instructions(og_prompt)
+        full_prompt = prompt + row["text"]
+
+        # Reuse an earlier response to the same prompt and post if there is one
+        cache_key = ResponseCache.make_key(model.model_name, instructions, og_prompt, row["text"])
+        res = cache.get(cache_key)
+        cached = res is not None
+
+        if not cached:
+            # Interact with the model to fill out response, response_explanation, confidence, truthful_level, and correct
+            res = generate_response(model, full_prompt, limiter)
+
+            # Checks if the prompt was blocked or the response is empty
+            if res is None:
+                print(str(index) + ": No response")
+                return None
+
+        # Extract relevant information from the XML content
+        new_list = build_output_row(ET.fromstring(res), index, row, prompt, dataset_name, subject)
+
+        # Only cache responses that parsed correctly
+        if not cached:
+            cache.set(cache_key, res)
+        return new_list
+
+    except AuthError:
+        # A rejected key stops the whole run, not just this row
+        raise
+    except AttributeError as e:
+        print(f"(server error) Error extracting data from XML: {str(e)} response: {str(res)}")
+        return None
+    except ValueError as e:
+        print(f"(server error) Error extracting data from XML: {str(e)} response: {str(res)}")
+        return None
+    except Exception as e:
+        print(f"(server error) Exception: {str(e)}")
+        return None
+
+
+def evaluate_batch(model, limiter, cache, og_prompt, instructions, batch, dataset_name, subject):
+    """
+    Query the model for several dataset rows in a single request.
+    Rows missing from the model's answer are retried one at a time.
+
+    :param model: The model backend
+    :param limiter: The rate limiter for the API key
+    :param cache: The response cache
+    :param og_prompt: The user's prompt, without instructions
+    :param instructions: The formatting instructions for a single post, used for the cache key of answers asked alone
+    :param batch: A list of (position in row order, dataset index, row) tuples
+    :param dataset_name: The name of the dataset
+    :param subject: The subject of the dataset
+    :return: A list of (position, row to write to the output csv or None) tuples, in batch order
+    """
+    prompt = append_instructions(og_prompt)
+    batch_instructions = get_batch_instructions()
+    results = {}
+
+    # Only send posts that aren't already cached, either asked alone or in an earlier batch
+    pending = []
+    for position, index, row in batch:
+        cache_key = ResponseCache.make_key(model.model_name, instructions, og_prompt, row["text"])
+        batch_cache_key = ResponseCache.make_key(model.model_name, batch_instructions, og_prompt, row["text"])
+        for key in (cache_key, batch_cache_key):
+            res = cache.get(key)
+            if res is None:
+                continue
+            try:
+                results[position] = build_output_row(ET.fromstring(res), index, row, prompt, dataset_name, subject)
+                break
+            except (AttributeError, ValueError):
+                pass
+        if position not in results:
+            pending.append((position, index, row, batch_cache_key))
+
+    if len(pending) > 1:
+        res = None
+        try:
+            batch_prompt = append_batch_instructions(og_prompt, [row["text"] for _, _, row, _ in pending])
+            max_output_tokens = min(MAX_OUTPUT_TOKENS * len(pending), MAX_BATCH_OUTPUT_TOKENS)
+            res = generate_response(model, batch_prompt, limiter, max_output_tokens)
+
+            # Blocked or empty responses leave every post to be retried on its own
+            if res is not None:
+                responses = split_batch_response(res)
+                for n, (position, index, row, cache_key) in enumerate(pending, start=1):
+                    if n not in responses:
+                        continue
+                    try:
+                        results[position] = build_output_row(responses[n], index, row, prompt, dataset_name, subject)
+                    except (AttributeError, ValueError):
+                        continue
+                    # The answer was given alongside other posts, so it is cached under the batch instructions,
+                    # where only other batched runs will reuse it
+                    responses[n].attrib.pop("id", None)
+                    cache.set(cache_key, ET.tostring(responses[n], encoding="unicode"))
+        except AuthError:
+            raise
+        except Exception as e:
+            print(f"(server error) Exception in batched request: {str(e)} response: {str(res)}")
+
+    # Retry rows missing from the batched answer one at a time
+    for position, index, row in batch:
+        if results.get(position) is None:
+            results[position] = evaluate_row(model, limiter, cache, og_prompt, instructions, index, row, dataset_name, subject)
+    return [(position, results[position]) for position, _, _ in batch]
+
+
+def build_output_row(root, index, row, prompt, dataset_name, subject):
+    """
+    Build the output csv row from a parsed <response> element.
+
+    :param root: The <response> XML element
+    :param index: The index of the row in the dataset
+    :param row: The dataset row
+    :param prompt: The full prompt, including instructions
+    :param dataset_name: The name of the dataset
+    :param subject: The subject of the dataset
+    :return: The row to write to the output csv
+    """
+    answer = root.find('answer').text
+    confidence_level = root.find('confidence_level').text
+    truth_level = root.find('truth_level').text
+    explanation = root.find('explanation').text
+
+    # Determines if AI was correct or not
+    label = int(row["label"])
+    if str(label) == str(answer):
+        correct = 1
+    else:
+        correct = 0
+
+    # Create the new row of data for output csv
+    new_list = []
+    new_list.append(index) # id
+    new_list.append(dataset_name) # dataset
+    new_list.append(row["text"]) # text
+    new_list.append(subject) # subject
+    new_list.append(prompt.replace("\n", "")) # prompt
+    new_list.append(row["label"]) # label
+    new_list.append(answer) # response
+    new_list.append(confidence_level) # confidence_level
+    new_list.append(truth_level) # truth_level
+    new_list.append(correct) # correct
+    new_list.append(explanation) # response_explanation
+    return new_list
+
+
+def generate_response(model, full_prompt, limiter, max_output_tokens=MAX_OUTPUT_TOKENS):
+    """
+    Send a prompt to the model, pacing it with the rate limiter and retrying on quota errors.
+
+    :param model: The model backend
+    :param full_prompt: The prompt to send
+    :param limiter: The rate limiter for the API key
+    :param max_output_tokens: The maximum number of tokens in the response
+    :return: The response text, or None if the response was blocked or empty
+    """
+    attempt = 0
+    while True:
+        # Requests already queued when the key was rejected fail without calling the model again
+        if model.key_rejected:
+            raise AuthError("The API key was rejected")
+        limiter.acquire(estimate_tokens(full_prompt))
+        try:
+            res = model.generate(full_prompt, max_output_tokens)
+        except RateLimitError:
+            # Quota error, slow down every task using this key and try again
+            limiter.report_throttled()
+            attempt += 1
+            if attempt > MAX_RATE_LIMIT_RETRIES:
+                raise
+            print(f"Rate limited, retrying request (attempt {attempt})")
+            continue
+        except AuthError:
+            # The key was rejected, so the next submission with it has to check it again
+            if model.key_rejected:
+                raise
+            model.key_rejected = True
+            if model.api_key:
+                status, message = invalidate_api_key_check(model.api_key)
+                if not status:
+                    print("ERROR:", message)
+            raise
+        limiter.report_success()
+        return res
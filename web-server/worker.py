@@ -0,0 +1,130 @@
+import multiprocessing
+import os
+import signal
+import sys
+import time
+from dotenv import load_dotenv
+
+# Determine the path to the .env file
+env_path = os.path.join(os.path.dirname(sys.argv[0]), '..', '.env')
+
+# Load .env variables
+load_dotenv(env_path)
+
+from helper_functions.dataset_cache import cache_registered_datasets
+from helper_functions.email_outbox import email_sender_loop, requeue_interrupted_emails
+from helper_functions.bootstrap import backfill_result_intervals
+from helper_functions.fail_running_tasks import fail_running_tasks
+from helper_functions.job_queue import claim_next_task, requeue_interrupted_tasks, acquire_worker_lock, check_worker_lock
+from web_detect import execute_task, mark_task_failed
+
+# Number of prompt runs executed at the same time
+WORKER_PROCESSES = int(os.getenv("WORKER_PROCESSES", 2))
+
+# Seconds to wait before checking an empty queue again
+POLL_INTERVAL = float(os.getenv("WORKER_POLL_INTERVAL", 2))
+
+# Seconds between checks that the worker lock is still held
+LOCK_CHECK_INTERVAL = 60
+
+
+def worker_loop(stop_event):
+    """
+    Claim and run tasks from the queue until a shutdown is requested.
+
+    :param stop_event: Set when the worker should stop after its current task
+    """
+    # Let the parent process decide how to handle shutdown signals
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    while not stop_event.is_set():
+        status, message, task = claim_next_task()
+        if not status:
+            print(f"Error claiming task: {message}")
+            stop_event.wait(POLL_INTERVAL)
+            continue
+        if task is None:
+            stop_event.wait(POLL_INTERVAL)
+            continue
+
+        task_id, uuid_name, run_args = task
+        print(f"Worker {os.getpid()} running task {uuid_name}")
+        try:
+            execute_task(task_id, uuid_name, run_args)
+        except Exception as e:
+            print(f"(server error) Task {uuid_name} failed: {str(e)}")
+            mark_task_failed(uuid_name)
+
+
+def email_sender(stop_event):
+    """
+    Send queued emails until a shutdown is requested.
+
+    :param stop_event: Set when the sender should stop
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    email_sender_loop(stop_event)
+
+
+def main():
+    # Only one worker.py may run, otherwise recovering tasks below would requeue tasks another one is running
+    status, message, lock_conn = acquire_worker_lock()
+    if not status:
+        print(f"Not starting workers: {message}")
+        sys.exit(1)
+
+    # Recover tasks from the last time the workers were stopped
+    fail_running_tasks()
+    status, message = requeue_interrupted_tasks()
+    if not status:
+        print(f"Error requeueing interrupted tasks: {message}")
+    status, message = requeue_interrupted_emails()
+    if not status:
+        print(f"Error requeueing interrupted emails: {message}")
+
+    # Convert registered datasets to their columnar cache before any run needs them
+    cache_registered_datasets()
+
+    # Give results saved before score intervals were computed their intervals
+    status, message = backfill_result_intervals()
+    if not status:
+        print(f"Error adding score intervals to results: {message}")
+
+    stop_event = multiprocessing.Event()
+    workers = [multiprocessing.Process(target=worker_loop, args=(stop_event,)) for _ in range(WORKER_PROCESSES)]
+    # A single process sends all emails, so one SMTP connection is reused
+    workers.append(multiprocessing.Process(target=email_sender, args=(stop_event,)))
+    for worker in workers:
+        worker.start()
+
+    # First signal finishes the current tasks, second signal stops immediately.
+    # Tasks stopped immediately are resumed from their checkpoint on the next start.
+    def shutdown(signum, frame):
+        if stop_event.is_set():
+            print("Stopping workers immediately")
+            for worker in workers:
+                worker.kill()
+            return
+        print("Finishing current tasks before stopping, send the signal again to stop immediately")
+        stop_event.set()
+
+    signal.signal(signal.SIGINT, shutdown)
+    signal.signal(signal.SIGTERM, shutdown)
+
+    last_lock_check = time.monotonic()
+    while any(worker.is_alive() for worker in workers):
+        time.sleep(1)
+        if time.monotonic() - last_lock_check < LOCK_CHECK_INTERVAL:
+            continue
+        last_lock_check = time.monotonic()
+        status, message = check_worker_lock(lock_conn)
+        if not status and not stop_event.is_set():
+            # Without the lock another worker.py could start and requeue these tasks, so finish up and stop
+            print(f"{message}, stopping workers after their current tasks")
+            stop_event.set()
+    lock_conn.close()
+
+
+if __name__ == '__main__':
+    main()